@@ -0,0 +1,151 @@
+# Python standard library imports
+from datetime import timedelta
+
+# Third-party imports
+
+# Local imports
+from db.models import Cluster
+from cluster_lifecycle_manager.models.cluster_model import ClusterModel
+
+
+class ClusterReconciler(object):
+    """
+    Decides how to transition the Cluster rows so that they match what the Cloud Provider reports. The Cloud Provider
+    is listed once per <cloud provider, region> instead of describing every cluster, so monitoring N clusters costs
+    one API call per region (plus pagination).
+    This class only plans the transitions, the caller lists the clusters and applies the plan in bulk.
+    """
+
+    # Only list the clusters created after the oldest Cluster row was launched, with some margin since the Cloud Provider
+    # creates the cluster before the row is saved, and for clock skew.
+    LISTING_MARGIN = timedelta(hours=1)
+
+    # Clusters in these states are reconciled
+    STATES = [Cluster.State.LAUNCHED, Cluster.State.READY, Cluster.State.EXPIRED]
+
+    PROVIDER_STATE_TO_CLUSTER_STATE = {
+        ClusterModel.STATE.INITIALIZING: Cluster.State.LAUNCHED,
+        ClusterModel.STATE.READY: Cluster.State.READY,
+        ClusterModel.STATE.DELETING: Cluster.State.DELETED,
+        ClusterModel.STATE.DELETED: Cluster.State.DELETED
+    }
+
+    # Bulk transitions in the order to apply them. Cluster.State only allows going to DELETED from EXPIRED,
+    # so a cluster that was deleted outside of the CLM takes two steps.
+    TRANSITIONS = [
+        (Cluster.State.LAUNCHED, Cluster.State.READY),
+        (Cluster.State.LAUNCHED, Cluster.State.EXPIRED),
+        (Cluster.State.READY, Cluster.State.EXPIRED),
+        (Cluster.State.EXPIRED, Cluster.State.DELETED)
+    ]
+
+    def __init__(self, absent_grace_secs):
+        """
+        Construct a ClusterReconciler.
+        :param absent_grace_secs: A cluster that the Cloud Provider does not list is only considered deleted once it
+        was launched at least this many seconds ago (int), since a new cluster may not be listed right away.
+        """
+        self.absent_grace_secs = absent_grace_secs
+
+    @classmethod
+    def group_by_location(cls, clusters):
+        """
+        Group the Cluster objects by where they run, skipping the ones that never got an ID from the Cloud Provider.
+        :param clusters: List of Cluster objects
+        :return: Return a dictionary from the 2-tuple <cloud provider (str), region (str)> to a list of Cluster objects
+        """
+        groups = {}
+        for cluster in clusters:
+            if cluster.cluster_id is None:
+                continue
+            groups.setdefault((cluster.cloud_provider, cluster.region), []).append(cluster)
+        return groups
+
+    @classmethod
+    def get_created_after(cls, clusters):
+        """
+        Get the date to list the clusters from so that every one of the given Cluster objects is included.
+        :param clusters: Non-empty list of Cluster objects
+        :return: Return a Python DateTime object (UTC)
+        """
+        return min(cluster.date_launched for cluster in clusters) - cls.LISTING_MARGIN
+
+    @classmethod
+    def find_provider_clusters(cls, provider_clusters, cluster_ids):
+        """
+        Consume the clusters listed by the Cloud Provider lazily, only keeping the ones that are tracked, and stop
+        as soon as all of them were found so that no more pages are requested.
+        :param provider_clusters: Iterable (e.g., generator) of ClusterModel objects
+        :param cluster_ids: List of cluster IDs (str) assigned by the Cloud Provider
+        :return: Return a list of ClusterModel objects
+        """
+        remaining = set(cluster_ids)
+        found = []
+        for provider_cluster in provider_clusters:
+            if provider_cluster.id in remaining:
+                found.append(provider_cluster)
+                remaining.discard(provider_cluster.id)
+                if len(remaining) == 0:
+                    break
+        return found
+
+    @classmethod
+    def get_still_active(cls, clusters, provider_clusters):
+        """
+        Get the EXPIRED Cluster objects that the Cloud Provider still lists as active, e.g., because terminating them
+        failed, so they should be terminated again.
+        :param clusters: List of Cluster objects
+        :param provider_clusters: List of active ClusterModel objects listed by the Cloud Provider
+        :return: Return a list of Cluster objects
+        """
+        active_ids = {provider_cluster.id for provider_cluster in provider_clusters}
+        return [cluster for cluster in clusters if cluster.state == Cluster.State.EXPIRED and cluster.cluster_id in active_ids]
+
+    def get_observed_state(self, cluster, provider_clusters_by_id, now, complete_listing=False):
+        """
+        Get the state that the Cluster should have given what the Cloud Provider reports.
+        :param cluster: Cluster object
+        :param provider_clusters_by_id: Dictionary from the cluster ID (str) to the ClusterModel listed by the Cloud Provider
+        :param now: Python DateTime object
+        :param complete_listing: Boolean indicating whether the listing included every active cluster of the region,
+        see CloudProvider.has_complete_listing(). If False, a cluster missing from it is not known to be deleted.
+        :return: Return one of Cluster.State, or None if unknown.
+        """
+        provider_cluster = provider_clusters_by_id.get(cluster.cluster_id)
+        if provider_cluster is not None:
+            return self.PROVIDER_STATE_TO_CLUSTER_STATE.get(provider_cluster.state)
+
+        # May be on a page that was not listed
+        if not complete_listing:
+            return None
+
+        # Only active clusters are listed, so it is being deleted or already is.
+        if (now - cluster.date_launched).total_seconds() >= self.absent_grace_secs:
+            return Cluster.State.DELETED
+        return None
+
+    def plan(self, clusters, provider_clusters, now, complete_listing=False):
+        """
+        Plan the transitions for the Cluster objects in one <cloud provider, region>.
+        :param clusters: List of Cluster objects in one of STATES
+        :param provider_clusters: List of ClusterModel objects listed by the Cloud Provider in that region
+        :param now: Python DateTime object
+        :param complete_listing: Boolean indicating whether provider_clusters includes every active cluster of the
+        region. Only then are the missing ones marked as deleted.
+        :return: Return a dictionary from the 2-tuple <from state, to state> in TRANSITIONS to a list of Cluster ids (int)
+        """
+        provider_clusters_by_id = {provider_cluster.id: provider_cluster for provider_cluster in provider_clusters}
+
+        plan = {}
+        for cluster in clusters:
+            observed_state = self.get_observed_state(cluster, provider_clusters_by_id, now, complete_listing)
+            if observed_state is None or observed_state == cluster.state:
+                continue
+
+            if cluster.state == Cluster.State.LAUNCHED and observed_state == Cluster.State.READY:
+                plan.setdefault((Cluster.State.LAUNCHED, Cluster.State.READY), []).append(cluster.id)
+            elif observed_state == Cluster.State.DELETED:
+                if cluster.state in [Cluster.State.LAUNCHED, Cluster.State.READY]:
+                    plan.setdefault((cluster.state, Cluster.State.EXPIRED), []).append(cluster.id)
+                plan.setdefault((Cluster.State.EXPIRED, Cluster.State.DELETED), []).append(cluster.id)
+        return plan
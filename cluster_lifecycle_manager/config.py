@@ -10,9 +10,83 @@ class Config(object):
     DEFAULT_TTL_HOURS = 72
     FREE_TRIAL_TTL_HOURS = 168 # 7 days
 
+    # Free trials get a Node of this type in the Cloud Provider's default region
+    FREE_TRIAL_NODE_TYPE = "TODO"
+    FREE_TRIAL_STORAGE_CONFIG = "TODO"
+
+    # Warm pool of idle Nodes launched ahead of time, so that an approved trial gets a READY Node in the same
+    # transaction instead of waiting for one to be provisioned. Map from the 3-tuple
+    # <cloud provider, region, node type> to the number of idle Nodes to keep, e.g.,
+    # {("EMR", "us-east-1", FREE_TRIAL_NODE_TYPE): 2}
+    WARM_POOL_TARGETS = {}
+    # Idle Nodes expire after this many hours and are replaced, so the pool does not keep stale Nodes.
+    WARM_POOL_TTL_HOURS = 24
+
+    # Size the warm pool from a forecast of the trial sign-ups by hour of the week, in which case WARM_POOL_TARGETS
+    # are the minimums. The forecast covers the next WARM_POOL_FORECAST_LEAD_HOURS so that Nodes are ready before
+    # the demand, it weighs the last WARM_POOL_FORECAST_WEEKS weeks with WARM_POOL_FORECAST_ALPHA given to the most
+    # recent one, and it is recomputed every WARM_POOL_FORECAST_SECS. The pool never exceeds MAX_ALLOWED_ACTIVE_NODES.
+    WARM_POOL_FORECAST = False
+    WARM_POOL_FORECAST_LEAD_HOURS = 2
+    WARM_POOL_FORECAST_WEEKS = 8
+    WARM_POOL_FORECAST_ALPHA = 0.3
+    WARM_POOL_FORECAST_SECS = 3600
+
     # Limits on resources
     MAX_ALLOWED_ACTIVE_NODES = 100
     MAX_ALLOWED_ACTIVE_CLUSTERS = 50
     MAX_ACTIVE_FREE_TRIALS_PER_COMPANY = 10
     MAX_ACTIVE_FREE_TRIALS_PER_EMAIL = 5
     MAX_REQUESTS_PER_MIN = 10
+
+    # Close the DB session at the end of every loop so that its identity map does not grow for the life of the
+    # daemon, and every loop reads fresh state from the DB.
+    SESSION_PER_LOOP = True
+
+    # Several CLM workers can run concurrently. Each loop, a worker claims up to this many pending trials and
+    # specs of each type, and owns them until the lease expires, after which another worker can reclaim them.
+    MAX_CLAIMED_PER_LOOP = 50
+    CLAIM_LEASE_SECS = 300
+
+    # Each phase commits once, isolating the failure of any single item in a savepoint,
+    # and also commits after every MAX_BATCH_SIZE items.
+    MAX_BATCH_SIZE = 50
+
+    # Blocking Cloud Provider calls (e.g., creating a cluster) run concurrently on a thread pool of this size,
+    # while all of the DB writes stay on the loop thread.
+    PROVISIONING_MAX_WORKERS = 16
+    # Maximum number of concurrent calls per Cloud Provider, which defaults to PROVISIONING_MAX_WORKERS
+    PROVISIONING_CONCURRENCY_PER_PROVIDER = {
+        "EMR": 8,
+        "HDI": 4
+    }
+    # A Node or Cluster Spec that fails to provision is retried with exponential backoff starting at
+    # PROVISIONING_RETRY_BASE_SECS (picked up by the next full sweep once due), and marked as failed after
+    # PROVISIONING_MAX_ATTEMPTS attempts.
+    PROVISIONING_MAX_ATTEMPTS = 5
+    PROVISIONING_RETRY_BASE_SECS = 60
+    PROVISIONING_RETRY_MAX_SECS = 3600
+    # Opt-in, a new Cluster Spec whose fingerprint matches a READY Cluster with at least CLUSTER_REUSE_MIN_REMAINING_HOURS
+    # left is attached to that Cluster, whose TTL is extended to cover the spec's, instead of creating another one.
+    CLUSTER_REUSE = False
+    CLUSTER_REUSE_MIN_REMAINING_HOURS = 1
+
+    # A Cluster Spec stays in flight while its cluster is being created. Once in flight for longer than this, e.g.,
+    # because the CLM crashed, the cluster is looked up by its idempotency tag and adopted, or else retried.
+    PROVISIONING_IN_FLIGHT_TIMEOUT_SECS = 300
+
+    # The daemon wakes up as soon as the webapp writes a Notification. It polls for them starting every
+    # NOTIFICATION_POLL_MIN_SECS and doubles the interval while idle, up to NOTIFICATION_POLL_MAX_SECS.
+    NOTIFICATION_POLL_MIN_SECS = 0.05
+    NOTIFICATION_POLL_MAX_SECS = 2
+    NOTIFICATION_RETENTION_SECS = 3600
+    # Run every phase at least this often, e.g., to expire resources and pick up any missed Notification.
+    FULL_SWEEP_SECS = 60
+
+    # Rebuild the in-memory expiry scheduler from the DB this often as a safety net.
+    EXPIRY_RECONCILE_SECS = 300
+
+    # Reconcile the Clusters against their Cloud Provider this often.
+    CLUSTER_RECONCILE_SECS = 30
+    # A Cluster that its Cloud Provider does not list is considered deleted once it was launched this long ago.
+    CLUSTER_ABSENT_GRACE_SECS = 600
@@ -0,0 +1,117 @@
+# Python standard library imports
+from datetime import timedelta
+import math
+
+# Third-party imports
+
+# Local imports
+
+
+class DemandForecaster(object):
+    """
+    Forecasts the trial sign-ups per Cloud Provider by hour of the week, so that the warm pool grows ahead of the
+    recurring spikes (e.g., Monday morning) and drains when no sign-ups are expected (e.g., overnight and weekends).
+    The rate of each hour of the week is an exponentially weighted moving average of the number of sign-ups in that
+    hour over the last few weeks, so recent weeks weigh more. The history is read with a single GROUP BY query.
+    """
+
+    HOURS_PER_WEEK = 7 * 24
+
+    def __init__(self, num_weeks, alpha, lead_hours):
+        """
+        Construct a DemandForecaster.
+        :param num_weeks: Number of weeks of history (int)
+        :param alpha: Weight of the most recent week (float) in (0, 1]
+        :param lead_hours: Size the pool for the sign-ups expected over this many hours from now (int), which must
+        cover the time to launch a Node so that it is ready before the demand arrives.
+        """
+        self.num_weeks = num_weeks
+        self.alpha = alpha
+        self.lead_hours = lead_hours
+
+        # Map from the cloud provider (str) to a list of HOURS_PER_WEEK rates (float, sign-ups per hour)
+        self.rates = {}
+
+    @classmethod
+    def get_hour_of_week(cls, date):
+        """
+        :param date: Python DateTime object
+        :return: Return the hour of the week (int) in [0, HOURS_PER_WEEK), starting on Monday at midnight.
+        """
+        return date.weekday() * 24 + date.hour
+
+    def get_since(self, now):
+        """
+        Get the start of the history, aligned to the hour so that every week has exactly one sample per hour of the week.
+        :param now: Python DateTime object
+        :return: Return a Python DateTime object
+        """
+        return now.replace(minute=0, second=0, microsecond=0) - timedelta(weeks=self.num_weeks)
+
+    def fit(self, counts, now):
+        """
+        Recompute the rates from the history.
+        :param counts: Dictionary from the 2-tuple <cloud provider (str), start of the hour (Python DateTime object)>
+        to the number of sign-ups (int) since get_since(now), e.g., from TrialRequest.count_created_by_hour()
+        :param now: Python DateTime object
+        """
+        since = self.get_since(now)
+        week_secs = timedelta(weeks=1).total_seconds()
+
+        # Map from the cloud provider to a list of num_weeks lists, oldest first, of the counts per hour of the week.
+        # Hours without any sign-ups are not returned by the query, so they stay 0.
+        history = {}
+        for ((cloud_provider, hour), count) in counts.items():
+            week = int((hour - since).total_seconds() // week_secs)
+            # Skip the current hour, which is still incomplete
+            if week < 0 or week >= self.num_weeks:
+                continue
+            weeks = history.setdefault(cloud_provider, [[0] * self.HOURS_PER_WEEK for _ in range(self.num_weeks)])
+            weeks[week][self.get_hour_of_week(hour)] += count
+
+        rates = {}
+        for (cloud_provider, weeks) in history.items():
+            slot_rates = [float(count) for count in weeks[0]]
+            for week in weeks[1:]:
+                slot_rates = [self.alpha * count + (1 - self.alpha) * rate for (count, rate) in zip(week, slot_rates)]
+            rates[cloud_provider] = slot_rates
+        self.rates = rates
+
+    def get_expected_arrivals(self, cloud_provider, now):
+        """
+        Get the number of sign-ups expected over the next lead_hours.
+        :param cloud_provider: Cloud Provider name (str)
+        :param now: Python DateTime object
+        :return: Return the expected number of sign-ups (float)
+        """
+        slot_rates = self.rates.get(cloud_provider)
+        if slot_rates is None:
+            return 0.0
+        start = self.get_hour_of_week(now)
+        return sum(slot_rates[(start + i) % self.HOURS_PER_WEEK] for i in range(self.lead_hours))
+
+    def get_targets(self, min_targets, now, capacity):
+        """
+        Get the number of idle Nodes to keep in the warm pool. The expected sign-ups of each Cloud Provider are split
+        evenly across its pools, each pool keeps at least its minimum, and the total is scaled down to the capacity.
+        :param min_targets: Dictionary from the 3-tuple <cloud provider, region, node type> to the minimum number of
+        idle Nodes (int)
+        :param now: Python DateTime object
+        :param capacity: Maximum total number of idle Nodes (int), e.g., the Nodes that can still be launched
+        without exceeding MAX_ALLOWED_ACTIVE_NODES.
+        :return: Return a dictionary from the 3-tuple <cloud provider, region, node type> to the target (int)
+        """
+        keys_by_provider = {}
+        for key in min_targets.keys():
+            keys_by_provider.setdefault(key[0], []).append(key)
+
+        targets = {}
+        for (cloud_provider, keys) in keys_by_provider.items():
+            expected = self.get_expected_arrivals(cloud_provider, now) / len(keys)
+            for key in keys:
+                targets[key] = max(min_targets[key], int(math.floor(expected + 0.5)))
+
+        total = sum(targets.values())
+        if total > capacity:
+            targets = {key: int(target * capacity // total) for (key, target) in targets.items()}
+        return targets
@@ -0,0 +1,97 @@
+# Python standard library imports
+import heapq
+
+# Third-party imports
+
+# Local imports
+
+
+class ExpiryScheduler(object):
+    """
+    In-memory min-heap of resources (e.g., Nodes and Clusters) keyed by their expiry time, so the CLM can find the
+    ones that are due in O(log n) per event instead of rescanning the tables.
+    Rescheduling or cancelling a resource does not remove its old heap entry. Instead, the entry is ignored when it is
+    popped because it no longer matches the resource's current expiry time.
+    The DB remains the source of truth, so the caller should double check the due resources against the DB and
+    periodically rebuild the scheduler from it.
+    """
+
+    def __init__(self):
+        # Heap of 3-tuples <expires_at, kind, id>
+        self._heap = []
+        # Map from <kind, id> to its current expires_at
+        self._expires_at = {}
+
+    def __len__(self):
+        return len(self._expires_at)
+
+    def schedule(self, kind, id, expires_at):
+        """
+        Schedule or reschedule a resource to expire.
+        :param kind: Kind of resource (str), e.g., "node" or "cluster"
+        :param id: Resource ID (int PK)
+        :param expires_at: Python DateTime object. If None, the resource is cancelled.
+        """
+        if expires_at is None:
+            self.cancel(kind, id)
+            return
+
+        key = (kind, id)
+        if self._expires_at.get(key) == expires_at:
+            return
+        self._expires_at[key] = expires_at
+        heapq.heappush(self._heap, (expires_at, kind, id))
+
+    def cancel(self, kind, id):
+        """
+        Stop tracking a resource, e.g., because it is no longer LAUNCHED or READY.
+        :param kind: Kind of resource (str)
+        :param id: Resource ID (int PK)
+        """
+        self._expires_at.pop((kind, id), None)
+
+    def reset(self, kind, schedule):
+        """
+        Replace every resource of this kind with the given schedule, e.g., when reconciling against the DB.
+        :param kind: Kind of resource (str)
+        :param schedule: List of 2-tuples <id (int), expires_at (Python DateTime object)>
+        """
+        self._expires_at = {key: expires_at for (key, expires_at) in self._expires_at.items() if key[0] != kind}
+        self._heap = [(expires_at, k, id) for (expires_at, k, id) in self._heap if k != kind]
+        heapq.heapify(self._heap)
+        for (id, expires_at) in schedule:
+            self.schedule(kind, id, expires_at)
+
+    def _discard_stale(self):
+        """
+        Pop the heap entries that were rescheduled or cancelled until the top one is current.
+        """
+        while len(self._heap) > 0:
+            expires_at, kind, id = self._heap[0]
+            if self._expires_at.get((kind, id)) == expires_at:
+                return
+            heapq.heappop(self._heap)
+
+    def get_next_due(self):
+        """
+        Get the earliest expiry time.
+        :return: Return a Python DateTime object, or None if nothing is scheduled.
+        """
+        self._discard_stale()
+        return self._heap[0][0] if len(self._heap) > 0 else None
+
+    def pop_due(self, now):
+        """
+        Remove and return the resources whose expiry time is <= now.
+        :param now: Python DateTime object
+        :return: Return a dictionary from the kind (str) to a list of resource IDs (int)
+        """
+        due = {}
+        while True:
+            self._discard_stale()
+            if len(self._heap) == 0 or self._heap[0][0] > now:
+                break
+            _expires_at, kind, id = heapq.heappop(self._heap)
+            del self._expires_at[(kind, id)]
+            due.setdefault(kind, []).append(id)
+        return due
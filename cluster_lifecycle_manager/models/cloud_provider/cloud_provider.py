@@ -5,6 +5,7 @@ import re
 
 # Local imports
 from saas.cluster_lifecycle_manager.models.cloud_provider.mapping import CloudProviderMapping
+from saas.cluster_lifecycle_manager.models.cloud_provider.registry import CloudProviderRegistry
 from saas.cluster_lifecycle_manager.models.constants import CLUSTER_TYPE, STACK_VERSION
 
 
@@ -85,6 +86,29 @@ class CloudProvider(object):
         vpc, preferred_az, preferred_subnet = cp_config_clazz.get_network_settings(cluster_spec.region)
         cluster_spec.set_network(vpc, preferred_az, preferred_subnet)
 
+    @classmethod
+    def get_default_region(cls, cloud_provider):
+        """
+        Get the region to use when the request does not ask for one.
+        :param cloud_provider: Cloud Provider name (str)
+        :return: Return the region name (str)
+        """
+        return CloudProviderMapping.NAME_TO_CONFIG_CLASS[cloud_provider].DEFAULT_REGION
+
+    @classmethod
+    def register(cls, cloud_provider, cp_config_clazz, cp_manager_clazz):
+        """
+        Support another Cloud Provider in this process only, e.g., the simulator registers the in-memory FakeManager
+        before building the CLM, so that it is never accepted in production.
+        :param cloud_provider: Cloud Provider name (str)
+        :param cp_config_clazz: Subclass of CloudProviderConfig
+        :param cp_manager_clazz: Subclass of CloudProviderManager
+        """
+        if cloud_provider not in cls.NAME.ALL:
+            cls.NAME.ALL.append(cloud_provider)
+        CloudProviderMapping.NAME_TO_CONFIG_CLASS[cloud_provider] = cp_config_clazz
+        CloudProviderMapping.NAME_TO_MANAGER_CLASS[cloud_provider] = cp_manager_clazz
+
     @classmethod
     def _is_vm_type_supported(cls, cp_config_clazz, vm_type):
         """
@@ -114,9 +138,8 @@ class CloudProvider(object):
         :param cluster_spec: Instance of ClusterSpecModel
         :return: Return a 2-tuple of the form <cluster id, request id>
         """
-        # Dynamically determine which manager we should use
-        cp_manager_clazz = CloudProviderMapping.NAME_TO_MANAGER_CLASS[cluster_spec.cloud_provider]
-        cp_manager = cp_manager_clazz()
+        # Shared manager whose client is bound to that region
+        cp_manager = CloudProviderRegistry.get_manager(cluster_spec.cloud_provider, cluster_spec.region)
         return cp_manager.create_cluster(cluster_spec)
 
     @classmethod
@@ -127,11 +150,49 @@ class CloudProvider(object):
         :param region: Region name (str)
         :return: Return a list of Cluster instances.
         """
-        # Dynamically determine which manager we should use
-        cp_manager_clazz = CloudProviderMapping.NAME_TO_MANAGER_CLASS[cloud_provider]
-        cp_manager = cp_manager_clazz()
+        # Shared manager whose client is bound to that region
+        cp_manager = CloudProviderRegistry.get_manager(cloud_provider, region)
         return cp_manager.list_clusters(region)
 
+    @classmethod
+    def iter_clusters(cls, cloud_provider, region, states=None, created_after=None):
+        """
+        Given a Cloud Provider name and a region, lazily iterate over the clusters, one page at a time.
+        :param cloud_provider: Cloud Provider name (str)
+        :param region: Region name (str)
+        :param states: Optional list of ClusterModel.STATE values (str). If None, only the currently active clusters.
+        :param created_after: Optional Python DateTime object (UTC) to only include clusters created after it.
+        :return: Return a generator of Cluster instances.
+        """
+        # Shared manager whose client is bound to that region
+        cp_manager = CloudProviderRegistry.get_manager(cloud_provider, region)
+        return cp_manager.iter_clusters(region, states, created_after)
+
+    @classmethod
+    def has_complete_listing(cls, cloud_provider):
+        """
+        :param cloud_provider: Cloud Provider name (str)
+        :return: Return True if iter_clusters() lists every matching cluster of the region, so that a cluster it does
+        not list can be assumed to be gone.
+        """
+        cp_manager_clazz = CloudProviderMapping.NAME_TO_MANAGER_CLASS.get(cloud_provider)
+        return cp_manager_clazz is not None and cp_manager_clazz.COMPLETE_LISTING
+
+    @classmethod
+    def find_clusters_by_tag(cls, cloud_provider, region, key, values, created_after=None):
+        """
+        Given a Cloud Provider name and a region, find the clusters whose tag has one of the given values.
+        :param cloud_provider: Cloud Provider name (str)
+        :param region: Region name (str)
+        :param key: Tag key (str)
+        :param values: List of tag values (str)
+        :param created_after: Optional Python DateTime object (UTC) to only include clusters created after it.
+        :return: Return a dictionary from the tag value (str) to the Cluster instance
+        """
+        # Shared manager whose client is bound to that region
+        cp_manager = CloudProviderRegistry.get_manager(cloud_provider, region)
+        return cp_manager.find_clusters_by_tag(region, key, values, created_after)
+
     @classmethod
     def get_cluster_info_by_id(cls, cloud_provider, region, id):
         """
@@ -141,9 +202,8 @@ class CloudProvider(object):
         :param id: Cluster ID (str)
         :return: Return a JSON response that depends on the format used by the Cloud Provider.
         """
-        # Dynamically determine which manager we should use
-        cp_manager_clazz = CloudProviderMapping.NAME_TO_MANAGER_CLASS[cloud_provider]
-        cp_manager = cp_manager_clazz()
+        # Shared manager whose client is bound to that region
+        cp_manager = CloudProviderRegistry.get_manager(cloud_provider, region)
         return cp_manager.get_cluster_info_by_id(region, id)
 
     @classmethod
@@ -155,9 +215,8 @@ class CloudProvider(object):
         :param name: Cluster Name (str)
         :return: Return a JSON response that depends on the format used by the Cloud Provider.
         """
-        # Dynamically determine which manager we should use
-        cp_manager_clazz = CloudProviderMapping.NAME_TO_MANAGER_CLASS[cloud_provider]
-        cp_manager = cp_manager_clazz()
+        # Shared manager whose client is bound to that region
+        cp_manager = CloudProviderRegistry.get_manager(cloud_provider, region)
         return cp_manager.get_cluster_info_by_name(region, name)
 
     @classmethod
@@ -169,9 +228,38 @@ class CloudProvider(object):
         :param id: Cluster ID (str)
         :return: Return the request ID
         """
-        # Dynamically determine which manager we should use
-        cp_manager_clazz = CloudProviderMapping.NAME_TO_MANAGER_CLASS[cloud_provider]
-        cp_manager = cp_manager_clazz()
+        # Shared manager whose client is bound to that region
+        cp_manager = CloudProviderRegistry.get_manager(cloud_provider, region)
 
         # TODO, perhaps check that it is active first.
         return cp_manager.destroy_cluster(region, id)
+
+    @classmethod
+    def destroy_clusters(cls, cloud_provider, region, ids):
+        """
+        Destroy several clusters in the same region with as few calls as the Cloud Provider allows.
+        :param cloud_provider: Cloud Provider name (str)
+        :param region: Region name (str)
+        :param ids: List of Cluster IDs (str)
+        :return: Return a dictionary from each Cluster ID (str) to a 2-tuple <request ID (str) or None,
+        error message (str) or None if it succeeded>
+        """
+        # Shared manager whose client is bound to that region
+        cp_manager = CloudProviderRegistry.get_manager(cloud_provider, region)
+        return cp_manager.destroy_clusters(region, ids)
+
+    @classmethod
+    def get_api_metrics(cls):
+        """
+        Get the metrics of the API calls made to every <Cloud Provider, region> so far, e.g., the time spent waiting
+        for the rate limiter and the number of throttled calls and retries.
+        :return: Return a dictionary from the 2-tuple <Cloud Provider name, region> to a dictionary of metrics
+        """
+        return CloudProviderRegistry.get_metrics()
+
+    @classmethod
+    def close(cls):
+        """
+        Close all of the shared Cloud Provider Managers, e.g., when the CLM shuts down.
+        """
+        CloudProviderRegistry.close()
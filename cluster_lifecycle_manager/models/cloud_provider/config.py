@@ -44,6 +44,13 @@ class CloudProviderConfig(ABC):
 
     SSH_KEY_NAME = "TODO"
 
+    # Client-side rate limit of the API calls per region. Starts at the max rate with a burst of API_BURST calls,
+    # halves on every throttled call down to the min rate, and slowly recovers.
+    API_MAX_RATE_PER_SEC = 5.0
+    API_MIN_RATE_PER_SEC = 0.5
+    API_BURST = 10
+    API_MAX_RETRIES = 5
+
     @classmethod
     def get_network_settings(cls, region):
         """
@@ -93,6 +100,13 @@ class EMRConfig(CloudProviderConfig):
 
     SSH_KEY_NAME = "topcat"
 
+    # Maximum number of cluster IDs in one terminate_job_flows call, kept conservative.
+    MAX_CLUSTERS_PER_TERMINATE = 10
+
+    # EMR throttles the API calls per account and region
+    API_MAX_RATE_PER_SEC = 4.0
+    API_BURST = 8
+
     @classmethod
     def get_network_settings(cls, region):
         """
@@ -165,3 +179,41 @@ class HDIConfig(CloudProviderConfig):
         """
         raise Exception("Unimplemented")
         #return (None, None, None)
+
+
+class FakeConfig(CloudProviderConfig):
+    """
+    In-memory Cloud Provider used by the simulator, see FakeManager.
+    """
+
+    NAME = "FAKE"
+
+    DEFAULT_CLUSTER_TYPE = CLUSTER_TYPE.HADOOP
+    CLUSTER_TYPES = [CLUSTER_TYPE.HADOOP]
+
+    STACK_VERSIONS = ["1.0"]
+
+    VERSIONS = {
+        STACK_VERSION.LATEST.upper(): "1.0",
+        STACK_VERSION.STABLE.upper(): "1.0"
+    }
+
+    DEFAULT_REGION = "fake-region-1"
+    # Mapping from ID to display name
+    SUPPORTED_REGIONS = {"fake-region-1": "Fake Region 1",
+                         "fake-region-2": "Fake Region 2"
+                        }
+
+    # The simulator measures the CLM, not the client-side rate limit, unless FakeManager is configured to throttle.
+    API_MAX_RATE_PER_SEC = 1000.0
+    API_MIN_RATE_PER_SEC = 10.0
+    API_BURST = 1000
+
+    @classmethod
+    def get_network_settings(cls, region):
+        """
+        Given a region, return the VPC, Availability Zone, and Subnet
+        :param region: Region name
+        :return: Return a 3-tuple of <VPC (str), Availability Zone (str), and Subnet (str)> for that region.
+        """
+        return ("fake-vpc", region + "a", "fake-subnet")
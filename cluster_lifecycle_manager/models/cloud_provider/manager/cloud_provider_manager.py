@@ -4,13 +4,67 @@
 from abc import ABC
 
 # Local imports
+from saas.cluster_lifecycle_manager.models.cluster_model import ClusterModel
+from saas.cluster_lifecycle_manager.models.cloud_provider.throttling import is_throttling_error
 
 
 class CloudProviderManager(ABC):
     """
     Represents an interface for all of the Cloud Provider Managers.
+    Each instance is bound to one region and is shared by all threads through the CloudProviderRegistry,
+    so it must be thread-safe.
     """
 
+    # Set to True by the managers whose iter_clusters() follows every page, so that a cluster missing from the listing
+    # is known to be gone instead of maybe being on a page that was never requested.
+    COMPLETE_LISTING = False
+
+    def __init__(self, region=None):
+        """
+        Construct a manager for one region.
+        :param region: Region name (str), or None to use the Cloud Provider's default region.
+        """
+        self.region = region
+        # Function through which every request to the Cloud Provider's API is made, e.g., RateLimitedManager.call_api
+        self._api_caller = None
+
+    def set_api_caller(self, api_caller):
+        """
+        Route every request to the Cloud Provider's API through a function, e.g., to rate limit and retry them.
+        :param api_caller: Function that takes the request's name (str), a function that makes exactly one request,
+        and its arguments, and returns the function's return value.
+        """
+        self._api_caller = api_caller
+
+    def _call_api(self, name, func, *args, **kwargs):
+        """
+        Make one request to the Cloud Provider's API. Subclasses must make every request through this, including
+        each page of a listing, and never call their own public methods through it.
+        :param name: Name (str) of the request, used for logging
+        :param func: Function that makes exactly one request, e.g., the client's method
+        :param args: Positional arguments of the function
+        :param kwargs: Keyword arguments of the function
+        :return: Return the function's return value
+        """
+        if self._api_caller is None:
+            return func(*args, **kwargs)
+        return self._api_caller(name, func, *args, **kwargs)
+
+    @classmethod
+    def _is_throttling_error(cls, err):
+        """
+        :param err: Exception raised by _call_api(), which already retried it if it was throttled
+        :return: Return True if the Cloud Provider is still throttling, in which case the caller must not make more
+        requests to work around it.
+        """
+        return is_throttling_error(err)
+
+    def close(self):
+        """
+        Release any resources, e.g., connections held by the client. The manager must not be used afterwards.
+        """
+        pass
+
     def create_cluster(self, cluster_spec):
         """
         Create a cluster given the ClusterSpecModel.
@@ -27,6 +81,44 @@ class CloudProviderManager(ABC):
         """
         raise Exception("Unimplemented")
 
+    def iter_clusters(self, region, states=None, created_after=None):
+        """
+        Given a region, lazily iterate over the clusters, following the pagination of the Cloud Provider.
+        :param region: Region name (str)
+        :param states: Optional list of ClusterModel.STATE values (str). If None, only the currently active clusters.
+        :param created_after: Optional Python DateTime object (UTC) to only include clusters created after it.
+        :return: Return a generator of Cluster instances.
+        """
+        raise Exception("Unimplemented")
+
+    def find_clusters_by_tag(self, region, key, values, created_after=None):
+        """
+        Find the active clusters whose tag has one of the given values, e.g., to adopt the clusters that were created
+        right before the CLM crashed. Clusters that are being deleted or already are cannot be adopted, so they are
+        skipped. By default, lists the active clusters once, and only describes the ones whose listing does not include
+        their tags, stopping as soon as every value was found. Managers whose Cloud Provider can filter by tag should
+        override this.
+        :param region: Region name (str)
+        :param key: Tag key (str)
+        :param values: List of tag values (str)
+        :param created_after: Optional Python DateTime object (UTC) to only include clusters created after it.
+        :return: Return a dictionary from the tag value (str) to the Cluster instance
+        """
+        remaining = set(values)
+        found = {}
+        if len(remaining) == 0:
+            return found
+
+        for listed in self.iter_clusters(region, None, created_after):
+            cluster = listed if len(listed.get_tags()) > 0 else self.get_cluster_info_by_id(region, listed.id)
+            value = cluster.get_tags().get(key)
+            if value in remaining:
+                found[value] = cluster
+                remaining.discard(value)
+                if len(remaining) == 0:
+                    break
+        return found
+
     def get_cluster_info_by_id(self, region, id):
         """
         Given a region and cluster id, return more information about that cluster.
@@ -53,3 +145,24 @@ class CloudProviderManager(ABC):
         :return: Return a request Id (str)
         """
         raise Exception("Unimplemented")
+
+    def destroy_clusters(self, region, ids):
+        """
+        Destroy several clusters, assuming that they are still active. By default, destroys them one at a time.
+        A throttling error that outlasted the retries is raised instead of being reported for the cluster, since the
+        remaining ones would be throttled too. The clusters that are still active are terminated again by the next
+        reconciliation.
+        :param region: Region name (str)
+        :param ids: List of Cluster IDs (str)
+        :return: Return a dictionary from each Cluster ID (str) to a 2-tuple <request ID (str) or None,
+        error message (str) or None if it succeeded>
+        """
+        results = {}
+        for id in ids:
+            try:
+                results[id] = (self.destroy_cluster(region, id), None)
+            except Exception as err:
+                if self._is_throttling_error(err):
+                    raise
+                results[id] = (None, str(err))
+        return results
@@ -4,6 +4,7 @@ from dateutil.tz import tzlocal
 
 # Third party imports
 import boto3
+from botocore.config import Config as BotoConfig
 
 # Local imports
 from saas.cluster_lifecycle_manager.models.cloud_provider.manager.cloud_provider_manager import CloudProviderManager
@@ -28,6 +29,12 @@ class EMRManager(CloudProviderManager):
 
     CLOUD_PROVIDER_NAME = "EMR"
 
+    # iter_clusters() follows the Marker of every page
+    COMPLETE_LISTING = True
+
+    # Maximum number of values of a tag filter in one get_resources call
+    MAX_TAG_VALUES_PER_FILTER = 20
+
     class STATE:
         STARTING = "STARTING"
         BOOTSTRAPPING = "BOOTSTRAPPING"
@@ -52,10 +59,33 @@ class EMRManager(CloudProviderManager):
         STATE.TERMINATED_WITH_ERRORS: ClusterModel.STATE.DELETED
     }
 
-    def __init__(self):
-        self.client = boto3.client("emr", region_name=EMRConfig.DEFAULT_REGION)
+    def __init__(self, region=None):
+        """
+        Construct an EMRManager whose client is bound to the region. Creating a client is expensive, so get the
+        shared instance from the CloudProviderRegistry instead.
+        :param region: Region name (str), or None to use EMRConfig.DEFAULT_REGION
+        """
+        super().__init__(region if region is not None else EMRConfig.DEFAULT_REGION)
+        # The default boto3 session is not thread-safe, but a client is, so it is shared by all threads.
+        session = boto3.session.Session()
+        # The RateLimitedManager is the only retry layer, so that every request takes a token and every throttle
+        # reaches its AIMD right away, instead of botocore retrying it internally first.
+        boto_config = BotoConfig(retries={"max_attempts": 0})
+        self.client = session.client("emr", region_name=self.region, config=boto_config)
+        # ListClusters cannot filter by tag, but the Resource Groups Tagging API can
+        self.tagging_client = session.client("resourcegroupstaggingapi", region_name=self.region, config=boto_config)
         self.logger = Utils.get_logger("EMRManager")
 
+    def close(self):
+        """
+        Close the connections of both clients.
+        """
+        for client in [self.client, self.tagging_client]:
+            # Only available in newer versions of botocore
+            close = getattr(client, "close", None)
+            if close is not None:
+                close()
+
     @staticmethod
     def _get_applications(cluster_spec):
         """
@@ -172,8 +202,7 @@ class EMRManager(CloudProviderManager):
             "Tags": tags_list
         }
 
-        # TODO, this also needs to use the client specific to that region.
-        response = self.client.run_job_flow(**kwargs)
+        response = self._call_api("run_job_flow", self.client.run_job_flow, **kwargs)
         '''
         {'JobFlowId': 'j-1UYMQJJE7KJD8', 
         'ClusterArn': 'arn:aws:elasticmapreduce:us-east-1:217619106665:cluster/j-1UYMQJJE7KJD8', 
@@ -202,45 +231,102 @@ class EMRManager(CloudProviderManager):
         :param region: Region name (str)
         :return: Return a list of Cluster instances.
         """
+        return list(self.iter_clusters(region))
 
+    def iter_clusters(self, region, states=None, created_after=None):
+        """
+        Given a region, lazily iterate over the clusters, requesting the next page only when needed.
+        :param region: Region name (str)
+        :param states: Optional list of ClusterModel.STATE values (str) to filter on. If None, only the currently
+        active clusters, i.e., INITIALIZING and READY.
+        :param created_after: Optional Python DateTime object (UTC) to only include clusters created after it,
+        which is filtered by EMR.
+        :return: Return a generator of Cluster instances.
+        """
         # https://docs.aws.amazon.com/emr/latest/APIReference/API_ListClusters.html
-        # TODO, this is currently ignoring the region. since it assumes the client
-        # was setup to use it already.
-
-        response = self.client.list_clusters(ClusterStates=(self.STATE.INIT_STATES + self.STATE.READY_STATES))
-
-        # List of dicts
-        '''
-        {
-        'Id': 'j-3AY581YLLQP2D', 
-        'Name': 'test_cluster_1', 
-        'Status': {
-          'State': 'WAITING', 
-          'StateChangeReason': {
-            'Message': 'Cluster ready to run steps.'
-          },
-          'Timeline': {
-            'CreationDateTime': datetime.datetime(2020, 2, 19, 15, 14, 40, 944000, tzinfo=tzlocal()), 
-            'ReadyDateTime': datetime.datetime(2020, 2, 19, 15, 19, 1, 943000, tzinfo=tzlocal())
-          }
-        }, 
-        'NormalizedInstanceHours': 32, 
-        'ClusterArn': 'arn:aws:elasticmapreduce:us-east-1:217619106665:cluster/j-3AY581YLLQP2D'
-        }
-        '''
-        raw_data = response["Clusters"]
-
-        clusters = []
-        for elem in raw_data:
-            internal_state = elem["Status"]["State"]
-            cluster_state = self.INTERNAL_STATE_TO_CLUSTER_STATE[internal_state]
-            date_created = Utils.safe_get(elem, ["Status", "Timeline", "CreationDateTime"], None)
-            date_ready = Utils.safe_get(elem, ["Status", "Timeline", "ReadyDateTime"], None)
-
-            cluster = ClusterModel(self.CLOUD_PROVIDER_NAME, elem["Id"], elem["Name"], cluster_state, internal_state,
-                              date_created, date_ready)
-            clusters.append(cluster)
-        return clusters
+        # The client is bound to this manager's region, which the CloudProviderRegistry picked based on the region.
+        if states is None:
+            states = [ClusterModel.STATE.INITIALIZING, ClusterModel.STATE.READY]
+        internal_states = [internal_state for (internal_state, cluster_state) in self.INTERNAL_STATE_TO_CLUSTER_STATE.items()
+                           if cluster_state in states]
+
+        kwargs = {"ClusterStates": internal_states}
+        if created_after is not None:
+            kwargs["CreatedAfter"] = created_after
+
+        while True:
+            response = self._call_api("list_clusters", self.client.list_clusters, **kwargs)
+
+            # List of dicts
+            '''
+            {
+            'Id': 'j-3AY581YLLQP2D', 
+            'Name': 'test_cluster_1', 
+            'Status': {
+              'State': 'WAITING', 
+              'StateChangeReason': {
+                'Message': 'Cluster ready to run steps.'
+              },
+              'Timeline': {
+                'CreationDateTime': datetime.datetime(2020, 2, 19, 15, 14, 40, 944000, tzinfo=tzlocal()), 
+                'ReadyDateTime': datetime.datetime(2020, 2, 19, 15, 19, 1, 943000, tzinfo=tzlocal())
+              }
+            }, 
+            'NormalizedInstanceHours': 32, 
+            'ClusterArn': 'arn:aws:elasticmapreduce:us-east-1:217619106665:cluster/j-3AY581YLLQP2D'
+            }
+            '''
+            for elem in response.get("Clusters", []):
+                internal_state = elem["Status"]["State"]
+                cluster_state = self.INTERNAL_STATE_TO_CLUSTER_STATE[internal_state]
+                date_created = Utils.safe_get(elem, ["Status", "Timeline", "CreationDateTime"], None)
+                date_ready = Utils.safe_get(elem, ["Status", "Timeline", "ReadyDateTime"], None)
+
+                yield ClusterModel(self.CLOUD_PROVIDER_NAME, elem["Id"], elem["Name"], cluster_state, internal_state,
+                                   date_created, date_ready)
+
+            # Present only if there are more pages
+            marker = response.get("Marker")
+            if marker is None:
+                break
+            kwargs["Marker"] = marker
+
+    def find_clusters_by_tag(self, region, key, values, created_after=None):
+        """
+        Find the active clusters whose tag has one of the given values with a single scan of the Resource Groups Tagging
+        API filtered by the tag, which requires the tag:GetResources permission, and then describe only the matches.
+        :param region: Region name (str)
+        :param key: Tag key (str)
+        :param values: List of tag values (str)
+        :param created_after: Not needed, since the scan only returns the tagged clusters.
+        :return: Return a dictionary from the tag value (str) to the Cluster instance
+        """
+        # Map from the cluster ID (str) to the tag value (str)
+        tagged = {}
+        for i in range(0, len(values), self.MAX_TAG_VALUES_PER_FILTER):
+            kwargs = {"TagFilters": [{"Key": key, "Values": values[i:i + self.MAX_TAG_VALUES_PER_FILTER]}],
+                      "ResourceTypeFilters": ["elasticmapreduce:cluster"]}
+            while True:
+                response = self._call_api("get_resources", self.tagging_client.get_resources, **kwargs)
+                for elem in response.get("ResourceTagMappingList", []):
+                    # E.g., arn:aws:elasticmapreduce:us-east-1:217619106665:cluster/j-1UYMQJJE7KJD8
+                    cluster_id = elem["ResourceARN"].split("/")[-1]
+                    for tag in elem.get("Tags", []):
+                        if tag["Key"] == key:
+                            tagged[cluster_id] = tag["Value"]
+
+                # Empty on the last page
+                token = response.get("PaginationToken")
+                if not token:
+                    break
+                kwargs["PaginationToken"] = token
+
+        found = {}
+        for (cluster_id, value) in tagged.items():
+            cluster = self.get_cluster_info_by_id(region, cluster_id)
+            if cluster.state in [ClusterModel.STATE.INITIALIZING, ClusterModel.STATE.READY]:
+                found[value] = cluster
+        return found
 
     def get_cluster_info_by_id(self, region, id):
         """
@@ -249,7 +335,7 @@ class EMRManager(CloudProviderManager):
         :param id: Cluster ID (str)
         :return: Return a Cluster instance
         """
-        response = self.client.describe_cluster(ClusterId=id)
+        response = self._call_api("describe_cluster", self.client.describe_cluster, ClusterId=id)
 
         '''
         {
@@ -318,12 +404,12 @@ class EMRManager(CloudProviderManager):
         cluster = ClusterModel(self.CLOUD_PROVIDER_NAME, cluster_info["Id"], cluster_info["Name"], cluster_state, internal_state, date_created, date_ready)
 
         props_dict = {}
-        public_dns_name = Utils.safe_get(cluster_info, ["Status", "MasterPublicDnsName"], None)
+        public_dns_name = Utils.safe_get(cluster_info, ["MasterPublicDnsName"], None)
         if public_dns_name is not None:
             props_dict["dns_name"] = public_dns_name
 
         tags_dict = {}
-        raw_tags = Utils.safe_get(cluster_info, ["Status", "Tags"], None)
+        raw_tags = Utils.safe_get(cluster_info, ["Tags"], None)
         if raw_tags is not None:
             for elem in raw_tags:
                 tags_dict[elem["Key"]] = elem["Value"]
@@ -349,7 +435,7 @@ class EMRManager(CloudProviderManager):
         :return: Return the request ID (str) to track this.
         """
         # Status will eventually transition to Terminated
-        response = self.client.terminate_job_flows(JobFlowIds=[id])
+        response = self._call_api("terminate_job_flows", self.client.terminate_job_flows, JobFlowIds=[id])
         '''
         {
         'ResponseMetadata': {
@@ -366,3 +452,43 @@ class EMRManager(CloudProviderManager):
         }
         '''
         return response["ResponseMetadata"]["RequestId"]
+
+    def destroy_clusters(self, region, ids):
+        """
+        Destroy several clusters with one terminate_job_flows call per chunk of EMRConfig.MAX_CLUSTERS_PER_TERMINATE IDs.
+        EMR rejects the whole call if any ID is invalid, so a chunk that fails validation is retried one ID at a time
+        to report the error of each ID. A throttling error that outlasted the retries is raised instead, since
+        splitting the chunk would only add more calls while EMR is throttling.
+        :param region: Region name (str)
+        :param ids: List of Cluster IDs (str)
+        :return: Return a dictionary from each Cluster ID (str) to a 2-tuple <request ID (str) or None,
+        error message (str) or None if it succeeded>
+        """
+        results = {}
+        chunk_size = EMRConfig.MAX_CLUSTERS_PER_TERMINATE
+        for i in range(0, len(ids), chunk_size):
+            chunk = ids[i:i + chunk_size]
+            try:
+                response = self._call_api("terminate_job_flows", self.client.terminate_job_flows, JobFlowIds=chunk)
+                request_id = Utils.safe_get(response, ["ResponseMetadata", "RequestId"], None)
+                for id in chunk:
+                    results[id] = (request_id, None)
+            except Exception as err:
+                if self._is_throttling_error(err):
+                    raise
+                if len(chunk) == 1:
+                    results[chunk[0]] = (None, str(err))
+                    continue
+
+                self.logger.warning("Unable to terminate clusters {}, will try one at a time. Error: {}".format(chunk, err))
+                for id in chunk:
+                    try:
+                        results[id] = (self.destroy_cluster(region, id), None)
+                    except Exception as single_err:
+                        if self._is_throttling_error(single_err):
+                            raise
+                        results[id] = (None, str(single_err))
+
+        self.logger.info("Terminated {} of {} clusters".format(len([r for r in results.values() if r[1] is None]), len(ids)))
+        return results
+
@@ -0,0 +1,281 @@
+# Python Standard Library imports
+from datetime import datetime, timedelta
+import itertools
+import random
+import threading
+import time
+
+# Third party imports
+
+# Local imports
+from saas.cluster_lifecycle_manager.models.cloud_provider.manager.cloud_provider_manager import CloudProviderManager
+from saas.cluster_lifecycle_manager.models.cloud_provider.config import FakeConfig
+from saas.cluster_lifecycle_manager.models.cluster_model import ClusterModel
+from saas.cluster_lifecycle_manager.utils import Utils
+
+
+class FakeThrottlingError(Exception):
+    """
+    Raised by FakeManager to simulate throttling, with the same shape as a botocore ClientError so that the
+    RateLimitedManager retries it.
+    """
+
+    def __init__(self, operation):
+        super().__init__("Rate exceeded calling {}".format(operation))
+        self.response = {"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}
+
+
+class FakeManager(CloudProviderManager):
+    """
+    In-memory Cloud Provider used by the simulator to run the CLM without any cloud account.
+    Every call sleeps for the configured latency, and may fail or be throttled at random with a seeded generator so that
+    a simulation is reproducible. A cluster is INITIALIZING until ready_secs after it was created, and DELETING until
+    delete_secs after it was destroyed, according to the injected clock.
+    The state is kept at the class level and shared by every region's instance, so the simulator can configure it and
+    read it back. Call configure() before the CLM makes its first call.
+    """
+
+    CLOUD_PROVIDER_NAME = "FAKE"
+
+    # iter_clusters() follows the marker of every page
+    COMPLETE_LISTING = True
+
+    # Number of clusters returned by each request of a listing
+    PAGE_SIZE = 20
+
+    _lock = threading.Lock()
+
+    # Map from the region (str) to a dictionary from the cluster ID (str) to a dictionary with the cluster's attributes
+    _clusters = {}
+    _ids = itertools.count(1)
+    _random = random.Random(0)
+
+    latency_secs = 0.0
+    failure_rate = 0.0
+    throttle_rate = 0.0
+    lost_response_rate = 0.0
+    ready_secs = 300
+    delete_secs = 60
+    utcnow = staticmethod(datetime.utcnow)
+
+    def __init__(self, region=None):
+        """
+        Construct a FakeManager for the region.
+        :param region: Region name (str), or None to use FakeConfig.DEFAULT_REGION
+        """
+        super().__init__(region if region is not None else FakeConfig.DEFAULT_REGION)
+        self.logger = Utils.get_logger("FakeManager")
+
+    @classmethod
+    def configure(cls, seed=0, latency_secs=0.0, failure_rate=0.0, throttle_rate=0.0, lost_response_rate=0.0,
+                  ready_secs=300, delete_secs=60, utcnow=None):
+        """
+        Forget every cluster and change the behavior of the fake Cloud Provider.
+        :param seed: Seed (int) of the random failures and throttling
+        :param latency_secs: Number of seconds (float) that every call takes, in real time
+        :param failure_rate: Probability (float) that a call fails with an error that is not retried
+        :param throttle_rate: Probability (float) that a call is throttled
+        :param lost_response_rate: Probability (float) that creating a cluster succeeds but the response is lost, so the
+        caller gets an error anyway, e.g., a timeout.
+        :param ready_secs: Number of seconds (int) from creating a cluster until it is READY
+        :param delete_secs: Number of seconds (int) from destroying a cluster until it is DELETED
+        :param utcnow: Function that returns the current time as a Python DateTime object (UTC), or None for the
+        system clock.
+        """
+        with cls._lock:
+            cls._clusters = {}
+            cls._ids = itertools.count(1)
+            cls._random = random.Random(seed)
+            cls.latency_secs = latency_secs
+            cls.failure_rate = failure_rate
+            cls.throttle_rate = throttle_rate
+            cls.lost_response_rate = lost_response_rate
+            cls.ready_secs = ready_secs
+            cls.delete_secs = delete_secs
+            cls.utcnow = staticmethod(utcnow if utcnow is not None else datetime.utcnow)
+
+    @classmethod
+    def get_num_clusters(cls):
+        """
+        Count the clusters in every region by state.
+        :return: Return a dictionary from the ClusterModel.STATE (str) to the number of clusters (int)
+        """
+        now = cls.utcnow()
+        counts = {}
+        with cls._lock:
+            for clusters in cls._clusters.values():
+                for cluster in clusters.values():
+                    state = cls._get_state(cluster, now)
+                    counts[state] = counts.get(state, 0) + 1
+        return counts
+
+    @classmethod
+    def _get_state(cls, cluster, now):
+        """
+        :param cluster: Dictionary with the cluster's attributes
+        :param now: Python DateTime object
+        :return: Return the ClusterModel.STATE (str) of the cluster at that time
+        """
+        if cluster["date_destroyed"] is not None:
+            if now >= cluster["date_destroyed"] + timedelta(seconds=cls.delete_secs):
+                return ClusterModel.STATE.DELETED
+            return ClusterModel.STATE.DELETING
+        if now >= cluster["date_ready"]:
+            return ClusterModel.STATE.READY
+        return ClusterModel.STATE.INITIALIZING
+
+    def _to_cluster_model(self, cluster, now):
+        """
+        :param cluster: Dictionary with the cluster's attributes
+        :param now: Python DateTime object
+        :return: Return a ClusterModel object
+        """
+        state = self._get_state(cluster, now)
+        date_ready = cluster["date_ready"] if now >= cluster["date_ready"] else None
+        model = ClusterModel(self.CLOUD_PROVIDER_NAME, cluster["id"], cluster["name"], state, state,
+                             cluster["date_created"], date_ready)
+        model.set_tags(dict(cluster["tags"]))
+        model.set_props({"dns_name": "{}.{}.fake".format(cluster["id"], self.region)})
+        return model
+
+    def _request(self, operation, func, *args):
+        """
+        Make one request to the fake API through _call_api(), which sleeps for the latency, then fails or is throttled
+        at random, and otherwise applies the function.
+        :param operation: Name of the request (str)
+        :param func: Function that applies the request
+        :param args: Arguments of the function
+        :return: Return the function's return value
+        """
+        def request():
+            if self.latency_secs > 0:
+                time.sleep(self.latency_secs)
+
+            with self._lock:
+                value = self._random.random()
+            if value < self.throttle_rate:
+                raise FakeThrottlingError(operation)
+            if value < self.throttle_rate + self.failure_rate:
+                raise Exception("Simulated failure calling {}".format(operation))
+            return func(*args)
+
+        return self._call_api(operation, request)
+
+    def create_cluster(self, cluster_spec):
+        """
+        Create a cluster given the ClusterSpecModel.
+        :param cluster_spec: Instance of ClusterSpecModel
+        :return: Return a 2-tuple of the form <cluster id, request id>
+        """
+        return self._request("create_cluster", self._create_cluster, cluster_spec)
+
+    def _create_cluster(self, cluster_spec):
+        now = self.utcnow()
+        tags = dict(cluster_spec.tags) if cluster_spec.tags is not None else {}
+        tags["Name"] = cluster_spec.cluster_name
+        tags["Owner"] = cluster_spec.user
+        with self._lock:
+            cluster_id = "fake-{}".format(next(self._ids))
+            self._clusters.setdefault(self.region, {})[cluster_id] = {
+                "id": cluster_id,
+                "name": cluster_spec.cluster_name,
+                "tags": tags,
+                "date_created": now,
+                "date_ready": now + timedelta(seconds=self.ready_secs),
+                "date_destroyed": None
+            }
+            lost = self._random.random() < self.lost_response_rate
+
+        if lost:
+            raise Exception("Simulated timeout after creating cluster {}".format(cluster_id))
+        return cluster_id, "request-{}".format(cluster_id)
+
+    def list_clusters(self, region):
+        """
+        Given a region, list all currently active clusters.
+        :param region: Region name (str)
+        :return: Return a list of Cluster instances.
+        """
+        return list(self.iter_clusters(region))
+
+    def iter_clusters(self, region, states=None, created_after=None):
+        """
+        Given a region, lazily iterate over the clusters in the order they were created, one page per request.
+        :param region: Region name (str)
+        :param states: Optional list of ClusterModel.STATE values (str) to filter on. If None, only the currently
+        active clusters, i.e., INITIALIZING and READY.
+        :param created_after: Optional Python DateTime object (UTC) to only include clusters created after it.
+        :return: Return a generator of Cluster instances.
+        """
+        if states is None:
+            states = [ClusterModel.STATE.INITIALIZING, ClusterModel.STATE.READY]
+
+        marker = 0
+        while marker is not None:
+            (page, marker) = self._request("list_clusters", self._list_page, states, created_after, marker)
+            for cluster in page:
+                yield cluster
+
+    def _list_page(self, states, created_after, marker):
+        """
+        :param states: List of ClusterModel.STATE values (str) to filter on
+        :param created_after: Optional Python DateTime object (UTC)
+        :param marker: Index (int) of the first cluster to consider
+        :return: Return a 2-tuple of <list of Cluster instances, marker of the next page or None if this is the last>
+        """
+        now = self.utcnow()
+        with self._lock:
+            clusters = list(self._clusters.get(self.region, {}).values())
+
+        page = []
+        while marker < len(clusters) and len(page) < self.PAGE_SIZE:
+            cluster = clusters[marker]
+            marker += 1
+            if created_after is not None and cluster["date_created"] <= created_after:
+                continue
+            if self._get_state(cluster, now) in states:
+                page.append(self._to_cluster_model(cluster, now))
+        return page, (marker if marker < len(clusters) else None)
+
+    def get_cluster_info_by_id(self, region, id):
+        """
+        Given a region and cluster id, return more information about that cluster.
+        :param region: Region name (str)
+        :param id: Cluster ID (str)
+        :return: Return a Cluster instance
+        """
+        return self._request("describe_cluster", self._describe_cluster, id)
+
+    def _describe_cluster(self, id):
+        with self._lock:
+            cluster = self._clusters.get(self.region, {}).get(id)
+        if cluster is None:
+            raise Exception("Cluster {} does not exist in region {}".format(id, self.region))
+        return self._to_cluster_model(cluster, self.utcnow())
+
+    def get_cluster_info_by_name(self, region, name):
+        """
+        Given a region and cluster name, return more information about that cluster.
+        :param region: Region name (str)
+        :param name: Cluster Name (str)
+        :return: Return a Cluster instance
+        """
+        raise Exception("Not supported by the fake Cloud Provider since it only uses an ID instead of a name")
+
+    def destroy_cluster(self, region, id):
+        """
+        Destroy a cluster, assuming that it is still active.
+        :param region: Region name (str)
+        :param id: Cluster ID (str)
+        :return: Return the request ID (str) to track this.
+        """
+        return self._request("terminate_cluster", self._terminate_cluster, id)
+
+    def _terminate_cluster(self, id):
+        with self._lock:
+            cluster = self._clusters.get(self.region, {}).get(id)
+            if cluster is None:
+                raise Exception("Cluster {} does not exist in region {}".format(id, self.region))
+            if cluster["date_destroyed"] is None:
+                cluster["date_destroyed"] = self.utcnow()
+        return "request-destroy-{}".format(id)
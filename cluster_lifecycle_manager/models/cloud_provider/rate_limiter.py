@@ -0,0 +1,208 @@
+# Python standard library imports
+import threading
+import random
+import time
+import logging
+
+# Third-party imports
+
+# Local imports
+from saas.cluster_lifecycle_manager.models.cloud_provider.throttling import is_throttling_error
+
+
+logger = logging.getLogger("RateLimiter")
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket that allows up to capacity calls in a burst and then rate calls per second.
+    A caller that finds the bucket empty reserves the next token and sleeps until it is available, so concurrent callers
+    are served in order at the sustainable rate instead of all retrying at once.
+    The clock and sleep functions can be injected to test it without waiting.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        """
+        Construct a TokenBucket that starts full.
+        :param rate: Number of tokens added per second (float)
+        :param capacity: Maximum number of tokens (int)
+        :param clock: Function that returns the current time in seconds (float)
+        :param sleep: Function that sleeps for the given number of seconds
+        """
+        self.rate = float(rate)
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = float(capacity)
+        self._last_refill = clock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def set_rate(self, rate):
+        """
+        Change the rate, keeping the tokens accumulated so far.
+        :param rate: Number of tokens added per second (float)
+        """
+        with self._lock:
+            self._refill(self._clock())
+            self.rate = float(rate)
+
+    def adjust_rate(self, func):
+        """
+        Change the rate based on the current one in a single step, so that concurrent callers do not lose each
+        other's changes.
+        :param func: Function that takes the current rate (float) and returns the new rate (float)
+        :return: Return the new rate (float)
+        """
+        with self._lock:
+            self._refill(self._clock())
+            self.rate = float(func(self.rate))
+            return self.rate
+
+    def acquire(self):
+        """
+        Take one token, sleeping until it is available.
+        :return: Return the number of seconds spent waiting (float)
+        """
+        with self._lock:
+            self._refill(self._clock())
+            self._tokens -= 1
+            wait_secs = 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+        if wait_secs > 0:
+            self._sleep(wait_secs)
+        return wait_secs
+
+
+class RateLimiterMetrics(object):
+    """
+    Thread-safe counters of the calls made through a RateLimitedManager.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.num_calls = 0
+        self.num_throttled = 0
+        self.num_retries = 0
+        self.num_failures = 0
+        self.wait_secs = 0.0
+
+    def add(self, **kwargs):
+        """
+        Increment the counters by the given amounts, e.g., add(num_calls=1, wait_secs=0.2)
+        """
+        with self._lock:
+            for (name, value) in kwargs.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def to_dict(self):
+        """
+        :return: Return a dictionary from the metric name (str) to its value.
+        """
+        with self._lock:
+            return {"num_calls": self.num_calls, "num_throttled": self.num_throttled, "num_retries": self.num_retries,
+                    "num_failures": self.num_failures, "wait_secs": round(self.wait_secs, 3)}
+
+
+class RateLimitedManager(object):
+    """
+    Wraps a CloudProviderManager so that every request it makes to the Cloud Provider's API (e.g., each page of a
+    listing, or each describe of a multi-step lookup) takes a token from the bucket of its <Cloud Provider, region>
+    and is retried when the Cloud Provider throttles it. The manager sends its requests through call_api(), which this
+    installs with set_api_caller(), so composite methods are limited one request at a time and a throttled request
+    only retries itself instead of the whole method.
+    The rate adapts with additive-increase/multiplicative-decrease: every throttled call halves it (down to min_rate),
+    and every successful call increases it a little (up to max_rate), so a burst converges on the maximum sustainable rate.
+    """
+
+    def __init__(self, manager, bucket, min_rate, max_rate, max_retries=5, base_backoff_secs=0.5,
+                 max_backoff_secs=20.0, rate_increase=0.05, rate_decrease_factor=0.5,
+                 sleep=time.sleep, rand=random.random):
+        """
+        Construct a RateLimitedManager.
+        :param manager: Instance of a CloudProviderManager, whose requests are routed through this from now on
+        :param bucket: TokenBucket shared by all of the calls to that <Cloud Provider, region>
+        :param min_rate: Lowest rate (calls per second) to back off to (float)
+        :param max_rate: Highest rate (calls per second) to recover to (float)
+        :param max_retries: Number of times to retry a throttled call before raising the error (int)
+        :param base_backoff_secs: Backoff of the first retry, which doubles on every retry (float)
+        :param max_backoff_secs: Maximum backoff of any retry (float)
+        :param rate_increase: Calls per second added to the rate after every successful call (float)
+        :param rate_decrease_factor: Multiply the rate by this after every throttled call (float)
+        :param sleep: Function that sleeps for the given number of seconds
+        :param rand: Function that returns a random float in [0, 1) for the jitter
+        """
+        self.manager = manager
+        self.bucket = bucket
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_retries = max_retries
+        self.base_backoff_secs = base_backoff_secs
+        self.max_backoff_secs = max_backoff_secs
+        self.rate_increase = rate_increase
+        self.rate_decrease_factor = rate_decrease_factor
+        self.metrics = RateLimiterMetrics()
+        self._sleep = sleep
+        self._rand = rand
+        manager.set_api_caller(self.call_api)
+
+    def _get_backoff_secs(self, attempt):
+        """
+        Full jitter exponential backoff.
+        :param attempt: Number of attempts that were throttled so far (int)
+        :return: Return the number of seconds to sleep (float)
+        """
+        return self._rand() * min(self.max_backoff_secs, self.base_backoff_secs * (2 ** (attempt - 1)))
+
+    def _on_success(self):
+        if self.bucket.rate < self.max_rate:
+            self.bucket.adjust_rate(lambda rate: min(self.max_rate, rate + self.rate_increase))
+
+    def _on_throttled(self):
+        self.bucket.adjust_rate(lambda rate: max(self.min_rate, rate * self.rate_decrease_factor))
+
+    def call_api(self, name, func, *args, **kwargs):
+        """
+        Make one request to the Cloud Provider once a token is available, retrying while it is throttled.
+        :param name: Name (str) of the request, used for logging
+        :param func: Function that makes exactly one request, e.g., the boto3 client's method
+        :param args: Positional arguments of the function
+        :param kwargs: Keyword arguments of the function
+        :return: Return the function's return value
+        """
+        attempt = 0
+        while True:
+            wait_secs = self.bucket.acquire()
+            self.metrics.add(num_calls=1, wait_secs=wait_secs)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as err:
+                if not is_throttling_error(err):
+                    self.metrics.add(num_failures=1)
+                    raise
+
+                attempt += 1
+                self._on_throttled()
+                self.metrics.add(num_throttled=1)
+                if attempt > self.max_retries:
+                    self.metrics.add(num_failures=1)
+                    raise
+
+                backoff_secs = self._get_backoff_secs(attempt)
+                logger.warning("Throttled calling {}, retry {} of {} in {:.2f} secs at {:.2f} calls/sec. Error: {}".
+                               format(name, attempt, self.max_retries, backoff_secs, self.bucket.rate, err))
+                self.metrics.add(num_retries=1, wait_secs=backoff_secs)
+                self._sleep(backoff_secs)
+                continue
+
+            self._on_success()
+            return result
+
+    def __getattr__(self, name):
+        """
+        Pass everything through to the manager, whose requests are rate limited by call_api().
+        """
+        return getattr(self.manager, name)
@@ -0,0 +1,76 @@
+# Python Standard Library imports
+import threading
+import logging
+
+# Third-party imports
+
+# Local imports
+from saas.cluster_lifecycle_manager.models.cloud_provider.mapping import CloudProviderMapping
+from saas.cluster_lifecycle_manager.models.cloud_provider.rate_limiter import TokenBucket, RateLimitedManager
+
+
+logger = logging.getLogger("CloudProviderRegistry")
+
+
+class CloudProviderRegistry(object):
+    """
+    Thread-safe cache of the Cloud Provider Managers keyed by <Cloud Provider name, region>, so that each manager
+    and its client (which is expensive to create) is created lazily once and then shared by every call to that region.
+    Each manager is wrapped in a RateLimitedManager with its own token bucket, since Cloud Providers throttle per region.
+    """
+    _lock = threading.Lock()
+
+    # Map from the 2-tuple <Cloud Provider name, region> to the manager instance
+    _managers = {}
+
+    @classmethod
+    def get_manager(cls, cloud_provider, region=None):
+        """
+        Get the manager for the Cloud Provider and region, creating it if needed.
+        :param cloud_provider: Cloud Provider name (str)
+        :param region: Region name (str), or None to use the Cloud Provider's default region.
+        :return: Return an instance of a CloudProviderManager wrapped in a RateLimitedManager
+        """
+        if region is None:
+            region = CloudProviderMapping.NAME_TO_CONFIG_CLASS[cloud_provider].DEFAULT_REGION
+
+        key = (cloud_provider, region)
+        manager = cls._managers.get(key)
+        if manager is None:
+            with cls._lock:
+                # Another thread may have created it while waiting for the lock
+                manager = cls._managers.get(key)
+                if manager is None:
+                    # Dynamically determine which manager we should use
+                    cp_manager_clazz = CloudProviderMapping.NAME_TO_MANAGER_CLASS[cloud_provider]
+                    cp_config_clazz = CloudProviderMapping.NAME_TO_CONFIG_CLASS[cloud_provider]
+                    bucket = TokenBucket(cp_config_clazz.API_MAX_RATE_PER_SEC, cp_config_clazz.API_BURST)
+                    manager = RateLimitedManager(cp_manager_clazz(region), bucket, cp_config_clazz.API_MIN_RATE_PER_SEC,
+                                                 cp_config_clazz.API_MAX_RATE_PER_SEC, cp_config_clazz.API_MAX_RETRIES)
+                    cls._managers[key] = manager
+        return manager
+
+    @classmethod
+    def get_metrics(cls):
+        """
+        Get the rate limiter metrics of every manager.
+        :return: Return a dictionary from the 2-tuple <Cloud Provider name, region> to a dictionary of metrics
+        """
+        with cls._lock:
+            managers = list(cls._managers.items())
+        return {key: manager.metrics.to_dict() for (key, manager) in managers}
+
+    @classmethod
+    def close(cls):
+        """
+        Close and forget all of the managers. The next call to get_manager will create a new one.
+        """
+        with cls._lock:
+            managers = list(cls._managers.items())
+            cls._managers = {}
+
+        for (key, manager) in managers:
+            try:
+                manager.close()
+            except Exception as err:
+                logger.warning("Unable to close the manager for {}. Error: {}".format(key, err))
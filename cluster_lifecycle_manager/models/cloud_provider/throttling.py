@@ -0,0 +1,24 @@
+# Python standard library imports
+
+# Third-party imports
+
+# Local imports
+
+
+# Error codes returned by AWS and Azure when throttling
+THROTTLING_ERROR_CODES = {"Throttling", "ThrottlingException", "ThrottledException", "RequestLimitExceeded",
+                          "TooManyRequestsException", "TooManyRequests", "RequestThrottled"}
+
+
+def is_throttling_error(err):
+    """
+    Determine if the exception means that the Cloud Provider throttled the call.
+    :param err: Exception, e.g., a botocore ClientError
+    :return: Return True if it was throttled.
+    """
+    response = getattr(err, "response", None)
+    if isinstance(response, dict):
+        code = response.get("Error", {}).get("Code")
+        if code in THROTTLING_ERROR_CODES:
+            return True
+    return "Throttl" in str(err) or "Rate exceeded" in str(err)
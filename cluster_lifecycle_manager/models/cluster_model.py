@@ -42,6 +42,12 @@ class ClusterModel(object):
     def set_props(self, props_dict):
         self._props_dict = props_dict
 
+    def get_tags(self):
+        return self._tags_dict
+
+    def get_props(self):
+        return self._props_dict
+
     def __repr__(self):
         """
         Return machine-readable representation.
@@ -1,5 +1,7 @@
 # Python standard library imports
 import re
+import json
+import hashlib
 
 # Third-party imports
 
@@ -11,6 +13,10 @@ class ClusterSpecModel(object):
 
     ALLOWED_TAG_REGEX  = re.compile(r"[a-zA-Z0-9\s_\.:/=+\\-\\\\]+", re.IGNORECASE)
 
+    # Tag whose value identifies the ClusterSpec that created the cluster, so that a cluster created right before
+    # the CLM crashed can be found and adopted instead of being created again.
+    IDEMPOTENCY_TAG_KEY = "ClmIdempotencyToken"
+
     def __init__(self, cloud_provider, cluster_name, cluster_type, stack_version, user, region=None,
                  head_node_type=None, num_head_nodes=1, worker_node_type=None, num_worker_nodes=1,
                  services=None, root_volume_size_gb=10, master_volume_size_gb=20, worker_volume_size_gb=20, tags=None):
@@ -69,6 +75,30 @@ class ClusterSpecModel(object):
         # We will typically always add the cluster name and the owner anyways later on.
         self.tags = tags if tags is not None else {}
 
+    def get_fingerprint(self):
+        """
+        Get a canonical fingerprint of the cluster's shape once the ClusterSpecModel has been resolved by one of the
+        CloudProviders, so that identical requests can share a cluster. It ignores who asked for it, its name and tags.
+        :return: Return the hex SHA-256 (str) of 64 characters
+        """
+        canonical = {
+            "cloud_provider": self.cloud_provider,
+            "region": self.region,
+            "cluster_type": self.cluster_type.upper() if self.cluster_type is not None else None,
+            "stack_version": self._effective_stack_version,
+            "head_node_type": self.head_node_type,
+            "num_head_nodes": self.num_head_nodes,
+            "worker_node_type": self.worker_node_type,
+            "num_worker_nodes": self.num_worker_nodes,
+            "services": sorted([name.lower(), version] for (name, version) in self.services),
+            "root_volume_size_gb": self.root_volume_size_gb,
+            "master_volume_size_gb": self.master_volume_size_gb,
+            "worker_volume_size_gb": self.worker_volume_size_gb,
+            "subnet": self._subnet
+        }
+        data = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
     def set_network(self, vpc, network_region, subnet):
         """
         Set the network settings like the VPC, network region, and the subnet.
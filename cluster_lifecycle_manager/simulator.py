@@ -0,0 +1,276 @@
+# Python standard library imports
+import sys
+import os
+import argparse
+import csv
+import logging
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Third-party imports
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+
+# Local imports
+from db.models import DBRunner, Base, TrialRequest, Node, ClusterSpec, Cluster, Notification
+from db import clock
+from cluster_lifecycle_manager.config import Config as CLMConfig
+from cluster_lifecycle_manager.models.cloud_provider.cloud_provider import CloudProvider
+from cluster_lifecycle_manager.models.cloud_provider.config import FakeConfig
+from cluster_lifecycle_manager.models.cloud_provider.manager.fake_manager import FakeManager
+from cluster_lifecycle_manager.models.constants import CLUSTER_TYPE, STACK_VERSION
+from cluster_lifecycle_manager.unravel_clm import ClusterLifecycleManager
+from cluster_lifecycle_manager.utils import Utils
+
+
+class Simulator(object):
+    """
+    Runs the CLM against the fake Cloud Provider, a FakeClock, and an SQLite DB, replaying a workload of trial requests
+    and Cluster Specs as the webapp would submit them. Simulated time only moves when the CLM is idle, or by as long as
+    each loop really took, so hours of traffic replay in seconds and the results are reproducible for a given seed,
+    except for the loop times themselves.
+    Reports the loop-time percentiles (in real seconds) and the throughput, e.g., to compare a change to the CLM
+    before and after on the same workload.
+    """
+
+    # Monday at midnight, so that the hour of the week of the simulated sign-ups is predictable
+    START = datetime(2020, 3, 2)
+
+    logger = Utils.get_logger("Simulator")
+
+    class Kind:
+        TRIAL = "trial"
+        CLUSTER = "cluster"
+
+        ALL = [TRIAL, CLUSTER]
+
+    def __init__(self, db_url, workload, duration_secs, idle_step_secs):
+        """
+        Construct a Simulator. Call FakeManager.configure() first.
+        :param db_url: SQLAlchemy URL of an SQLite DB (str)
+        :param workload: List of 2-tuples <offset in secs from the start (float), one of Kind (str)> sorted by offset
+        :param duration_secs: Stop after this many simulated seconds (float)
+        :param idle_step_secs: Advance the clock by this many seconds (float) when the CLM is idle, like its poll interval
+        """
+        self.workload = workload
+        self.duration_secs = duration_secs
+        self.idle_step_secs = idle_step_secs
+
+        # Only the simulator supports the fake Cloud Provider, and it must be registered before the CLM is built
+        CloudProvider.register(FakeConfig.NAME, FakeConfig, FakeManager)
+
+        self.clock = clock.FakeClock(self.START)
+        clock.set_clock(self.clock)
+
+        self.session, self.engine = DBRunner.setup_session(db_url)
+        Base.metadata.create_all(self.engine)
+
+        self.clm = ClusterLifecycleManager(None)
+        self.clm.session, self.clm.engine = self.session, self.engine
+        self.region = CloudProvider.get_default_region(FakeConfig.NAME)
+
+        # Number of seconds (float) that each loop with work took
+        self.loop_secs = []
+        self.num_steps = 0
+        self.real_secs = 0.0
+
+    @classmethod
+    def generate_workload(cls, num_trials, num_clusters, duration_secs, seed):
+        """
+        Generate a synthetic workload whose requests arrive uniformly at random, i.e., a Poisson process.
+        :param num_trials: Number of trial requests (int)
+        :param num_clusters: Number of Cluster Specs (int)
+        :param duration_secs: The requests arrive within this many seconds (float)
+        :param seed: Seed (int) of the arrival times
+        :return: Return a list of 2-tuples <offset in secs (float), one of Kind (str)> sorted by offset
+        """
+        rand = random.Random(seed)
+        workload = [(rand.uniform(0, duration_secs), cls.Kind.TRIAL) for _ in range(num_trials)]
+        workload += [(rand.uniform(0, duration_secs), cls.Kind.CLUSTER) for _ in range(num_clusters)]
+        return sorted(workload)
+
+    @classmethod
+    def read_workload(cls, path):
+        """
+        Read a recorded workload, e.g., exported from the trial_request and cluster_spec tables.
+        :param path: Path (str) to a CSV file whose rows are <offset in secs from the start, one of Kind>,
+        with an optional header.
+        :return: Return a list of 2-tuples <offset in secs (float), one of Kind (str)> sorted by offset
+        """
+        workload = []
+        with open(path) as f:
+            for row in csv.reader(f):
+                if len(row) < 2 or row[0].strip().startswith("#"):
+                    continue
+                try:
+                    offset = float(row[0])
+                except ValueError:
+                    # Header
+                    continue
+                kind = row[1].strip().lower()
+                if kind not in cls.Kind.ALL:
+                    raise Exception("Workload kind {} must be one of {}".format(kind, ", ".join(cls.Kind.ALL)))
+                workload.append((offset, kind))
+        return sorted(workload)
+
+    def _submit(self, i, kind):
+        """
+        Insert the request with its Notification in one transaction, like the webapp.
+        :param i: Index (int) of the request in the workload, which makes its names unique
+        :param kind: One of Kind (str)
+        """
+        if kind == self.Kind.TRIAL:
+            trial = TrialRequest.create_if_not_exists("Sim", "User {}".format(i), "sim{}@example.com".format(i), "Engineer",
+                                                      "Company {}".format(i), "127.0.0.1", FakeConfig.NAME, False)
+            trial.save()
+            Notification.create(Notification.Topic.TRIAL_REQUEST, trial.id).save()
+        else:
+            spec = ClusterSpec.create_if_not_exists("sim-cluster-{}".format(i), FakeConfig.NAME, self.region, "simulator",
+                                                    1, "DEFAULT", 2, "DEFAULT", None, STACK_VERSION.LATEST, CLUSTER_TYPE.DEFAULT,
+                                                    None, None, "hadoop,spark", None, False, False, False, False,
+                                                    None, CLMConfig.DEFAULT_TTL_HOURS, None)
+            spec.save()
+            Notification.create(Notification.Topic.CLUSTER_SPEC, spec.id).save()
+        self.session.commit()
+
+    def run(self):
+        """
+        Replay the workload until duration_secs of simulated time have passed.
+        """
+        end = self.START + timedelta(seconds=self.duration_secs)
+        next_event = 0
+        dirty = set()
+        real_start = time.monotonic()
+        while self.clock.utcnow() < end:
+            elapsed_secs = (self.clock.utcnow() - self.START).total_seconds()
+            while next_event < len(self.workload) and self.workload[next_event][0] <= elapsed_secs:
+                self._submit(next_event, self.workload[next_event][1])
+                next_event += 1
+
+            dirty, duration = self.clm.step(dirty)
+            self.num_steps += 1
+            if duration is not None:
+                self.loop_secs.append(duration)
+                self.clock.advance(duration)
+
+            if len(dirty) == 0:
+                step_secs = self.idle_step_secs
+                if next_event < len(self.workload):
+                    # Wake up for the next request, but never stand still
+                    step_secs = max(0.001, min(step_secs, self.workload[next_event][0] - elapsed_secs))
+                self.clock.advance(step_secs)
+        self.real_secs = time.monotonic() - real_start
+        self.session.commit()
+
+    @classmethod
+    def get_percentile(cls, values, percentile):
+        """
+        :param values: Sorted list of numbers
+        :param percentile: Percentile (float) in [0, 100]
+        :return: Return the nearest-rank percentile, or None if there are no values.
+        """
+        if len(values) == 0:
+            return None
+        rank = max(1, int(round(percentile / 100.0 * len(values) + 0.5)))
+        return values[min(rank, len(values)) - 1]
+
+    def get_report(self):
+        """
+        :return: Return a dictionary with the results of the simulation
+        """
+        loop_secs = sorted(self.loop_secs)
+        sim_hours = self.duration_secs / 3600.0
+        trials = TrialRequest.count_by_state()
+        clusters = Cluster.count_by_state()
+        num_decided = sum(count for (state, count) in trials.items() if state != TrialRequest.State.PENDING)
+        num_launched = sum(clusters.values())
+
+        return {
+            "num_steps": self.num_steps,
+            "num_loops": len(loop_secs),
+            "loop_secs": {"p50": self.get_percentile(loop_secs, 50), "p90": self.get_percentile(loop_secs, 90),
+                          "p99": self.get_percentile(loop_secs, 99), "max": loop_secs[-1] if len(loop_secs) > 0 else None},
+            "real_secs": round(self.real_secs, 3),
+            "trials_per_sim_hour": round(num_decided / sim_hours, 2),
+            "clusters_per_sim_hour": round(num_launched / sim_hours, 2),
+            "trials_per_real_sec": round(num_decided / self.real_secs, 2) if self.real_secs > 0 else None,
+            "trial_requests": trials,
+            "nodes": Node.count_by_state(),
+            "cluster_specs": ClusterSpec.count_by_state(),
+            "clusters": clusters,
+            "provider_clusters": FakeManager.get_num_clusters(),
+            "api_metrics": CloudProvider.get_api_metrics()
+        }
+
+    def close(self):
+        self.clm._cleanup()
+        self.session.close()
+        clock.set_clock(clock.Clock())
+
+
+if __name__ == "__main__":
+    """
+    Replay a synthetic or recorded workload against the CLM without any cloud account or MySQL, e.g.,
+    python simulator.py --trials 500 --clusters 50 --hours 4 --latency-ms 200 --failure-rate 0.05
+    """
+    parser = argparse.ArgumentParser(description="Cluster Lifecycle Manager simulator")
+    parser.add_argument("--trials", type=int, default=100, help="Number of synthetic trial requests")
+    parser.add_argument("--clusters", type=int, default=10, help="Number of synthetic Cluster Specs")
+    parser.add_argument("--workload", default=None, help="CSV of a recorded workload <offset secs, trial|cluster>, "
+                                                         "instead of a synthetic one")
+    parser.add_argument("--hours", type=float, default=1.0, help="Simulated hours to run for")
+    parser.add_argument("--idle-step-secs", type=float, default=CLMConfig.NOTIFICATION_POLL_MAX_SECS,
+                        help="Simulated seconds to skip while the CLM is idle")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Real latency of every Cloud Provider call")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Probability that a Cloud Provider call fails")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Probability that a Cloud Provider call is throttled")
+    parser.add_argument("--lost-response-rate", type=float, default=0.0,
+                        help="Probability that a cluster is created but the response is lost")
+    parser.add_argument("--ready-secs", type=int, default=300, help="Simulated seconds for a cluster to be READY")
+    parser.add_argument("--delete-secs", type=int, default=60, help="Simulated seconds for a cluster to be DELETED")
+    parser.add_argument("--ttl-hours", type=int, default=None, help="Override the TTL of the trials and clusters")
+    parser.add_argument("--lift-limits", action="store_true", help="Do not deny any trial request")
+    parser.add_argument("--db-url", default=None, help="SQLite URL, which defaults to a new temporary file")
+    parser.add_argument("--verbose", action="store_true", help="Log every loop of the CLM")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        ClusterLifecycleManager.logger.setLevel(logging.WARNING)
+    if args.lift_limits:
+        CLMConfig.MAX_ALLOWED_ACTIVE_NODES = CLMConfig.MAX_ALLOWED_ACTIVE_CLUSTERS = sys.maxsize
+        CLMConfig.MAX_ACTIVE_FREE_TRIALS_PER_COMPANY = CLMConfig.MAX_ACTIVE_FREE_TRIALS_PER_EMAIL = sys.maxsize
+        CLMConfig.MAX_REQUESTS_PER_MIN = sys.maxsize
+    if args.ttl_hours is not None:
+        CLMConfig.FREE_TRIAL_TTL_HOURS = CLMConfig.DEFAULT_TTL_HOURS = args.ttl_hours
+
+    db_url = args.db_url
+    if db_url is None:
+        (fd, db_path) = tempfile.mkstemp(prefix="clm_simulator_", suffix=".db")
+        os.close(fd)
+        db_url = "sqlite:///" + db_path
+
+    duration_secs = args.hours * 3600
+    if args.workload is not None:
+        workload = Simulator.read_workload(args.workload)
+    else:
+        workload = Simulator.generate_workload(args.trials, args.clusters, duration_secs, args.seed)
+
+    FakeManager.configure(
+        seed=args.seed, latency_secs=args.latency_ms / 1000.0, failure_rate=args.failure_rate,
+        throttle_rate=args.throttle_rate, lost_response_rate=args.lost_response_rate,
+        ready_secs=args.ready_secs, delete_secs=args.delete_secs, utcnow=clock.utcnow)
+
+    simulator = Simulator(db_url, workload, duration_secs, args.idle_step_secs)
+    try:
+        simulator.run()
+        report = simulator.get_report()
+    finally:
+        simulator.close()
+
+    print("Simulated {} hours with {} requests in {} real secs using {}".format(args.hours, len(workload), report["real_secs"], db_url))
+    for (key, value) in report.items():
+        print("{}: {}".format(key, value))
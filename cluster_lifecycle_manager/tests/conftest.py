@@ -0,0 +1,12 @@
+# Python standard library imports
+import os
+import sys
+
+# Third-party imports
+
+# Local imports
+
+# The CLM imports "db" and "cluster_lifecycle_manager" from the repo's root, and the models import "saas" from its parent.
+root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(root_dir)
+sys.path.append(os.path.dirname(root_dir))
@@ -0,0 +1,159 @@
+# Python standard library imports
+
+# Third-party imports
+import pytest
+
+# Local imports
+from saas.cluster_lifecycle_manager.models.cloud_provider.rate_limiter import TokenBucket, RateLimitedManager
+from saas.cluster_lifecycle_manager.models.cloud_provider.manager.fake_manager import FakeManager, FakeThrottlingError
+
+
+class FakeClock(object):
+    """
+    Clock that only moves when told to, and whose sleep() advances it and records how long it was asked to sleep.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.sleeps.append(secs)
+        self.now += secs
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def fake_manager():
+    FakeManager.configure()
+    yield FakeManager()
+    FakeManager.configure()
+
+
+def make_rate_limited(manager, clock, rate=10.0, min_rate=1.0, max_rate=10.0, **kwargs):
+    """
+    :return: Return a RateLimitedManager whose bucket and backoff use the fake clock, without any jitter.
+    """
+    bucket = TokenBucket(rate, 1, clock=clock, sleep=clock.sleep)
+    return RateLimitedManager(manager, bucket, min_rate, max_rate, sleep=clock.sleep, rand=lambda: 1.0, **kwargs)
+
+
+def test_token_bucket_allows_a_burst_then_waits_for_the_rate(clock):
+    bucket = TokenBucket(2.0, 2, clock=clock, sleep=clock.sleep)
+
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == 0.0
+    # Empty, so the next token is half a second away at 2 tokens per second
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_token_bucket_reserves_tokens_in_order(clock):
+    bucket = TokenBucket(4.0, 1, clock=clock, sleep=lambda secs: None)
+
+    # Without the clock moving, every caller reserves the token after the previous one
+    waits = [bucket.acquire() for _ in range(4)]
+    assert waits == [0.0, pytest.approx(0.25), pytest.approx(0.5), pytest.approx(0.75)]
+
+
+def test_token_bucket_refills_up_to_capacity(clock):
+    bucket = TokenBucket(1.0, 2, clock=clock, sleep=clock.sleep)
+    bucket.acquire()
+    bucket.acquire()
+
+    clock.now += 60.0
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == pytest.approx(1.0)
+
+
+def test_adjust_rate_keeps_the_accumulated_tokens(clock):
+    bucket = TokenBucket(1.0, 10, clock=clock, sleep=clock.sleep)
+    for _ in range(10):
+        bucket.acquire()
+
+    clock.now += 2.0
+    assert bucket.adjust_rate(lambda rate: rate * 4) == 4.0
+    # The 2 tokens from before the change, then the next one at the new rate
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == pytest.approx(0.25)
+
+
+def test_rate_decreases_multiplicatively_and_increases_additively(clock, fake_manager):
+    limited = make_rate_limited(fake_manager, clock, rate=8.0, min_rate=1.0, max_rate=10.0, rate_increase=0.5)
+
+    limited._on_throttled()
+    assert limited.bucket.rate == 4.0
+    limited._on_throttled()
+    limited._on_throttled()
+    limited._on_throttled()
+    # Never below min_rate
+    assert limited.bucket.rate == 1.0
+
+    limited._on_success()
+    assert limited.bucket.rate == 1.5
+    for _ in range(100):
+        limited._on_success()
+    # Never above max_rate
+    assert limited.bucket.rate == 10.0
+
+
+def test_call_api_retries_while_throttled(clock, fake_manager):
+    limited = make_rate_limited(fake_manager, clock, max_retries=3, base_backoff_secs=0.5)
+    FakeManager.configure(throttle_rate=1.0)
+
+    def stop_throttling(secs):
+        # The first backoff ends the throttling, so the retry succeeds
+        clock.sleep(secs)
+        FakeManager.throttle_rate = 0.0
+
+    limited._sleep = stop_throttling
+    assert limited.list_clusters(fake_manager.region) == []
+
+    assert clock.sleeps == [pytest.approx(0.5)]
+    metrics = limited.metrics.to_dict()
+    assert metrics["num_calls"] == 2
+    assert metrics["num_throttled"] == 1
+    assert metrics["num_retries"] == 1
+    assert metrics["num_failures"] == 0
+    # Halved by the throttle, then increased by the success
+    assert limited.bucket.rate == pytest.approx(5.0 + limited.rate_increase)
+
+
+def test_call_api_gives_up_after_max_retries(clock, fake_manager):
+    limited = make_rate_limited(fake_manager, clock, max_retries=3, base_backoff_secs=0.5, max_backoff_secs=1.5)
+    FakeManager.configure(throttle_rate=1.0)
+
+    with pytest.raises(FakeThrottlingError):
+        limited.list_clusters(fake_manager.region)
+
+    # Exponential backoff capped at max_backoff_secs, without jitter since rand() returns 1.0
+    assert clock.sleeps == [pytest.approx(0.5), pytest.approx(1.0), pytest.approx(1.5)]
+    metrics = limited.metrics.to_dict()
+    assert metrics["num_calls"] == 4
+    assert metrics["num_throttled"] == 4
+    assert metrics["num_retries"] == 3
+    assert metrics["num_failures"] == 1
+    assert limited.bucket.rate == 1.0
+
+
+def test_call_api_does_not_retry_other_errors(clock, fake_manager):
+    limited = make_rate_limited(fake_manager, clock)
+    FakeManager.configure(failure_rate=1.0)
+
+    with pytest.raises(Exception, match="Simulated failure"):
+        limited.list_clusters(fake_manager.region)
+
+    metrics = limited.metrics.to_dict()
+    assert metrics["num_calls"] == 1
+    assert metrics["num_retries"] == 0
+    assert metrics["num_failures"] == 1
+    assert limited.bucket.rate == 10.0
@@ -0,0 +1,86 @@
+# Python standard library imports
+from datetime import timedelta
+
+# Third-party imports
+
+# Local imports
+from db.models import TrialRequest, Node
+from db import clock
+from cluster_lifecycle_manager.config import Config as CLMConfig
+
+
+class TrialAdmission(object):
+    """
+    Decides which trial requests in a batch are allowed given the current state of the system
+    to prevent a denial of service attack.
+    The aggregates are computed with a few GROUP BY queries once per batch and then updated in memory as each trial
+    is decided, so admitting a batch of P trials costs a constant number of queries and O(P) work.
+    """
+
+    # Nodes in these states count towards the limit of active nodes
+    ACTIVE_NODE_STATES = [Node.State.LAUNCHED, Node.State.READY, Node.State.EXPIRED]
+
+    # Exempt from the limits per company and email
+    UNRAVEL_COMPANY = "unravel"
+    UNRAVEL_EMAIL_DOMAIN = "@unraveldata.com"
+
+    def __init__(self):
+        """
+        Construct a TrialAdmission object by reading the aggregates for this batch.
+        """
+        # Idle Nodes in the warm pool only count once a trial claims them
+        node_counts = Node.count_by_state(states=self.ACTIVE_NODE_STATES, is_pooled=False)
+        self.num_active_nodes = sum(node_counts.values())
+
+        # TODO, repeat similar logic for Clusters
+        self.num_active_clusters = 0
+
+        self.pending_by_company = TrialRequest.count_pending_by_company()
+        self.pending_by_email = TrialRequest.count_pending_by_email()
+
+        # This includes requests in all states (even APPROVED and DENIED), since it could mean an attack, so
+        # don't process any new requests except those by Unravel.
+        self.total_requests_in_last_min = TrialRequest.get_num_created_after_datetime(clock.utcnow() - timedelta(minutes=1))
+
+    @classmethod
+    def _normalize(cls, value):
+        return value.strip().lower() if value is not None else ""
+
+    def check(self, trial):
+        """
+        Determine if the trial request is allowed, without changing the aggregates.
+        :param trial: TrialRequest object whose state is PENDING
+        :return: Return a 2-tuple of <allowed (bool), reason (str) that is empty if allowed>
+        """
+        company = self._normalize(trial.company)
+        email = self._normalize(trial.email)
+        num_by_same_company = self.pending_by_company.get(company, 0)
+        num_by_same_email = self.pending_by_email.get(email, 0)
+
+        if self.num_active_nodes > CLMConfig.MAX_ALLOWED_ACTIVE_NODES:
+            return False, "Number of active nodes {} exceeds limit of {}".format(self.num_active_nodes, CLMConfig.MAX_ALLOWED_ACTIVE_NODES)
+        if company != self.UNRAVEL_COMPANY and num_by_same_company > CLMConfig.MAX_ACTIVE_FREE_TRIALS_PER_COMPANY:
+            return False, "Company {} has {} active trials which exceeds limit of {}".\
+                format(trial.company, num_by_same_company, CLMConfig.MAX_ACTIVE_FREE_TRIALS_PER_COMPANY)
+        if not email.endswith(self.UNRAVEL_EMAIL_DOMAIN) and num_by_same_email > CLMConfig.MAX_ACTIVE_FREE_TRIALS_PER_EMAIL:
+            return False, "Email {} has {} active trials which exceeds limit of {}".\
+                format(trial.email, num_by_same_email, CLMConfig.MAX_ACTIVE_FREE_TRIALS_PER_EMAIL)
+        if self.total_requests_in_last_min > CLMConfig.MAX_REQUESTS_PER_MIN:
+            return False, "Total requests in last minute is {} which exceeds limit of {}".\
+                format(self.total_requests_in_last_min, CLMConfig.MAX_REQUESTS_PER_MIN)
+        return True, ""
+
+    def record(self, trial, approved):
+        """
+        Update the aggregates once the trial request has been decided, so it is no longer pending.
+        :param trial: TrialRequest object
+        :param approved: Boolean indicating if it was approved, in which case it will launch a Node.
+        """
+        company = self._normalize(trial.company)
+        email = self._normalize(trial.email)
+        if self.pending_by_company.get(company, 0) > 0:
+            self.pending_by_company[company] -= 1
+        if self.pending_by_email.get(email, 0) > 0:
+            self.pending_by_email[email] -= 1
+        if approved:
+            self.num_active_nodes += 1
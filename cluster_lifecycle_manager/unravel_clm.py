@@ -1,10 +1,13 @@
 # Python standard library imports
 import sys
 import os
+import socket
 import argparse
 import logging
-from datetime import datetime, timedelta
+from datetime import timedelta
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Third-party imports
 from daemon import runner
@@ -13,11 +16,16 @@ root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(root_dir)
 
 # Local imports
-from db.models import DBRunner, TrialRequest, NodeSpec, Node, ClusterSpec, Cluster
+from db.models import DBRunner, TrialRequest, NodeSpec, Node, ClusterSpec, Cluster, Notification
 from db.config import Config as DBConfig
+from db import clock
 from cluster_lifecycle_manager.config import Config as CLMConfig
 from cluster_lifecycle_manager.models.cloud_provider.cloud_provider import CloudProvider
 from cluster_lifecycle_manager.models.cluster_spec_model import ClusterSpecModel
+from cluster_lifecycle_manager.trial_admission import TrialAdmission
+from cluster_lifecycle_manager.expiry_scheduler import ExpiryScheduler
+from cluster_lifecycle_manager.cluster_reconciler import ClusterReconciler
+from cluster_lifecycle_manager.demand_forecaster import DemandForecaster
 from cluster_lifecycle_manager.utils import Utils
 
 
@@ -33,7 +41,50 @@ class ClusterLifecycleManager(object):
     """
     logger = Utils.get_logger("ClusterLifecycleManager")
 
-    LOOP_SLEEP_SECS = 10
+    class Phase:
+        TRIALS = "trials"
+        PROVISION = "provision"
+        MONITOR = "monitor"
+        RECONCILE = "reconcile"
+        EXPIRE = "expire"
+
+        # Order in which they run within a loop
+        ALL = [TRIALS, PROVISION, MONITOR, RECONCILE, EXPIRE]
+
+        # Phases that claim up to MAX_CLAIMED_PER_LOOP items, so a full batch means there may be more
+        CLAIMING = [TRIALS, PROVISION]
+
+    # When a phase does some work, the phases that consume its output must run too
+    PHASE_TO_DOWNSTREAM_PHASES = {
+        Phase.TRIALS: {Phase.PROVISION},
+        Phase.PROVISION: {Phase.MONITOR},
+        Phase.MONITOR: set(),
+        Phase.RECONCILE: set(),
+        Phase.EXPIRE: set()
+    }
+
+    NOTIFICATION_TOPIC_TO_PHASES = {
+        Notification.Topic.TRIAL_REQUEST: {Phase.TRIALS},
+        Notification.Topic.CLUSTER_SPEC: {Phase.PROVISION},
+        Notification.Topic.NODE_TTL: {Phase.EXPIRE},
+        Notification.Topic.CLUSTER_TTL: {Phase.EXPIRE}
+    }
+
+    # Kinds of resources in the expiry scheduler
+    class ExpiryKind:
+        NODE = "node"
+        CLUSTER = "cluster"
+
+    # Resources that the daemon expires
+    EXPIRY_KIND_TO_MODEL = {
+        ExpiryKind.NODE: Node,
+        ExpiryKind.CLUSTER: Cluster
+    }
+
+    NOTIFICATION_TOPIC_TO_EXPIRY_KIND = {
+        Notification.Topic.NODE_TTL: ExpiryKind.NODE,
+        Notification.Topic.CLUSTER_TTL: ExpiryKind.CLUSTER
+    }
 
     def __init__(self, args):
         self.stdin_path = "/dev/null"
@@ -45,6 +96,32 @@ class ClusterLifecycleManager(object):
 
         self.session, self.engine = None, None
 
+        # Unique across all of the CLM workers that may be running concurrently.
+        self.worker_id = "{}:{}".format(socket.gethostname(), os.getpid())
+
+        # Blocking Cloud Provider calls run on this pool, created lazily, with a cap per Cloud Provider.
+        self._provisioning_pool = None
+        self._provider_semaphores = {}
+
+        # Highest Notification id that this worker has seen
+        self.last_notification_id = 0
+        self.last_full_sweep = None
+
+        # When each resource is due to expire. Seeded from the DB and periodically reconciled against it.
+        self.expiry_scheduler = ExpiryScheduler()
+        self.last_expiry_reconcile = None
+        # Map from the expiry kind to the set of resource IDs whose TTL was changed by the webapp
+        self.ttl_changes = {}
+
+        self.cluster_reconciler = ClusterReconciler(CLMConfig.CLUSTER_ABSENT_GRACE_SECS)
+        self.last_cluster_reconcile = None
+
+        self.demand_forecaster = None
+        if CLMConfig.WARM_POOL_FORECAST:
+            self.demand_forecaster = DemandForecaster(CLMConfig.WARM_POOL_FORECAST_WEEKS, CLMConfig.WARM_POOL_FORECAST_ALPHA,
+                                                      CLMConfig.WARM_POOL_FORECAST_LEAD_HOURS)
+        self.last_forecast = None
+
     def _connect_to_db(self):
         """
         Connect to the MySQL database.
@@ -54,47 +131,49 @@ class ClusterLifecycleManager(object):
         self.logger.info("Connected to the DB successfully")
         
     def _cleanup(self):
-        pass
+        if self._provisioning_pool is not None:
+            self._provisioning_pool.shutdown(wait=True)
+            self._provisioning_pool = None
+        CloudProvider.close()
 
-    def _is_new_trial_allowed(self, trial):
+    def _get_provisioning_pool(self):
+        """
+        Get the thread pool used to make blocking Cloud Provider calls concurrently.
+        :return: Return a ThreadPoolExecutor
+        """
+        if self._provisioning_pool is None:
+            self._provisioning_pool = ThreadPoolExecutor(max_workers=CLMConfig.PROVISIONING_MAX_WORKERS,
+                                                         thread_name_prefix="provisioning")
+            for cloud_provider in CloudProvider.NAME.ALL:
+                limit = CLMConfig.PROVISIONING_CONCURRENCY_PER_PROVIDER.get(cloud_provider, CLMConfig.PROVISIONING_MAX_WORKERS)
+                self._provider_semaphores[cloud_provider] = threading.BoundedSemaphore(limit)
+        return self._provisioning_pool
+
+    def _call_with_provider_limit(self, cloud_provider, func, *args):
+        """
+        Runs on the provisioning pool. Call the function while holding one of the Cloud Provider's slots
+        so that no more than its configured number of calls are in flight at once.
+        This must not touch the DB session, which is only used by the loop thread.
+        :param cloud_provider: Cloud Provider name (str)
+        :param func: Function to call
+        :param args: Arguments to the function
+        :return: Return the function's return value
+        """
+        with self._provider_semaphores[cloud_provider]:
+            return func(*args)
+
+    def _is_new_trial_allowed(self, admission, trial):
         """
         Determine if a new trial request is allowed given the current state of the system
         to prevent a denial of service attack.
+        :param admission: TrialAdmission object with the aggregates for this batch
         :param trial: TrialRequest object
         :return: Return a boolean indicating if this trial is allowed.
         """
         # Get the current number of active nodes and clusters
         # Ensure that the same email or company doesn't have more than x active requests.
         # Throttle all requests, so prevent a new one if received more than y in the last z minutes.
-        allowed = True
-        num_active_nodes = len(Node.get_by_states([Node.State.LAUNCHED, Node.State.READY, Node.State.EXPIRED]))
-
-        # TODO, repeat similar logic for Clusters
-        num_active_clusters = 0
-
-        active_trials = TrialRequest.get_all_pending()
-        active_trials_by_same_company = [t for t in active_trials if t.company.strip().lower() == trial.company.strip().lower()]
-        active_trials_by_same_email = [t for t in active_trials if t.email.strip().lower() == trial.email.strip().lower()]
-
-        # This includes requests in all states (even APPROVED and DENIED), since it could mean an attack, so
-        # don't process any new requests except those by Unravel.
-        total_requests_in_last_min = TrialRequest.get_num_created_after_datetime(datetime.utcnow() - timedelta(minutes=1))
-
-        reason = ""
-        if num_active_nodes > CLMConfig.MAX_ALLOWED_ACTIVE_NODES:
-            allowed = False
-            reason = "Number of active nodes {} exceeds limit of {}".format(num_active_nodes, CLMConfig.MAX_ALLOWED_ACTIVE_NODES)
-        elif trial.company.strip().lower() != "unravel" and len(active_trials_by_same_company) > CLMConfig.MAX_ACTIVE_FREE_TRIALS_PER_COMPANY:
-            allowed = False
-            reason = "Company {} has {} active trials which exceeds limit of {}".\
-                format(trial.company, len(active_trials_by_same_company), CLMConfig.MAX_ACTIVE_FREE_TRIALS_PER_COMPANY)
-        elif not trial.email.strip().lower().endswith("@unraveldata.com") and len(active_trials_by_same_email) > CLMConfig.MAX_ACTIVE_FREE_TRIALS_PER_EMAIL:
-            allowed = False
-            reason = "Email {} has {} active trials which exceeds limit of {}".\
-                format(trial.email, len(active_trials_by_same_email), CLMConfig.MAX_ACTIVE_FREE_TRIALS_PER_EMAIL)
-        elif total_requests_in_last_min > CLMConfig.MAX_REQUESTS_PER_MIN:
-            reason = "Total requests in last minute is {} which exceeds limit of {}".format(total_requests_in_last_min, CLMConfig.MAX_REQUESTS_PER_MIN)
-            allowed = False
+        allowed, reason = admission.check(trial)
 
         if allowed is False:
             self.logger.warning("Denied trial request with ID {}. Reason: {}".format(trial.id, reason))
@@ -104,82 +183,142 @@ class ClusterLifecycleManager(object):
         """
         Check for any new records in the trial_request table that indicate the need to create a NodeSpec
         and optionally a ClusterSpec.
+        :return: Return the number of trial requests that were claimed (int)
         """
-        new_trials = TrialRequest.get_all_pending()
-        self.logger.info("There are {} pending trial requests.".format(len(new_trials)))
+        new_trials = TrialRequest.claim_pending(self.worker_id, CLMConfig.MAX_CLAIMED_PER_LOOP, CLMConfig.CLAIM_LEASE_SECS)
+        # Publish the claim so that other workers skip these
+        self.session.commit()
+        self.logger.info("Claimed {} pending trial requests.".format(len(new_trials)))
+
+        if len(new_trials) == 0:
+            return 0
+
+        # Aggregates are read once for the whole batch and updated as each trial is decided.
+        admission = TrialAdmission()
+        num_denied = 0
+        # Ids of the Nodes that trials claimed from the warm pool, whose TTL changed
+        pooled_node_ids = []
 
         # Example of how to create a node_spec for the pending request.
-        for trial in new_trials:
-            num_denied = 0
+        for (i, trial) in enumerate(new_trials):
             try:
-                if trial.cloud_provider not in CloudProvider.NAME.ALL:
-                    trial.set_state(TrialRequest.State.DENIED)
-                    trial.update()
-                    self.session.commit()
-
-                    error = "Trial request {} has cloud provider {} which is not supported.".format(trial.id, trial.cloud_provider)
-                    raise Exception(error)
-
-                node_type = "TODO"
-                storage_config = "TODO"
-
-                unravel_version = CLMConfig.UNRAVEL_VERSION_LATEST
-                unravel_tar = CLMConfig.UNRAVEL_VERSION_TO_TAR[unravel_version]
-
-                approved = self._is_new_trial_allowed(trial)
-
-                if approved:
-                    spec = NodeSpec.create_if_not_exists(cloud_provider=trial.cloud_provider, user="free_trial", node_type=node_type,
-                                                         storage_config=storage_config, unravel_version=unravel_version,
-                                                         unravel_tar=unravel_tar, mysql_version=CLMConfig.UNRAVEL_MYSQL_VERSION,
-                                                         install_ondemand=False, extra=None, ttl_hours=CLMConfig.FREE_TRIAL_TTL_HOURS,
-                                                         trial_request_id=trial.id)
-                    spec.save()
-                    trial.set_state(TrialRequest.State.APPROVED)
-                    trial.update()
-
-                    self.logger.info("Transitioned TrialRequest with ID {} from pending to approved by creating a NodeSpec. Trial Request: {} has NodeSpec: {}".
-                        format(trial.id, trial, spec))
-                else:
-                    num_denied += 1
-                    trial.set_state(TrialRequest.State.DENIED)
-                    self.logger.info("Transitioned TrialRequest with ID {} from pending to denied due to potential attack.".
-                                     format(trial.id))
-                    trial.update()
-
-                self.session.commit()
+                with DBRunner.savepoint():
+                    node = None
+                    if trial.cloud_provider not in CloudProvider.NAME.ALL:
+                        trial.set_state(TrialRequest.State.DENIED)
+                        trial.update()
+                        approved = False
+                        self.logger.error("Trial request {} has cloud provider {} which is not supported.".
+                                          format(trial.id, trial.cloud_provider))
+                    else:
+                        approved, node = self._process_trial(admission, trial)
+                        num_denied += 0 if approved else 1
+                admission.record(trial, approved)
+                if node is not None:
+                    pooled_node_ids.append(node.id)
             except Exception as err:
                 self.logger.error("Unable to process trial request with ID {}. Error: {}".format(trial.id, err))
+            self._commit_batch(i + 1)
+
+        self.session.commit()
+        self._reschedule_expiry(self.ExpiryKind.NODE, pooled_node_ids)
+        if num_denied > 0:
+            self.logger.info("In this loop, denied {} trials.".format(num_denied))
+        return len(new_trials)
 
-            if num_denied > 0:
-                self.logger.info("In this loop, denied {} trials.".format(num_denied))
+    def _process_trial(self, admission, trial):
+        """
+        Approve the trial request by creating a NodeSpec for it, or deny it. If the warm pool has an idle Node for it,
+        the NodeSpec gets that Node right away, otherwise, the NodeSpec is provisioned later.
+        :param admission: TrialAdmission object with the aggregates for this batch
+        :param trial: TrialRequest object whose state is PENDING
+        :return: Return a 2-tuple of <boolean indicating if it was approved, Node claimed from the warm pool or None>
+        """
+        region = CloudProvider.get_default_region(trial.cloud_provider)
+        node_type = CLMConfig.FREE_TRIAL_NODE_TYPE
+        storage_config = CLMConfig.FREE_TRIAL_STORAGE_CONFIG
+
+        unravel_version = CLMConfig.UNRAVEL_VERSION_LATEST
+        unravel_tar = CLMConfig.UNRAVEL_VERSION_TO_TAR[unravel_version]
+
+        approved = self._is_new_trial_allowed(admission, trial)
+        node = None
+
+        if approved:
+            # Single flush for all of the objects
+            with DBRunner.unit_of_work():
+                spec = NodeSpec.create_if_not_exists(cloud_provider=trial.cloud_provider, region=region, user="free_trial",
+                                                     node_type=node_type, storage_config=storage_config, unravel_version=unravel_version,
+                                                     unravel_tar=unravel_tar, mysql_version=CLMConfig.UNRAVEL_MYSQL_VERSION,
+                                                     install_ondemand=False, extra=None, ttl_hours=CLMConfig.FREE_TRIAL_TTL_HOURS,
+                                                     trial_request_id=trial.id)
+                spec.save()
+
+                node = Node.claim_from_pool(trial.cloud_provider, region, node_type, spec, CLMConfig.FREE_TRIAL_TTL_HOURS)
+                if node is not None:
+                    spec.set_state(NodeSpec.State.FINISHED)
+                    spec.update()
+
+                trial.set_state(TrialRequest.State.APPROVED)
+                trial.update()
+
+            if node is not None:
+                self.logger.info("Transitioned TrialRequest with ID {} from pending to approved by claiming Node with ID {} from the warm pool. "
+                                 "Trial Request: {} has NodeSpec: {}".format(trial.id, node.id, trial, spec))
+            else:
+                self.logger.info("Transitioned TrialRequest with ID {} from pending to approved by creating a NodeSpec. Trial Request: {} has NodeSpec: {}".
+                    format(trial.id, trial, spec))
+        else:
+            trial.set_state(TrialRequest.State.DENIED)
+            self.logger.info("Transitioned TrialRequest with ID {} from pending to denied due to potential attack.".
+                             format(trial.id))
+            trial.update()
+        return approved, node
 
     def _create_nodes_and_clusters(self):
         """
         Given any pending specs for Nodes and Clusters, actually provision them.
+        :return: Return the number of Node and Cluster specs that were claimed (int)
         """
-        pending_node_specs = NodeSpec.get_all_pending()
-        self.logger.info("There are {} pending Node Specs.".format(len(pending_node_specs)))
+        num_recovered = self._recover_in_flight_cluster_specs()
+
+        pending_node_specs = NodeSpec.claim_pending(self.worker_id, CLMConfig.MAX_CLAIMED_PER_LOOP, CLMConfig.CLAIM_LEASE_SECS)
+        self.session.commit()
+        self.logger.info("Claimed {} pending Node Specs.".format(len(pending_node_specs)))
 
-        for node_spec in pending_node_specs:
+        # List of 2-tuples <Node id, expires_at> to schedule once committed
+        new_node_expiry = []
+        for (i, node_spec) in enumerate(pending_node_specs):
             try:
                 self.logger.info("Analyzing Node Spec with ID {}".format(node_spec.id))
-                node = Node.create_from_node_spec(node_spec)
-                node.save()
+                with DBRunner.savepoint(), DBRunner.unit_of_work():
+                    node = Node.create_from_node_spec(node_spec)
+                    node.save()
 
-                node_spec.set_state(NodeSpec.State.FINISHED)
-                node_spec.update()
-                self.session.commit()
+                    node_spec.set_state(NodeSpec.State.FINISHED)
+                    node_spec.update()
+                new_node_expiry.append((node.id, node.expires_at))
 
                 self.logger.info("Transitioned NodeSpec with ID {} from pending to finished by creating a Node. NodeSpec: {} has Node: {}".
                     format(node_spec.id, node_spec, node))
             except Exception as err:
-                self.logger.error("Unable to launch Node for NodeSpec with ID {}".format(node_spec.id))
+                self.logger.error("Unable to launch Node for NodeSpec with ID {}. Error: {}".format(node_spec.id, err))
+                self._record_failed_spec(node_spec, err)
+            self._commit_batch(i + 1)
+
+        self.session.commit()
+        for (id, expires_at) in new_node_expiry:
+            self.expiry_scheduler.schedule(self.ExpiryKind.NODE, id, expires_at)
 
         # TODO, very similar to above
-        pending_cluster_specs = ClusterSpec.get_all_pending()
-        self.logger.info("There are {} pending Cluster Specs.".format(len(pending_cluster_specs)))
+        pending_cluster_specs = ClusterSpec.claim_pending(self.worker_id, CLMConfig.MAX_CLAIMED_PER_LOOP, CLMConfig.CLAIM_LEASE_SECS)
+        self.session.commit()
+        self.logger.info("Claimed {} pending Cluster Specs.".format(len(pending_cluster_specs)))
 
+        # List of 2-tuples <ClusterSpec, ClusterSpecModel> that are ready to be created
+        in_flight = []
+        # Ids of the existing Clusters whose TTL was extended to reuse them
+        reused_cluster_ids = []
         for cluster_spec in pending_cluster_specs:
             try:
                 self.logger.info("Analyzing Cluster Spec with ID {}".format(cluster_spec.id))
@@ -187,84 +326,622 @@ class ClusterLifecycleManager(object):
                 cluster_spec_model = ClusterSpecModel.create_from_db_cluster_spec(cluster_spec)
                 CloudProvider.resolve_spec(cluster_spec_model)
                 cluster_spec_model.validate()
+                cluster_spec.fingerprint = cluster_spec_model.get_fingerprint()
+
+                if CLMConfig.CLUSTER_REUSE:
+                    cluster = self._reuse_cluster(cluster_spec)
+                    if cluster is not None:
+                        reused_cluster_ids.append(cluster.id)
+                        continue
+
+                with DBRunner.savepoint():
+                    cluster_spec.mark_in_flight()
+                cluster_spec_model.tags[ClusterSpecModel.IDEMPOTENCY_TAG_KEY] = cluster_spec.idempotency_token
+                in_flight.append((cluster_spec, cluster_spec_model))
+            except Exception as err:
+                self.logger.error("Unable to launch Cluster for ClusterSpec with ID {}. Error: {}".format(cluster_spec.id, err))
+                self._record_failed_spec(cluster_spec, err)
 
-                # This actually instantiates the cluster on EMR/HDI/DataProc
-                # TODO, we should try to mock this if possible.
+        # The in-flight markers must be durable before any cluster is created, so that a crash before saving the
+        # Cluster leads to adopting the cluster instead of creating a duplicate.
+        self.session.commit()
+        self._reschedule_expiry(self.ExpiryKind.CLUSTER, reused_cluster_ids)
+
+        # Map from the Future of the Cloud Provider call to its ClusterSpec
+        futures = {}
+        for (cluster_spec, cluster_spec_model) in in_flight:
+            # This actually instantiates the cluster on EMR/HDI/DataProc, which is a blocking network call,
+            # so the calls for all of the specs run concurrently on the provisioning pool.
+            # TODO, we should try to mock this if possible.
+            future = self._get_provisioning_pool().submit(self._call_with_provider_limit, cluster_spec_model.cloud_provider,
+                                                          CloudProvider.create_cluster, cluster_spec_model)
+            futures[future] = cluster_spec
+
+        # List of 2-tuples <Cluster id, expires_at> to schedule once committed
+        new_cluster_expiry = []
+        # The DB writes stay serialized on this thread, in the order that the calls finish.
+        for (i, future) in enumerate(as_completed(futures)):
+            cluster_spec = futures[future]
+            try:
                 # id: j-2WVDA2NW2HRGP, request: 5432581b-bf55-4f91-823b-09359e080bf7
-                cluster_id, _request_id = CloudProvider.create_cluster(cluster_spec_model)
-                # cluster_id = "j-2WVDA2NW2HRGP"
-                # _request_id = "5432581b-bf55-4f91-823b-09359e080bf7"
-
-                cluster = Cluster.create_from_cluster_spec(cluster_spec)
-                cluster.cluster_id = cluster_id
-                cluster.save()
+                cluster_id, _request_id = future.result()
+            except Exception as err:
+                # The call may have failed after the cluster was created (e.g., a timeout), so the spec stays in flight
+                # until the recovery checks for a cluster with its token.
+                self.logger.error("Unable to launch Cluster for ClusterSpec with ID {}, will check for it with token {}. Error: {}".
+                                  format(cluster_spec.id, cluster_spec.idempotency_token, err))
+                try:
+                    with DBRunner.savepoint():
+                        cluster_spec.last_error = str(err)[:ClusterSpec.MAX_ERROR_LENGTH]
+                        cluster_spec.update()
+                except Exception as save_err:
+                    self.logger.error("Unable to save the error for ClusterSpec with ID {}. Error: {}".format(cluster_spec.id, save_err))
+                self._commit_batch(i + 1)
+                continue
 
-                cluster_spec.set_state(ClusterSpec.State.FINISHED)
-                cluster_spec.update()
-                self.session.commit()
+            try:
+                cluster = self._save_cluster(cluster_spec, cluster_id)
+                new_cluster_expiry.append((cluster.id, cluster.expires_at))
 
-                self.logger.info("Transitioned ClusterSpec with ID {} from pending to finished by creating a Cluster. ClusterSpec: {} has Cluster: {}".
+                self.logger.info("Transitioned ClusterSpec with ID {} from in-flight to finished by creating a Cluster. ClusterSpec: {} has Cluster: {}".
                     format(cluster_spec.id, cluster_spec, cluster))
             except Exception as err:
-                self.logger.error("Unable to launch Cluster for ClusterSpec with ID {}. Error: {}".format(cluster_spec.id, err))
+                # Left in flight, the recovery will adopt the cluster.
+                self.logger.error("Unable to save Cluster {} for ClusterSpec with ID {}. Error: {}".format(cluster_id, cluster_spec.id, err))
+            self._commit_batch(i + 1)
+
+        self.session.commit()
+        for (id, expires_at) in new_cluster_expiry:
+            self.expiry_scheduler.schedule(self.ExpiryKind.CLUSTER, id, expires_at)
+
+        num_refilled = self._refill_warm_pool()
+        return num_recovered + len(pending_node_specs) + len(pending_cluster_specs) + num_refilled
+
+    def _get_warm_pool_targets(self):
+        """
+        Get the number of idle Nodes to keep in the warm pool, either the static CLMConfig.WARM_POOL_TARGETS or,
+        if enabled, the forecast of the demand.
+        :return: Return a dictionary from the 3-tuple <cloud provider, region, node type> to the target (int)
+        """
+        if self.demand_forecaster is None:
+            return CLMConfig.WARM_POOL_TARGETS
+
+        now = clock.utcnow()
+        if self.last_forecast is None or (now - self.last_forecast).total_seconds() >= CLMConfig.WARM_POOL_FORECAST_SECS:
+            counts = TrialRequest.count_created_by_hour(self.demand_forecaster.get_since(now))
+            self.demand_forecaster.fit(counts, now)
+            self.last_forecast = now
+
+        # Hard cap, the idle Nodes plus the ones used by trials must not exceed the limit of active nodes.
+        node_counts = Node.count_by_state(states=TrialAdmission.ACTIVE_NODE_STATES, is_pooled=False)
+        capacity = max(0, CLMConfig.MAX_ALLOWED_ACTIVE_NODES - sum(node_counts.values()))
+        return self.demand_forecaster.get_targets(CLMConfig.WARM_POOL_TARGETS, now, capacity)
+
+    def _refill_warm_pool(self):
+        """
+        Launch Nodes into the warm pool until every <cloud provider, region, node type> in CLMConfig.WARM_POOL_TARGETS
+        has its target number of idle LAUNCHED or READY Nodes, and expire the newest idle Nodes above the target.
+        Idle Nodes that expire or are claimed by trials are replaced here, since they no longer count towards the target.
+        :return: Return the number of Nodes that were launched or expired (int)
+        """
+        if len(CLMConfig.WARM_POOL_TARGETS) == 0:
+            return 0
+
+        targets = self._get_warm_pool_targets()
+        counts = Node.count_pooled()
+        # List of 2-tuples <Node id, expires_at> to schedule once committed
+        new_node_expiry = []
+        drained_ids = []
+        for ((cloud_provider, region, node_type), target) in targets.items():
+            num_missing = target - counts.get((cloud_provider, region, node_type), 0)
+            if num_missing < 0:
+                ids = Node.get_pooled_ids(cloud_provider, region, node_type, -num_missing)
+                if Node.expire_pooled(ids) > 0:
+                    drained_ids.extend(ids)
+                continue
+
+            for _ in range(num_missing):
+                try:
+                    with DBRunner.savepoint():
+                        node = Node.create_pooled(cloud_provider, region, node_type, CLMConfig.WARM_POOL_TTL_HOURS)
+                        node.save()
+                    new_node_expiry.append((node.id, node.expires_at))
+                except Exception as err:
+                    self.logger.error("Unable to launch a {} Node of type {} in region {} for the warm pool. Error: {}".
+                                      format(cloud_provider, node_type, region, err))
+                    break
+
+        self.session.commit()
+        for (id, expires_at) in new_node_expiry:
+            self.expiry_scheduler.schedule(self.ExpiryKind.NODE, id, expires_at)
+        self._reschedule_expiry(self.ExpiryKind.NODE, drained_ids)
+        if len(new_node_expiry) > 0 or len(drained_ids) > 0:
+            self.logger.info("Launched {} Nodes into and expired {} Nodes from the warm pool. Targets: {}".
+                             format(len(new_node_expiry), len(drained_ids), targets))
+        return len(new_node_expiry) + len(drained_ids)
+
+    def _save_cluster(self, cluster_spec, cluster_id):
+        """
+        Save the Cluster that the Cloud Provider created for the ClusterSpec, and finish the ClusterSpec.
+        :param cluster_spec: ClusterSpec object whose state is IN_FLIGHT
+        :param cluster_id: Cluster ID (str) assigned by the Cloud Provider
+        :return: Return the Cluster object. Still need to call session.commit()
+        """
+        with DBRunner.savepoint(), DBRunner.unit_of_work():
+            cluster = Cluster.create_from_cluster_spec(cluster_spec)
+            cluster.cluster_id = cluster_id
+            cluster.fingerprint = cluster_spec.fingerprint
+            cluster.save()
+
+            cluster_spec.set_state(ClusterSpec.State.FINISHED)
+            cluster_spec.update()
+        return cluster
+
+    def _reuse_cluster(self, cluster_spec):
+        """
+        Attach the ClusterSpec to a READY Cluster with the same fingerprint and enough TTL left, extending the Cluster's
+        TTL so that it lasts as long as the ClusterSpec asks for.
+        :param cluster_spec: ClusterSpec object whose state is PENDING and whose fingerprint is set
+        :return: Return the reused Cluster object, or None if there is none. Still need to call session.commit()
+        """
+        now = clock.utcnow()
+        with DBRunner.savepoint(), DBRunner.unit_of_work():
+            cluster = Cluster.find_reusable(cluster_spec.fingerprint, now + timedelta(hours=CLMConfig.CLUSTER_REUSE_MIN_REMAINING_HOURS))
+            if cluster is None:
+                return None
+
+            cluster.extend_ttl(now + timedelta(hours=cluster_spec.ttl_hours))
+            cluster_spec.reused_cluster_id = cluster.id
+            cluster_spec.set_state(ClusterSpec.State.FINISHED)
+            cluster_spec.update()
+
+        self.logger.info("Transitioned ClusterSpec with ID {} from pending to finished by reusing Cluster with ID {} that now expires at {}".
+                         format(cluster_spec.id, cluster.id, cluster.expires_at))
+        return cluster
+
+    def _recover_in_flight_cluster_specs(self):
+        """
+        Recover the ClusterSpecs that have been in flight for too long because the CLM crashed or failed to save the
+        Cluster after asking the Cloud Provider to create it. The clusters are looked up by their idempotency tag with one
+        scan per <cloud provider, region>. A cluster that exists is adopted, otherwise, the spec is retried with backoff.
+        :return: Return the number of ClusterSpecs that were recovered (int)
+        """
+        stale_before = clock.utcnow() - timedelta(seconds=CLMConfig.PROVISIONING_IN_FLIGHT_TIMEOUT_SECS)
+        specs = ClusterSpec.claim_stale_in_flight(self.worker_id, stale_before, CLMConfig.MAX_CLAIMED_PER_LOOP,
+                                                  CLMConfig.PROVISIONING_IN_FLIGHT_TIMEOUT_SECS)
+        self.session.commit()
+        if len(specs) == 0:
+            return 0
+        self.logger.info("Recovering {} in-flight Cluster Specs.".format(len(specs)))
+
+        groups = {}
+        for spec in specs:
+            groups.setdefault((spec.cloud_provider, spec.region), []).append(spec)
+
+        futures = {}
+        for ((cloud_provider, region), group) in groups.items():
+            tokens = [spec.idempotency_token for spec in group]
+            # Each cluster was created after its spec was marked in flight for the last time, no matter how many times
+            # it was retried.
+            created_after = min(spec.date_in_flight for spec in group) - ClusterReconciler.LISTING_MARGIN
+            future = self._get_provisioning_pool().submit(self._call_with_provider_limit, cloud_provider,
+                                                          CloudProvider.find_clusters_by_tag, cloud_provider, region,
+                                                          ClusterSpecModel.IDEMPOTENCY_TAG_KEY, tokens, created_after)
+            futures[future] = (cloud_provider, region)
+
+        num_recovered = 0
+        new_cluster_expiry = []
+        for future in as_completed(futures):
+            (cloud_provider, region) = futures[future]
+            try:
+                found = future.result()
+            except Exception as err:
+                # Cannot tell if the clusters exist, so leave them in flight until the next time.
+                self.logger.warning("Unable to find the in-flight {} clusters in region {}. Error: {}".format(cloud_provider, region, err))
+                continue
+
+            for spec in groups[(cloud_provider, region)]:
+                provider_cluster = found.get(spec.idempotency_token)
+                if provider_cluster is None:
+                    error = spec.last_error if spec.last_error is not None else \
+                        "No cluster was created with token {}".format(spec.idempotency_token)
+                    self._record_failed_spec(spec, error)
+                    num_recovered += 1
+                    continue
+
+                try:
+                    cluster = self._save_cluster(spec, provider_cluster.id)
+                    new_cluster_expiry.append((cluster.id, cluster.expires_at))
+                    num_recovered += 1
+                    self.logger.info("Adopted {} cluster {} for in-flight ClusterSpec with ID {} with token {}".
+                                     format(cloud_provider, provider_cluster.id, spec.id, spec.idempotency_token))
+                except Exception as err:
+                    self.logger.error("Unable to adopt cluster {} for ClusterSpec with ID {}. Error: {}".format(provider_cluster.id, spec.id, err))
+
+        self.session.commit()
+        for (id, expires_at) in new_cluster_expiry:
+            self.expiry_scheduler.schedule(self.ExpiryKind.CLUSTER, id, expires_at)
+        return num_recovered
+
+    def _record_failed_spec(self, spec, err):
+        """
+        Record a failed attempt to provision the spec, so that it is retried after a backoff instead of every loop,
+        and given up on once it runs out of attempts.
+        :param spec: NodeSpec or ClusterSpec object whose state is PENDING, or IN_FLIGHT without a cluster
+        :param err: Exception raised while provisioning it, or an error message (str)
+        """
+        try:
+            with DBRunner.savepoint():
+                failed = spec.record_failed_attempt(str(err), CLMConfig.PROVISIONING_MAX_ATTEMPTS,
+                                                    CLMConfig.PROVISIONING_RETRY_BASE_SECS, CLMConfig.PROVISIONING_RETRY_MAX_SECS)
+            if failed:
+                self.logger.error("Transitioned {} with ID {} from pending to failed after {} attempts. Last error: {}".
+                                  format(type(spec).__name__, spec.id, spec.attempts, spec.last_error))
+            else:
+                self.logger.info("Will retry {} with ID {} at {} after {} failed attempts.".
+                                 format(type(spec).__name__, spec.id, spec.next_attempt_at, spec.attempts))
+        except Exception as err:
+            self.logger.error("Unable to record the failed attempt for {} with ID {}. Error: {}".format(type(spec).__name__, spec.id, err))
+
+    def _commit_batch(self, num_processed):
+        """
+        Each phase commits once at the end, with every item isolated in its own savepoint. This also commits
+        after every MAX_BATCH_SIZE items so that a large batch does not hold its row locks for too long.
+        :param num_processed: Number of items processed so far in this batch (int)
+        """
+        if num_processed % CLMConfig.MAX_BATCH_SIZE == 0:
+            self.session.commit()
 
     def _monitor_nodes_and_clusters(self):
         """
         Monitor the newly launched Nodes and Clusters and determine when they are pingable and ready to be delivered.
         This may involve notifying the customers with an email.
+        :return: Return the number of Nodes and Clusters that changed state (int)
         """
         launched = Node.get_by_state(Node.State.LAUNCHED)
-        for node in launched:
-            # TODO, perform some sort of ping/health, and then update the record with the IP address.
-            node.set_state(Node.State.READY)
-            node.update()
-            self.logger.info("Transitioning Node with ID {} from launched to ready. {}".format(node.id, node))
+        # TODO, perform some sort of ping/health, and then update the record with the IP address.
+        ids = [node.id for node in launched]
+        if len(ids) > 0:
+            Node.bulk_transition(Node.State.LAUNCHED, Node.State.READY, ids)
+            self.logger.info("Transitioning Nodes with IDs {} from launched to ready.".format(ids))
         self.session.commit()
+        # The TTL is now relative to date_ready
+        self._reschedule_expiry(self.ExpiryKind.NODE, ids)
+        return len(ids)
+
+    def _reconcile_clusters(self):
+        """
+        Make the Clusters match what their Cloud Provider reports, e.g., mark them as ready, or as deleted if they were
+        terminated outside of the CLM. Lists the clusters once per <cloud provider, region>, concurrently, instead of
+        describing each cluster.
+        :return: Return the number of Clusters that changed state (int)
+        """
+        clusters = Cluster.get_by_states(ClusterReconciler.STATES)
+        groups = ClusterReconciler.group_by_location(clusters)
+
+        futures = {}
+        for ((cloud_provider, region), group) in groups.items():
+            # Only plain values are passed to the pool, which must not touch the DB objects.
+            cluster_ids = [cluster.cluster_id for cluster in group]
+            created_after = ClusterReconciler.get_created_after(group)
+            future = self._get_provisioning_pool().submit(self._call_with_provider_limit, cloud_provider,
+                                                          self._find_provider_clusters, cloud_provider, region,
+                                                          cluster_ids, created_after)
+            futures[future] = (cloud_provider, region)
+
+        # Map from <from state, to state> to the list of Cluster ids
+        plan = {}
+        # List of 3-tuples <cloud provider, region, cluster ID> to terminate
+        to_terminate = []
+        now = clock.utcnow()
+        for future in as_completed(futures):
+            (cloud_provider, region) = futures[future]
+            try:
+                provider_clusters = future.result()
+            except Exception as err:
+                # Without a listing, cannot tell which clusters are gone, so leave this group as is.
+                self.logger.warning("Unable to list the {} clusters in region {}. Error: {}".format(cloud_provider, region, err))
+                continue
+
+            complete_listing = CloudProvider.has_complete_listing(cloud_provider)
+            if not complete_listing:
+                self.logger.warning("Listing the {} clusters does not follow every page, so the ones missing from it are "
+                                    "not marked as deleted.".format(cloud_provider))
+            for (transition, ids) in self.cluster_reconciler.plan(groups[(cloud_provider, region)], provider_clusters, now,
+                                                                  complete_listing).items():
+                plan.setdefault(transition, []).extend(ids)
+            for cluster in ClusterReconciler.get_still_active(groups[(cloud_provider, region)], provider_clusters):
+                to_terminate.append((cloud_provider, region, cluster.cluster_id))
+
+        num_transitioned = 0
+        for (from_state, to_state) in ClusterReconciler.TRANSITIONS:
+            ids = plan.get((from_state, to_state), [])
+            if len(ids) > 0:
+                num_transitioned += Cluster.bulk_transition(from_state, to_state, ids)
+                self.logger.info("Transitioning Clusters with IDs {} from {} to {} to match their Cloud Provider.".
+                                 format(ids, from_state, to_state))
+
+        self.session.commit()
+        self.last_cluster_reconcile = clock.utcnow()
+        self.logger.info("Reconciled {} Clusters in {} regions.".format(len(clusters), len(groups)))
+
+        # E.g., the TTL of a ready Cluster is now relative to date_ready
+        self._reschedule_expiry(self.ExpiryKind.CLUSTER, {id for ids in plan.values() for id in ids})
+
+        if len(to_terminate) > 0:
+            self.logger.info("Terminating {} expired Clusters again since they are still active.".format(len(to_terminate)))
+            self._destroy_clusters(to_terminate)
+        return num_transitioned
+
+    def _destroy_clusters(self, clusters):
+        """
+        Terminate the Clusters with one bulk call per <cloud provider, region>, concurrently. Does not change the DB,
+        reconciliation marks them as deleted once their Cloud Provider no longer lists them, and terminates them again
+        if it still does.
+        :param clusters: List of 3-tuples <cloud provider (str), region (str), cluster ID (str)>
+        :return: Return the number of Clusters that were terminated successfully (int)
+        """
+        groups = {}
+        for (cloud_provider, region, cluster_id) in clusters:
+            if cluster_id is not None:
+                groups.setdefault((cloud_provider, region), []).append(cluster_id)
+
+        futures = {}
+        for ((cloud_provider, region), cluster_ids) in groups.items():
+            future = self._get_provisioning_pool().submit(self._call_with_provider_limit, cloud_provider,
+                                                          CloudProvider.destroy_clusters, cloud_provider, region, cluster_ids)
+            futures[future] = (cloud_provider, region)
+
+        num_terminated = 0
+        for future in as_completed(futures):
+            (cloud_provider, region) = futures[future]
+            try:
+                results = future.result()
+            except Exception as err:
+                self.logger.error("Unable to terminate the {} clusters {} in region {}. Error: {}".
+                                  format(cloud_provider, groups[(cloud_provider, region)], region, err))
+                continue
+
+            for (cluster_id, (request_id, error)) in results.items():
+                if error is None:
+                    num_terminated += 1
+                else:
+                    self.logger.error("Unable to terminate {} cluster {} in region {}. Error: {}".format(cloud_provider, cluster_id, region, error))
+        return num_terminated
+
+    @staticmethod
+    def _find_provider_clusters(cloud_provider, region, cluster_ids, created_after):
+        """
+        Runs on the provisioning pool. Stream the active clusters in that region page by page until all of the
+        given ones were found.
+        :param cloud_provider: Cloud Provider name (str)
+        :param region: Region name (str)
+        :param cluster_ids: List of cluster IDs (str) assigned by the Cloud Provider
+        :param created_after: Python DateTime object (UTC) to filter on
+        :return: Return a list of ClusterModel objects
+        """
+        provider_clusters = CloudProvider.iter_clusters(cloud_provider, region, created_after=created_after)
+        return ClusterReconciler.find_provider_clusters(provider_clusters, cluster_ids)
+
+    def _reschedule_expiry(self, kind, ids):
+        """
+        Read the current expiry time of the given resources from the DB and update the expiry scheduler,
+        which stops tracking the ones that can no longer expire.
+        :param kind: Expiry kind (str)
+        :param ids: List or set of resource IDs (int PK)
+        """
+        model = self.EXPIRY_KIND_TO_MODEL.get(kind)
+        if model is None or len(ids) == 0:
+            return
+
+        schedule = model.get_expiry_schedule(list(ids))
+        for (id, expires_at) in schedule:
+            self.expiry_scheduler.schedule(kind, id, expires_at)
+        for id in set(ids) - {id for (id, _) in schedule}:
+            self.expiry_scheduler.cancel(kind, id)
+
+    def _reconcile_expiry(self):
+        """
+        Rebuild the expiry scheduler from the DB. This is the safety net for anything it missed, e.g., resources
+        created by another CLM worker, or notifications that were skipped.
+        """
+        for (kind, model) in self.EXPIRY_KIND_TO_MODEL.items():
+            self.expiry_scheduler.reset(kind, model.get_expiry_schedule())
+        self.last_expiry_reconcile = clock.utcnow()
+        self.logger.info("Reconciled the expiry scheduler with the DB, which now has {} resources.".format(len(self.expiry_scheduler)))
 
     def _expire_nodes_and_clusters(self):
         """
         Find any nodes that have been marked as expired and actually delete them once removed from the Cloud Provider.
-        Find any nodes that are candidates to expire and transition them into that state.
-        """
-        # The order matters, should first try to go from EXPIRED -> DELETED in this for-loop.
-        expired = Node.get_by_state(Node.State.EXPIRED)
-        self.logger.info("There are {} expired Nodes that have already been deleted by their respective Cloud Provider.".format(len(expired)))
-        # TODO, perhaps in makes sense to group them based on the Cloud Provider to perform bulk-ops
-        for node in expired:
-            node.set_state(Node.State.DELETED)
-            node.update()
-            self.logger.info("Marking Node with ID {} as deleted".format(node.id))
-            self.session.commit()
+        Find any nodes and clusters that are candidates to expire and transition them into that state,
+        and terminate the clusters in bulk, grouped by Cloud Provider and region.
+        :return: Return the number of Nodes and Clusters that changed state (int)
+        """
+        # The order matters, should first try to go from EXPIRED -> DELETED with a single statement.
+        # Clusters are only marked as deleted by reconciliation, once their Cloud Provider no longer lists them.
+        num_deleted = Node.bulk_transition(Node.State.EXPIRED, Node.State.DELETED)
+        self.logger.info("Marked {} expired Nodes that have already been deleted by their respective Cloud Provider as deleted.".format(num_deleted))
+
+        if self.last_expiry_reconcile is None or \
+                (clock.utcnow() - self.last_expiry_reconcile).total_seconds() >= CLMConfig.EXPIRY_RECONCILE_SECS:
+            self._reconcile_expiry()
+
+        for (kind, ids) in self.ttl_changes.items():
+            self._reschedule_expiry(kind, ids)
+        self.ttl_changes = {}
 
         # The next top-level loop will determine when these are deleted.
-        ready_to_expire = Node.get_all_ready_to_expire()
-        self.logger.info("There are {} Nodes ready to expire.".format(len(ready_to_expire)))
-        for node in ready_to_expire:
-            node.set_state(Node.State.EXPIRED)
-            node.update()
-            self.logger.info("Marking Node with ID {} as expired".format(node.id))
+        due = self.expiry_scheduler.pop_due(clock.utcnow())
+        num_expired = 0
+        # List of 3-tuples <cloud provider, region, cluster ID> to terminate once committed
+        to_terminate = []
+        for (kind, model) in self.EXPIRY_KIND_TO_MODEL.items():
+            due_ids = due.get(kind, [])
+            # The DB is the source of truth, e.g., in case the TTL was extended and the notification has not been seen yet.
+            ready_to_expire = model.get_all_ready_to_expire(ids=due_ids)
+            if len(due_ids) > 0:
+                self.logger.info("There are {} {}s ready to expire.".format(len(ready_to_expire), model.__name__))
+            for from_state in [model.State.LAUNCHED, model.State.READY]:
+                ids = [resource.id for resource in ready_to_expire if resource.state == from_state]
+                if len(ids) > 0:
+                    model.bulk_transition(from_state, model.State.EXPIRED, ids)
+                    self.logger.info("Marking {}s with IDs {} as expired".format(model.__name__, ids))
+            if model is Cluster:
+                to_terminate.extend([(cluster.cloud_provider, cluster.region, cluster.cluster_id) for cluster in ready_to_expire])
+            num_expired += len(ready_to_expire)
+
+            # Any that were not actually due go back into the scheduler with their current expiry time
+            self._reschedule_expiry(kind, set(due_ids) - {resource.id for resource in ready_to_expire})
+
+        self.session.commit()
+
+        if len(to_terminate) > 0:
+            num_terminated = self._destroy_clusters(to_terminate)
+            self.logger.info("Terminated {} of {} expired Clusters.".format(num_terminated, len(to_terminate)))
+        return num_deleted + num_expired
+
+    def _poll_notifications(self):
+        """
+        Get the phases that have work according to the Notifications written by the webapp since the last poll.
+        This is a range scan on the PK, so it is cheap enough to run many times per second.
+        Since ids are not guaranteed to commit in order, a Notification may be skipped, which the periodic
+        full sweep covers.
+        :return: Return a set of phases (str)
+        """
+        phases = set()
+        notifications = Notification.get_after_id(self.last_notification_id)
+        for notification in notifications:
+            phases |= self.NOTIFICATION_TOPIC_TO_PHASES.get(notification.topic, set())
+            kind = self.NOTIFICATION_TOPIC_TO_EXPIRY_KIND.get(notification.topic)
+            if kind is not None and notification.entity_id is not None:
+                self.ttl_changes.setdefault(kind, set()).add(notification.entity_id)
+            self.last_notification_id = max(self.last_notification_id, notification.id)
+
+        if len(notifications) > 0:
+            self.logger.info("Received {} notifications, up to ID {}".format(len(notifications), self.last_notification_id))
+        return phases
+
+    def run_once(self, phases):
+        """
+        Run the given phases once, in order.
+        :param phases: Set of phases (str) that have work
+        :return: Return the set of phases (str) that should run again right away, either because an upstream phase
+        produced work for them, or because they claimed a full batch and there may be more.
+        """
+        phase_to_func = {
+            self.Phase.TRIALS: self._check_for_free_trials,
+            self.Phase.PROVISION: self._create_nodes_and_clusters,
+            self.Phase.MONITOR: self._monitor_nodes_and_clusters,
+            self.Phase.RECONCILE: self._reconcile_clusters,
+            self.Phase.EXPIRE: self._expire_nodes_and_clusters
+        }
+
+        dirty = set(phases)
+        again = set()
+        for phase in self.Phase.ALL:
+            if phase not in dirty:
+                continue
+            num_processed = phase_to_func[phase]()
+            if num_processed > 0:
+                dirty |= self.PHASE_TO_DOWNSTREAM_PHASES[phase]
+            if phase in self.Phase.CLAIMING and num_processed >= CLMConfig.MAX_CLAIMED_PER_LOOP:
+                again.add(phase)
+        return again
+
+    def _end_transaction(self):
+        """
+        End the current transaction so that the next poll sees rows committed by the webapp in the meantime.
+        """
+        if CLMConfig.SESSION_PER_LOOP:
+            # Unit of work per loop, which releases every object loaded in this loop along with the
+            # connection, and the next loop will start a new transaction that sees fresh DB state.
+            self.session.close()
+        else:
+            self.session.commit()
+
+    def _get_due_phases(self, now):
+        """
+        Get the phases that have work, according to the Notifications and to the timers, e.g., a full sweep runs every
+        phase every FULL_SWEEP_SECS, and the expiry phase runs as soon as a resource is due to expire.
+        :param now: Python DateTime object
+        :return: Return a set of phases (str)
+        """
+        phases = set()
+        if self.last_full_sweep is None or (now - self.last_full_sweep).total_seconds() >= CLMConfig.FULL_SWEEP_SECS:
+            phases = set(self.Phase.ALL)
+            self.last_full_sweep = now
+            num_pruned = Notification.delete_before_datetime(now - timedelta(seconds=CLMConfig.NOTIFICATION_RETENTION_SECS))
             self.session.commit()
+            if num_pruned > 0:
+                self.logger.info("Pruned {} old notifications".format(num_pruned))
+            for ((cloud_provider, region), metrics) in CloudProvider.get_api_metrics().items():
+                self.logger.info("API calls to {} in region {}: {}".format(cloud_provider, region, metrics))
+
+        phases |= self._poll_notifications()
+
+        if self.last_cluster_reconcile is None or \
+                (now - self.last_cluster_reconcile).total_seconds() >= CLMConfig.CLUSTER_RECONCILE_SECS:
+            phases.add(self.Phase.RECONCILE)
+
+        next_expiry = self.expiry_scheduler.get_next_due()
+        if next_expiry is not None and next_expiry <= now:
+            phases.add(self.Phase.EXPIRE)
+        return phases
+
+    def step(self, dirty):
+        """
+        Run one iteration of the main loop, which is also driven by the simulator.
+        :param dirty: Set of phases (str) to run again right away, returned by the previous iteration
+        :return: Return a 2-tuple of <set of phases (str) to run again right away, number of seconds (float) that the
+        phases took, or None if there was no work>
+        """
+        dirty = set(dirty) | self._get_due_phases(clock.utcnow())
+        if len(dirty) == 0:
+            self._end_transaction()
+            return dirty, None
+
+        self.logger.info("** Commencing loop again. Phases: {}".format(", ".join(p for p in self.Phase.ALL if p in dirty)))
+        start = time.monotonic()
+        dirty = self.run_once(dirty)
+        duration = time.monotonic() - start
+
+        identity_map_size = len(self.session.identity_map)
+        self._end_transaction()
+        self.logger.info("** Loop took {} secs. Identity map size: {}, RSS: {:.1f} MB.".
+                         format(duration, identity_map_size, Utils.get_rss_mb()))
+        return dirty, duration
 
     def run(self):
         """
-        Main logic that runs continuously every 10 seconds.
+        Main logic that runs continuously. It wakes up as soon as the webapp writes a Notification, and runs only
+        the phases that have work, backing off while idle. Every phase runs in a full sweep every FULL_SWEEP_SECS.
         """
         self.logger.info("Starting {}".format(APPLICATION))
         try:
             self._connect_to_db()
+            self.last_notification_id = Notification.get_max_id()
+            self._reconcile_expiry()
+
+            # The first step is a full sweep
+            dirty = set()
+            poll_secs = CLMConfig.NOTIFICATION_POLL_MIN_SECS
             while True:
-                self.logger.info("** Commencing loop again")
-                start = datetime.utcnow()
-                self._check_for_free_trials()
-                self._create_nodes_and_clusters()
-                self._monitor_nodes_and_clusters()
-                self._expire_nodes_and_clusters()
-                end = datetime.utcnow()
-                duration = (end - start).total_seconds()
-                self.logger.info("** Loop took {} secs. Sleeping for 10 secs.".format(duration))
-                time.sleep(10)
+                dirty, duration = self.step(dirty)
+                if duration is not None:
+                    poll_secs = CLMConfig.NOTIFICATION_POLL_MIN_SECS
+
+                if len(dirty) == 0:
+                    sleep_secs = poll_secs
+                    next_expiry = self.expiry_scheduler.get_next_due()
+                    if next_expiry is not None:
+                        # Wake up in time for the next expiry
+                        sleep_secs = max(0, min(sleep_secs, (next_expiry - clock.utcnow()).total_seconds()))
+                    clock.get_clock().sleep(sleep_secs)
+                    # Back off while idle
+                    poll_secs = min(poll_secs * 2, CLMConfig.NOTIFICATION_POLL_MAX_SECS)
         except (KeyboardInterrupt, SystemExit) as err:
             self.logger.error("Safely handling exception. {}".format(err))
+            self._cleanup()
             raise
 
 
@@ -1,5 +1,8 @@
 # Python Standard Library imports
+import os
+import sys
 import logging
+import resource
 from collections import defaultdict
 
 class Utils:
@@ -13,14 +16,16 @@ class Utils:
         logger = logging.getLogger(name)
         logger.setLevel(logging.INFO)
 
-        # Console handler with a higher log level
-        ch = logging.StreamHandler()
-        ch.setLevel(logging.INFO)
+        # Loggers are global, so only add the handler the first time, otherwise every message is printed once per call.
+        if len(logger.handlers) == 0:
+            # Console handler with a higher log level
+            ch = logging.StreamHandler()
+            ch.setLevel(logging.INFO)
 
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        ch.setFormatter(formatter)
+            formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+            ch.setFormatter(formatter)
 
-        logger.addHandler(ch)
+            logger.addHandler(ch)
 
         return logger
 
@@ -52,3 +57,19 @@ class Utils:
                 break
 
         return curr_obj
+
+    @staticmethod
+    def get_rss_mb():
+        """
+        Get the current resident set size (RSS) of this process.
+        Uses /proc on Linux, and falls back to the peak RSS on other platforms.
+        :return: Return the RSS in MB (float)
+        """
+        try:
+            with open("/proc/self/statm", "r") as f:
+                resident_pages = int(f.read().split()[1])
+            return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+        except (IOError, OSError, ValueError, IndexError):
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # Reported in bytes on Mac and in KB on Linux
+            return max_rss / (1024.0 * 1024.0) if sys.platform == "darwin" else max_rss / 1024.0
@@ -0,0 +1,86 @@
+# Python standard library imports
+from datetime import datetime, timedelta
+import threading
+import time
+
+# Third-party imports
+
+# Local imports
+
+
+class Clock(object):
+    """
+    Source of the current time for the models and the CLM, which defaults to the system clock.
+    The simulator replaces it with a FakeClock by calling set_clock() so that simulated hours pass in milliseconds.
+    """
+
+    def utcnow(self):
+        """
+        :return: Return the current time as a Python DateTime object (UTC)
+        """
+        return datetime.utcnow()
+
+    def sleep(self, secs):
+        """
+        Sleep for the given number of seconds (float).
+        """
+        time.sleep(secs)
+
+
+class FakeClock(Clock):
+    """
+    Clock that only moves when it is advanced, so that a simulation is deterministic.
+    """
+
+    def __init__(self, start):
+        """
+        Construct a FakeClock.
+        :param start: Initial time as a Python DateTime object (UTC)
+        """
+        self._now = start
+        self._lock = threading.Lock()
+
+    def utcnow(self):
+        with self._lock:
+            return self._now
+
+    def sleep(self, secs):
+        """
+        Advance the clock instead of sleeping.
+        """
+        self.advance(secs)
+
+    def advance(self, secs):
+        """
+        Move the clock forward.
+        :param secs: Number of seconds (float)
+        """
+        with self._lock:
+            self._now += timedelta(seconds=secs)
+
+
+_clock = Clock()
+
+
+def get_clock():
+    """
+    :return: Return the Clock in use
+    """
+    return _clock
+
+
+def set_clock(clock):
+    """
+    Replace the Clock used by the models and the CLM.
+    :param clock: Instance of Clock, e.g., a FakeClock
+    """
+    global _clock
+    _clock = clock
+
+
+def utcnow():
+    """
+    Get the current time from the Clock in use. Also usable as a Column default.
+    :return: Return a Python DateTime object (UTC)
+    """
+    return _clock.utcnow()
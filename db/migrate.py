@@ -0,0 +1,139 @@
+# Python standard library imports
+import sys
+import os
+import re
+import argparse
+import logging
+from datetime import datetime
+
+# Third-party imports
+from sqlalchemy import text
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(root_dir)
+
+# Local imports
+from db.models import DBRunner
+
+
+logger = logging.getLogger("MigrationRunner")
+
+
+class MigrationRunner(object):
+    """
+    Applies the numbered schema migrations in db/schema (e.g., 01_ddl_expires_at.sql) on top of the original
+    schema in 00_ddl_schema.sql. Each migration is applied exactly once, in order, and the version is recorded
+    in the schema_version table so that running this again is a no-op.
+    """
+    SCHEMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schema")
+
+    # E.g., 01_ddl_expires_at.sql is version 1
+    MIGRATION_REGEX = re.compile(r"^(\d+)_ddl_.+\.sql$")
+
+    # Version of 00_ddl_schema.sql, which is created by create_db.sh
+    BASE_VERSION = 0
+
+    VERSION_TABLE = "schema_version"
+
+    def __init__(self, engine):
+        """
+        Construct a MigrationRunner
+        :param engine: SQLAlchemy engine connected to the clm database
+        """
+        self.engine = engine
+
+    def get_migrations(self):
+        """
+        Get all of the migrations that exist on disk after the original schema.
+        :return: Return a list of 2-tuples <version (int), file name (str)> sorted by version.
+        """
+        migrations = []
+        for file_name in os.listdir(self.SCHEMA_DIR):
+            m = self.MIGRATION_REGEX.match(file_name)
+            if m and int(m.group(1)) > self.BASE_VERSION:
+                migrations.append((int(m.group(1)), file_name))
+
+        migrations.sort()
+        versions = [version for (version, _) in migrations]
+        if len(versions) != len(set(versions)):
+            raise Exception("Found more than one migration with the same version in {}".format(self.SCHEMA_DIR))
+        return migrations
+
+    def get_current_version(self, conn):
+        """
+        Get the latest schema version that was applied, creating the schema_version table if needed.
+        :param conn: SQLAlchemy connection
+        :return: Return the version (int)
+        """
+        conn.execute(text("CREATE TABLE IF NOT EXISTS `{}` ("
+                          "`version` INT NOT NULL, "
+                          "`name` VARCHAR(256) NOT NULL, "
+                          "`date_applied` DATETIME NOT NULL, "
+                          "PRIMARY KEY (`version`))".format(self.VERSION_TABLE)))
+        version = conn.execute(text("SELECT MAX(`version`) FROM `{}`".format(self.VERSION_TABLE))).scalar()
+        return version if version is not None else self.BASE_VERSION
+
+    @classmethod
+    def _get_statements(cls, file_path):
+        """
+        Split a migration file into its statements, ignoring comment lines.
+        :param file_path: Absolute path to the .sql file
+        :return: Return a list of SQL statements (str)
+        """
+        with open(file_path, "r") as f:
+            lines = [line for line in f.readlines() if not line.strip().startswith("--")]
+        statements = [stmt.strip() for stmt in "".join(lines).split(";")]
+        return [stmt for stmt in statements if stmt != ""]
+
+    def get_pending(self):
+        """
+        Get the migrations that have not been applied yet.
+        :return: Return a list of 2-tuples <version (int), file name (str)>
+        """
+        with self.engine.connect() as conn:
+            current_version = self.get_current_version(conn)
+        return [(version, name) for (version, name) in self.get_migrations() if version > current_version]
+
+    def apply(self):
+        """
+        Apply all pending migrations in order and record each version as soon as it is applied.
+        MySQL implicitly commits DDL, so a migration that fails midway must be fixed by hand before re-running.
+        :return: Return the list of file names that were applied.
+        """
+        applied = []
+        with self.engine.connect() as conn:
+            current_version = self.get_current_version(conn)
+            logger.info("Current schema version is {}".format(current_version))
+
+            for (version, name) in self.get_migrations():
+                if version <= current_version:
+                    continue
+
+                logger.info("Applying migration {}".format(name))
+                for stmt in self._get_statements(os.path.join(self.SCHEMA_DIR, name)):
+                    conn.execute(text(stmt))
+
+                conn.execute(text("INSERT INTO `{}` (`version`, `name`, `date_applied`) VALUES (:version, :name, :date)".
+                                  format(self.VERSION_TABLE)),
+                             version=version, name=name, date=datetime.utcnow())
+                applied.append(name)
+
+        logger.info("Applied {} migration(s)".format(len(applied)))
+        return applied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply the clm schema migrations")
+    parser.add_argument("--dry-run", action="store_true", default=False, help="Only print the pending migrations")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    _session, engine = DBRunner.setup_session(DBRunner.get_unravel_jdbc_url())
+    runner = MigrationRunner(engine)
+
+    if args.dry_run:
+        for (version, name) in runner.get_pending():
+            print("Pending migration {}: {}".format(version, name))
+    else:
+        runner.apply()
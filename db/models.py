@@ -1,25 +1,34 @@
 # Python standard library imports
 from datetime import datetime, timedelta
+from contextlib import contextmanager
 import random, string
+import math
 import logging
+import threading
 
 # Third-party imports
-from sqlalchemy import create_engine
-from sqlalchemy import Column, Boolean, Integer, Float, String, DateTime, ForeignKey, Text
+from sqlalchemy import create_engine, event
+from sqlalchemy import Column, Boolean, Integer, Float, String, DateTime, ForeignKey, Text, Index
 from sqlalchemy import func, and_, or_, not_
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.declarative import as_declarative
-from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.orm import relationship, sessionmaker, scoped_session
 from sqlalchemy.pool import QueuePool
 from sqlalchemy.exc import DatabaseError
+from sqlalchemy.sql.expression import FunctionElement
 
 # Local imports
 from db.config import Config
+from db import clock
 
 
 # SQLAlchemy session
 session = None
 logger = logging.getLogger("SQLAlchemyModels")
 
+# Per-thread state of the transaction, e.g., how many savepoints and units of work are open
+_tx_state = threading.local()
+
 
 class DBRunner(object):
     """
@@ -52,10 +61,13 @@ class DBRunner(object):
         return url
 
     @classmethod
-    def setup_session(cls, jdbc_url):
+    def setup_session(cls, jdbc_url, scoped=False):
         """
         Given the JDBC url, set the global SQLAlchemy session and connect it to the appropriate engine
         :param jdbc_url: JDBC URL string
+        :param scoped: Boolean indicating whether the global session should be a thread-local scoped_session
+        instead of a single Session. Multi-threaded apps like the webapp should use True and call remove_session()
+        at the end of every request, while the single-threaded CLM daemon uses False.
         """
         global session
         global engine
@@ -69,15 +81,167 @@ class DBRunner(object):
             # Can enable echo=True for debugging
             echo = cls.DEBUG is True
             engine = create_engine(jdbc_url, pool_size=128, max_overflow=10, poolclass=QueuePool, echo=echo)
+            if engine.dialect.name == "sqlite":
+                cls._enable_sqlite_transactions(engine)
             Session = sessionmaker()
             # Actually bind it to an engine once we know the DB configs
             Session.configure(bind=engine)
-            session = Session()
+            # A scoped_session proxies all of the Session methods to the session of the current thread,
+            # so the models can keep using the global session in either mode.
+            session = scoped_session(Session) if scoped else Session()
         except Exception as exc:
             raise Exception("Setup session failed with exception: {}".format(exc))
 
         return session, engine
 
+    @classmethod
+    def _enable_sqlite_transactions(cls, engine):
+        """
+        The pysqlite driver only begins a transaction before a DML statement, so a SAVEPOINT after only SELECTs opens
+        the transaction itself and its RELEASE commits. Have SQLAlchemy emit the BEGIN instead, so that savepoint()
+        behaves as on MySQL, e.g., for the simulator.
+        See https://docs.sqlalchemy.org/en/13/dialects/sqlite.html#serializable-isolation-savepoints-transactional-ddl
+        :param engine: SQLAlchemy engine of an SQLite DB
+        """
+        @event.listens_for(engine, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            # Disable the driver's own BEGIN
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(engine, "begin")
+        def on_begin(conn):
+            conn.execute("BEGIN")
+
+    @classmethod
+    def remove_session(cls):
+        """
+        If the global session is a scoped_session, close and discard the current thread's session so that
+        its identity map does not leak into the next request served by this thread. Otherwise, do nothing.
+        """
+        if isinstance(session, scoped_session):
+            session.remove()
+
+    @classmethod
+    def in_savepoint(cls):
+        """
+        :return: Return True if the current thread is inside of savepoint()
+        """
+        return getattr(_tx_state, "savepoint_depth", 0) > 0
+
+    @classmethod
+    @contextmanager
+    def savepoint(cls):
+        """
+        Context manager that isolates the changes made inside of it with a SAVEPOINT, so that processing one item of
+        a batch can fail without discarding the rest of the batch's transaction. E.g.,
+
+        for item in items:
+            try:
+                with DBRunner.savepoint():
+                    item.update(x=y)
+            except Exception as err:
+                # Only the changes to this item were rolled back
+                logger.error(err)
+        session.commit()
+
+        On an exception, it rolls back to the savepoint and re-raises. Still need to call session.commit().
+        """
+        nested = session.begin_nested()
+        _tx_state.savepoint_depth = getattr(_tx_state, "savepoint_depth", 0) + 1
+        try:
+            yield nested
+            nested.commit()
+        except Exception:
+            nested.rollback()
+            raise
+        finally:
+            _tx_state.savepoint_depth -= 1
+
+    @classmethod
+    def in_unit_of_work(cls):
+        """
+        :return: Return True if the current thread is inside of unit_of_work()
+        """
+        return getattr(_tx_state, "unit_of_work_depth", 0) > 0
+
+    @classmethod
+    @contextmanager
+    def unit_of_work(cls):
+        """
+        Context manager that defers the flush of Base.save(), update(), and delete() until the end of the block,
+        so a workflow that changes several objects makes a single flush, in which SQLAlchemy can batch the INSERTs
+        of the same table into an executemany. E.g.,
+
+        with DBRunner.unit_of_work():
+            spec.save()
+            trial.update(state=y)
+        # Both were flushed, so spec.id is now set
+        session.commit()
+
+        Generated ids are not available inside of the block, unless a query autoflushes. Nested blocks flush
+        with the outermost one. Still need to call session.commit().
+
+        On an exception, the changes of the block are still pending in the session, so they must be discarded before
+        the next flush. Nest the block in savepoint(), whose rollback discards them along with the rest of the item,
+        e.g., "with DBRunner.savepoint(), DBRunner.unit_of_work():". Outside of a savepoint, the outermost block
+        rolls back the whole transaction and re-raises.
+        """
+        _tx_state.unit_of_work_depth = getattr(_tx_state, "unit_of_work_depth", 0) + 1
+        try:
+            yield
+        except Exception:
+            # Same as Base.flush_session(), inside of a savepoint only let it roll back to itself
+            if _tx_state.unit_of_work_depth == 1 and not cls.in_savepoint():
+                session.rollback()
+            raise
+        finally:
+            _tx_state.unit_of_work_depth -= 1
+
+        if not cls.in_unit_of_work():
+            Base.flush_session()
+
+
+class hours_after(FunctionElement):
+    """
+    SQL expression for a datetime plus a number of hours that can come from a column,
+    e.g., hours_after(now, Node.ttl_hours). Used by set-based UPDATEs that need to recompute expires_at.
+    """
+    type = DateTime()
+    name = "hours_after"
+
+
+@compiles(hours_after, "mysql")
+def _mysql_hours_after(element, compiler, **kw):
+    date, hours = list(element.clauses)
+    return "DATE_ADD({}, INTERVAL {} HOUR)".format(compiler.process(date, **kw), compiler.process(hours, **kw))
+
+
+@compiles(hours_after, "sqlite")
+def _sqlite_hours_after(element, compiler, **kw):
+    date, hours = list(element.clauses)
+    return "datetime({}, '+' || {} || ' hours')".format(compiler.process(date, **kw), compiler.process(hours, **kw))
+
+
+class hour_bucket(FunctionElement):
+    """
+    SQL expression that truncates a datetime to the start of its hour as a string formatted like
+    "2020-02-24 09:00:00", e.g., to count rows per hour with a single GROUP BY query.
+    """
+    type = String()
+    name = "hour_bucket"
+
+
+@compiles(hour_bucket, "mysql")
+def _mysql_hour_bucket(element, compiler, **kw):
+    date, = list(element.clauses)
+    return "DATE_FORMAT({}, '%%Y-%%m-%%d %%H:00:00')".format(compiler.process(date, **kw))
+
+
+@compiles(hour_bucket, "sqlite")
+def _sqlite_hour_bucket(element, compiler, **kw):
+    date, = list(element.clauses)
+    return "strftime('%Y-%m-%d %H:00:00', {})".format(compiler.process(date, **kw))
+
 
 @as_declarative()
 class Base(object):
@@ -102,6 +266,10 @@ class Base(object):
     """
     id = Column(Integer, primary_key=True)
 
+    # Default and maximum number of objects per page for the get_page classmethods
+    PAGE_SIZE = 50
+    MAX_PAGE_SIZE = 500
+
     def save(self):
         session.add(self)
         self._flush()
@@ -117,12 +285,172 @@ class Base(object):
         self._flush()
 
     def _flush(self):
+        # Inside of a unit of work, the flush happens once at the end.
+        if DBRunner.in_unit_of_work():
+            return
+        Base.flush_session()
+
+    @staticmethod
+    def flush_session():
+        """
+        Flush all of the pending changes in the session.
+        """
         try:
             session.flush()
         except DatabaseError:
-            session.rollback()
+            # Inside of a savepoint, only roll back to it (which DBRunner.savepoint does) instead of rolling back
+            # the whole transaction shared by the rest of the batch.
+            if not DBRunner.in_savepoint():
+                session.rollback()
             raise
 
+    def to_dict(self):
+        """
+        Get the column values of this object, e.g., to serialize it into JSON.
+        :return: Return a dictionary from the column name (str) to its value.
+        """
+        return {column.name: getattr(self, column.name) for column in self.__table__.columns}
+
+    @classmethod
+    def _get_page(cls, query, cursor, limit):
+        """
+        Keyset (seek) pagination from the newest to the oldest id, i.e., WHERE id < cursor ORDER BY id DESC LIMIT n,
+        so the cost of a page does not depend on how many pages came before it.
+        :param query: SQLAlchemy query with any filters already applied
+        :param cursor: Only return objects whose id is < cursor (int). If None, return the first page.
+        :param limit: Maximum number of objects to return (int)
+        :return: Return a 2-tuple of <list of objects, next cursor (int)>, where the next cursor is None
+        if this is the last page.
+        """
+        limit = max(1, min(limit, cls.MAX_PAGE_SIZE))
+        if cursor is not None:
+            query = query.filter(cls.id < cursor)
+
+        # Fetch one more row than needed to know if there is another page
+        rows = query.order_by(cls.id.desc()).limit(limit + 1).all()
+        if len(rows) > limit:
+            rows = rows[:limit]
+            return rows, rows[-1].id
+        return rows, None
+
+    @classmethod
+    def _claim_pending(cls, worker_id, limit, lease_secs):
+        """
+        Claim up to limit PENDING objects for this worker so that several workers never process the same one.
+        Rows that are locked by another worker's claim transaction are skipped (SELECT ... FOR UPDATE SKIP LOCKED),
+        and rows whose lease expired because their worker died are reclaimed.
+        Requires the class to define State.PENDING, claimed_by, and lease_expires_at. If it also defines
+        next_attempt_at, rows that are waiting to be retried are skipped until they are due.
+        :param worker_id: Unique id of the worker (str)
+        :param limit: Maximum number of objects to claim (int)
+        :param lease_secs: Number of seconds the claim lasts unless renewed by claiming again (int)
+        :return: Return a list of the claimed objects
+        """
+        now = clock.utcnow()
+        query = session.query(cls).filter(cls.state == cls.State.PENDING,
+                                          or_(cls.claimed_by == None, cls.claimed_by == worker_id,
+                                              cls.lease_expires_at < now))
+        if hasattr(cls, "next_attempt_at"):
+            query = query.filter(or_(cls.next_attempt_at == None, cls.next_attempt_at <= now))
+        claimed = query.order_by(cls.id).limit(limit).with_for_update(skip_locked=True).all()
+
+        lease_expires_at = now + timedelta(seconds=lease_secs)
+        for obj in claimed:
+            if obj.claimed_by is not None and obj.claimed_by != worker_id:
+                logger.info("Reclaiming {} with ID {} from worker {} whose lease expired at {}".
+                            format(cls.__name__, obj.id, obj.claimed_by, obj.lease_expires_at))
+            obj.claimed_by = worker_id
+            obj.lease_expires_at = lease_expires_at
+        session.flush()
+
+        # Still need to call session.commit() to publish the lease and release the row locks.
+        return claimed
+
+    @classmethod
+    def _get_due_pending(cls):
+        """
+        Get the PENDING objects that are not waiting to be retried. Requires the class to define next_attempt_at.
+        :return: Return a list of objects
+        """
+        now = clock.utcnow()
+        return session.query(cls).filter(cls.state == cls.State.PENDING,
+                                         or_(cls.next_attempt_at == None, cls.next_attempt_at <= now)).all()
+
+    def _record_failed_attempt(self, error, max_attempts, base_backoff_secs, max_backoff_secs):
+        """
+        Record that processing this PENDING object failed, and either schedule the next attempt with exponential
+        backoff and jitter, or transition it to FAILED once it ran out of attempts.
+        Requires the class to define State.FAILED, attempts, next_attempt_at, and last_error.
+        :param error: Error message (str)
+        :param max_attempts: Maximum number of attempts (int)
+        :param base_backoff_secs: Backoff after the first failed attempt, which doubles after every attempt (int)
+        :param max_backoff_secs: Maximum backoff (int)
+        :return: Return True if it transitioned to FAILED, otherwise, False. Still need to call session.commit()
+        """
+        self.attempts = (self.attempts or 0) + 1
+        self.last_error = error[:self.MAX_ERROR_LENGTH] if error is not None else None
+
+        if self.attempts >= max_attempts:
+            self.set_state(self.State.FAILED)
+            self.next_attempt_at = None
+            self.update()
+            return True
+
+        # Wait between half and the full backoff so that specs that failed together do not retry together
+        backoff_secs = min(max_backoff_secs, base_backoff_secs * (2 ** (self.attempts - 1)))
+        backoff_secs = backoff_secs / 2.0 + random.random() * backoff_secs / 2.0
+        self.next_attempt_at = clock.utcnow() + timedelta(seconds=backoff_secs)
+        self.update()
+        return False
+
+    @classmethod
+    def _get_expiry_schedule(cls, states, ids=None):
+        """
+        Get the id and expires_at of the rows in the given states. Requires the class to define expires_at.
+        :param states: List of states (str)
+        :param ids: Optional list of ids (int PK). If None, get every row in those states.
+        :return: Return a list of 2-tuples <id (int), expires_at (Python DateTime object)>
+        """
+        if ids is not None and len(ids) == 0:
+            return []
+
+        query = session.query(cls.id, cls.expires_at).filter(cls.state.in_(states), cls.expires_at != None)
+        if ids is not None:
+            query = query.filter(cls.id.in_(ids))
+        return [(id, expires_at) for (id, expires_at) in query.all()]
+
+    @classmethod
+    def _bulk_transition(cls, from_state, to_state, ids=None):
+        """
+        Transition all of the rows in from_state (optionally restricted to the given ids) to to_state using
+        a single UPDATE statement. Requires the class to define ALLOWED_TRANSITIONS and STATE_TO_DATE_COLUMN.
+        :param from_state: Current state (str)
+        :param to_state: Desired state (str)
+        :param ids: Optional list of ids (int PK). If None, transition every row in from_state.
+        :return: Return the number of rows that were transitioned (int)
+        """
+        if to_state not in cls.ALLOWED_TRANSITIONS[from_state]:
+            raise Exception("Cannot transition from state {} to {}".format(from_state, to_state))
+
+        if ids is not None and len(ids) == 0:
+            return 0
+
+        now = clock.utcnow()
+        values = {cls.state: to_state}
+        date_column = cls.STATE_TO_DATE_COLUMN.get(to_state)
+        if date_column is not None:
+            values[getattr(cls, date_column)] = now
+        if to_state == cls.State.READY:
+            # The TTL is now relative to date_ready
+            values[cls.expires_at] = hours_after(now, cls.ttl_hours)
+
+        query = session.query(cls).filter(cls.state == from_state)
+        if ids is not None:
+            query = query.filter(cls.id.in_(ids))
+
+        # Still need to call session.commit()
+        return query.update(values, synchronize_session="fetch")
+
 
 class TrialRequest(Base):
     """
@@ -148,12 +476,20 @@ class TrialRequest(Base):
     state = Column(String(32), nullable=False)
     trial_type = Column(String(128), nullable=False)
 
-    start_date = Column(DateTime, default=datetime.utcnow, nullable=False)
+    start_date = Column(DateTime, default=clock.utcnow, nullable=False)
     cloud_provider = Column(String(128), nullable=False)
     create_cluster = Column(Boolean, nullable=False)
     notify_customer = Column(String(32), nullable=True)
 
+    # Work-claiming by a CLM worker, see claim_pending()
+    claimed_by = Column(String(128), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+
     __tablename__ = "trial_request"
+    __table_args__ = (
+        Index("ix_trial_request_state_start_date", "state", "start_date"),
+        Index("ix_trial_request_start_date", "start_date"),
+    )
 
     def __init__(self, first_name, last_name, email, title, company, ip, state, trial_type, start_date, cloud_provider, create_cluster, notify_customer):
         """
@@ -179,7 +515,7 @@ class TrialRequest(Base):
         self.ip = ip
         self.state = state
         self.trial_type = trial_type
-        self.start_date = start_date if start_date is not None else datetime.utcnow()
+        self.start_date = start_date if start_date is not None else clock.utcnow()
         self.cloud_provider = cloud_provider
         self.create_cluster = create_cluster
 
@@ -213,6 +549,18 @@ class TrialRequest(Base):
         trials = session.query(TrialRequest).filter_by(state=cls.State.PENDING).all()
         return trials
 
+    @classmethod
+    def claim_pending(cls, worker_id, limit, lease_secs):
+        """
+        Claim up to limit PENDING TrialRequest objects for this worker, skipping the ones claimed by other live workers
+        and reclaiming the ones whose worker's lease expired.
+        :param worker_id: Unique id of the worker (str)
+        :param limit: Maximum number of objects to claim (int)
+        :param lease_secs: Number of seconds the claim lasts unless renewed by claiming again (int)
+        :return: Return a list of TrialRequest objects. Still need to call session.commit() to publish the claim.
+        """
+        return cls._claim_pending(worker_id, limit, lease_secs)
+
     @classmethod
     def get_by_states_or_after_datetime(cls, states, date):
         """
@@ -223,6 +571,26 @@ class TrialRequest(Base):
         """
         return session.query(TrialRequest).filter(or_(TrialRequest.state.in_(states), TrialRequest.start_date >= date)).all()
 
+    @classmethod
+    def get_page(cls, cursor=None, limit=Base.PAGE_SIZE, since=None, states=None):
+        """
+        Get one page of TrialRequest objects from the newest to the oldest.
+        If both since and states are given, this pages through the same rows as get_by_states_or_after_datetime.
+        :param cursor: Cursor (int) returned by the previous page, or None for the first page.
+        :param limit: Maximum number of objects to return (int)
+        :param since: Optional Python DateTime object, only include the ones whose start_date >= since.
+        :param states: Optional list of states (str), only include the ones whose state matches.
+        :return: Return a 2-tuple of <list of TrialRequest objects, next cursor (int) or None if last page>
+        """
+        query = session.query(TrialRequest)
+        if since is not None and states is not None:
+            query = query.filter(or_(TrialRequest.state.in_(states), TrialRequest.start_date >= since))
+        elif since is not None:
+            query = query.filter(TrialRequest.start_date >= since)
+        elif states is not None:
+            query = query.filter(TrialRequest.state.in_(states))
+        return cls._get_page(query, cursor, limit)
+
     @classmethod
     def get_by_id(cls, id):
         """
@@ -243,13 +611,72 @@ class TrialRequest(Base):
         count = session.query(func.count(TrialRequest.id)).filter(TrialRequest.start_date >= date).scalar()
         return count
 
+    @classmethod
+    def count_created_by_hour(cls, since):
+        """
+        Count the TrialRequest objects per Cloud Provider and hour of their start_date with a single GROUP BY query,
+        e.g., to forecast the demand.
+        :param since: Python DateTime object, only count the ones whose start_date is >= it.
+        :return: Return a dictionary from the 2-tuple <cloud provider (str), start of the hour (Python DateTime object)>
+        to the number of TrialRequest objects (int)
+        """
+        bucket = hour_bucket(TrialRequest.start_date)
+        rows = session.query(TrialRequest.cloud_provider, bucket, func.count(TrialRequest.id)).\
+            filter(TrialRequest.start_date >= since).group_by(TrialRequest.cloud_provider, bucket).all()
+        return {(cloud_provider, datetime.strptime(hour, "%Y-%m-%d %H:%M:%S")): count for (cloud_provider, hour, count) in rows}
+
+    @classmethod
+    def count_by_state(cls, since=None, states=None):
+        """
+        Count the TrialRequest objects grouped by state with a single GROUP BY query.
+        If both arguments are given, this counts the same rows as get_by_states_or_after_datetime.
+        :param since: Optional Python DateTime object, only count the ones whose start_date >= since.
+        :param states: Optional list of states (str), only count the ones whose state matches.
+        :return: Return a dictionary from the state (str) to the number of TrialRequest objects (int)
+        """
+        query = session.query(TrialRequest.state, func.count(TrialRequest.id))
+        if since is not None and states is not None:
+            query = query.filter(or_(TrialRequest.state.in_(states), TrialRequest.start_date >= since))
+        elif since is not None:
+            query = query.filter(TrialRequest.start_date >= since)
+        elif states is not None:
+            query = query.filter(TrialRequest.state.in_(states))
+        return dict(query.group_by(TrialRequest.state).all())
+
+    @classmethod
+    def _count_pending_grouped_by(cls, column):
+        """
+        Count the PENDING TrialRequest objects grouped by a case-insensitive, trimmed column.
+        :param column: Column to group by, e.g., TrialRequest.company
+        :return: Return a dictionary from the lowercase and trimmed value (str) to the number of TrialRequest objects (int)
+        """
+        key = func.lower(func.trim(column))
+        query = session.query(key, func.count(TrialRequest.id)).filter(TrialRequest.state == cls.State.PENDING)
+        return dict(query.group_by(key).all())
+
+    @classmethod
+    def count_pending_by_company(cls):
+        """
+        Count the PENDING TrialRequest objects per company with a single GROUP BY query.
+        :return: Return a dictionary from the lowercase company (str) to the number of TrialRequest objects (int)
+        """
+        return cls._count_pending_grouped_by(TrialRequest.company)
+
+    @classmethod
+    def count_pending_by_email(cls):
+        """
+        Count the PENDING TrialRequest objects per email with a single GROUP BY query.
+        :return: Return a dictionary from the lowercase email (str) to the number of TrialRequest objects (int)
+        """
+        return cls._count_pending_grouped_by(TrialRequest.email)
+
     @classmethod
     def create_if_not_exists(cls, first_name, last_name, email, title, company, ip, cloud_provider, create_cluster, notify_customer=None):
         """
         Create a TrialRequest with an initial state.
         :return: Return the TrialRequest object that was created
         """
-        start_date = datetime.utcnow()
+        start_date = clock.utcnow()
         trial = TrialRequest(first_name=first_name, last_name=last_name, email=email, title=title, company=company,
                              ip=ip, state=cls.State.PENDING, trial_type=cls.Type.FREE, start_date=start_date, cloud_provider=cloud_provider,
                              create_cluster=create_cluster, notify_customer=notify_customer)
@@ -286,9 +713,14 @@ class NodeSpec(Base):
     class State:
         PENDING = "pending"
         FINISHED = "finished"
+        # Gave up after too many failed attempts
+        FAILED = "failed"
 
     DEFAULT_TTL_HOURS = 72
 
+    # Truncate last_error to the column length
+    MAX_ERROR_LENGTH = 1024
+
     cloud_provider = Column(String(128), nullable=False)
     region = Column(String(256), nullable=False)
     state = Column(String(32), nullable=False)
@@ -304,13 +736,27 @@ class NodeSpec(Base):
     install_ondemand = Column(Boolean, nullable=False)
 
     extra = Column(Text, nullable=True)
-    date_requested = Column(DateTime, default=datetime.utcnow, nullable=False)
+    date_requested = Column(DateTime, default=clock.utcnow, nullable=False)
     ttl_hours = Column(Integer, default=DEFAULT_TTL_HOURS, nullable=False)
 
     # Nullable FK
     trial_request_id = Column(Integer, ForeignKey("trial_request.id"))
 
+    # Work-claiming by a CLM worker, see claim_pending()
+    claimed_by = Column(String(128), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+
+    # Retries with backoff after failing to provision it, see record_failed_attempt()
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, nullable=True)
+    last_error = Column(String(1024), nullable=True)
+
     __tablename__ = "node_spec"
+    __table_args__ = (
+        Index("ix_node_spec_state_date_requested", "state", "date_requested"),
+        Index("ix_node_spec_trial_request_id", "trial_request_id"),
+        Index("ix_node_spec_state_next_attempt_at", "state", "next_attempt_at"),
+    )
 
     def __repr__(self):
         """
@@ -350,7 +796,7 @@ class NodeSpec(Base):
         self.mysql_version = mysql_version
         self.install_ondemand = install_ondemand
         self.extra = extra
-        self.date_requested = datetime.utcnow()
+        self.date_requested = clock.utcnow()
 
         # Current number of hours to expire after date_launched.
         # When expiring a resource, simply set it to 0
@@ -359,6 +805,9 @@ class NodeSpec(Base):
         # FK may be None
         self.trial_request_id = trial_request_id
 
+        # Not attempted yet
+        self.attempts = 0
+
     @classmethod
     def get_by_trial_request_id(cls, trial_request_id):
         """
@@ -380,11 +829,33 @@ class NodeSpec(Base):
     @classmethod
     def get_all_pending(cls):
         """
-        Get all NodeSpec objects whose state is PENDING.
+        Get all NodeSpec objects whose state is PENDING and that are due, i.e., not waiting to be retried.
         :return: Return a list of NodeSpec objects, which could be an empty list.
         """
-        trials = session.query(NodeSpec).filter_by(state=cls.State.PENDING).all()
-        return trials
+        return cls._get_due_pending()
+
+    @classmethod
+    def claim_pending(cls, worker_id, limit, lease_secs):
+        """
+        Claim up to limit PENDING NodeSpec objects for this worker, skipping the ones claimed by other live workers
+        and reclaiming the ones whose worker's lease expired.
+        :param worker_id: Unique id of the worker (str)
+        :param limit: Maximum number of objects to claim (int)
+        :param lease_secs: Number of seconds the claim lasts unless renewed by claiming again (int)
+        :return: Return a list of NodeSpec objects. Still need to call session.commit() to publish the claim.
+        """
+        return cls._claim_pending(worker_id, limit, lease_secs)
+
+    def record_failed_attempt(self, error, max_attempts, base_backoff_secs, max_backoff_secs):
+        """
+        Record that provisioning this NodeSpec failed, so it is retried after a backoff or given up on as FAILED.
+        :param error: Error message (str)
+        :param max_attempts: Maximum number of attempts (int)
+        :param base_backoff_secs: Backoff after the first failed attempt, which doubles after every attempt (int)
+        :param max_backoff_secs: Maximum backoff (int)
+        :return: Return True if it transitioned to FAILED, otherwise, False. Still need to call session.commit()
+        """
+        return self._record_failed_attempt(error, max_attempts, base_backoff_secs, max_backoff_secs)
 
     @classmethod
     def get_by_id(cls, id):
@@ -424,8 +895,9 @@ class NodeSpec(Base):
         :param state: Desired state, which must be one of NodeSpec.State
         """
         allowed_transitions = {
-            NodeSpec.State.PENDING: {NodeSpec.State.FINISHED, },
-            NodeSpec.State.FINISHED: {}
+            NodeSpec.State.PENDING: {NodeSpec.State.FINISHED, NodeSpec.State.FAILED},
+            NodeSpec.State.FINISHED: {},
+            NodeSpec.State.FAILED: {}
         }
 
         if state == self.state:
@@ -450,6 +922,21 @@ class Node(Base):
         EXPIRED = "expired"
         DELETED = "deleted"
 
+    # Used by both set_state and bulk_transition
+    ALLOWED_TRANSITIONS = {
+        State.LAUNCHED: {State.READY, State.EXPIRED},
+        State.READY: {State.EXPIRED},
+        State.EXPIRED: {State.DELETED},
+        State.DELETED: {}
+    }
+
+    # Date column to stamp when transitioning into that state
+    STATE_TO_DATE_COLUMN = {
+        State.READY: "date_ready",
+        State.EXPIRED: "date_expired",
+        State.DELETED: "date_deleted"
+    }
+
     cloud_provider = Column(String(128), nullable=False)
     region = Column(String(256), nullable=False)
     state = Column(String(32), nullable=False)
@@ -457,15 +944,28 @@ class Node(Base):
     node_ip = Column(String(256), nullable=True)
 
     ttl_hours = Column(Integer, nullable=False)
-    date_launched = Column(DateTime, default=datetime.utcnow, nullable=False)
+    date_launched = Column(DateTime, default=clock.utcnow, nullable=False)
     date_ready    = Column(DateTime, nullable=True)
     date_expired  = Column(DateTime, nullable=True)
     date_deleted  = Column(DateTime, nullable=True)
 
+    # Denormalized date_launched/date_ready + ttl_hours so that expiry is a single range scan.
+    expires_at    = Column(DateTime, nullable=True)
+
     # Nullable FK
     node_spec_id = Column(Integer, ForeignKey("node_spec.id"))
 
+    # Launched ahead of time and idle in the warm pool until a trial claims it, see claim_from_pool()
+    is_pooled = Column(Boolean, default=False, nullable=False)
+    date_claimed = Column(DateTime, nullable=True)
+
     __tablename__ = "node"
+    __table_args__ = (
+        Index("ix_node_state_expires_at", "state", "expires_at"),
+        Index("ix_node_state_date_launched", "state", "date_launched"),
+        Index("ix_node_node_spec_id", "node_spec_id"),
+        Index("ix_node_is_pooled_state_location", "is_pooled", "state", "cloud_provider", "region", "node_type"),
+    )
 
     def __repr__(self):
         """
@@ -507,10 +1007,12 @@ class Node(Base):
         self.node_type = node_type
         self.node_ip = node_ip
         self.ttl_hours = ttl_hours if ttl_hours >= 0 else 0
-        self.date_launched = datetime.utcnow()
+        self.date_launched = clock.utcnow()
+        self._update_expires_at()
 
         # FK
         self.node_spec_id = node_spec_id
+        self.is_pooled = False
 
     @classmethod
     def get_by_node_spec_id(cls, node_spec_id):
@@ -550,6 +1052,120 @@ class Node(Base):
         nodes = session.query(Node).filter(Node.state.in_(states)).all()
         return nodes
 
+    @classmethod
+    def get_page(cls, cursor=None, limit=Base.PAGE_SIZE, states=None):
+        """
+        Get one page of Node objects from the newest to the oldest.
+        :param cursor: Cursor (int) returned by the previous page, or None for the first page.
+        :param limit: Maximum number of objects to return (int)
+        :param states: Optional list of states (str), only include the ones whose state matches.
+        :return: Return a 2-tuple of <list of Node objects, next cursor (int) or None if last page>
+        """
+        query = session.query(Node)
+        if states is not None:
+            query = query.filter(Node.state.in_(states))
+        return cls._get_page(query, cursor, limit)
+
+    @classmethod
+    def count_by_state(cls, states=None, is_pooled=None):
+        """
+        Count the Node objects grouped by state with a single GROUP BY query.
+        :param states: Optional list of states (str), only count the ones whose state matches.
+        :param is_pooled: Optional boolean, only count the ones that are (or are not) idle in the warm pool.
+        :return: Return a dictionary from the state (str) to the number of Node objects (int)
+        """
+        query = session.query(Node.state, func.count(Node.id))
+        if states is not None:
+            query = query.filter(Node.state.in_(states))
+        if is_pooled is not None:
+            query = query.filter(Node.is_pooled == is_pooled)
+        return dict(query.group_by(Node.state).all())
+
+    @classmethod
+    def count_pooled(cls):
+        """
+        Count the LAUNCHED and READY Node objects in the warm pool with a single GROUP BY query.
+        :return: Return a dictionary from the 3-tuple <cloud provider (str), region (str), node type (str)> to the
+        number of Node objects (int)
+        """
+        rows = session.query(Node.cloud_provider, Node.region, Node.node_type, func.count(Node.id)).\
+            filter(Node.is_pooled == True, Node.state.in_([cls.State.LAUNCHED, cls.State.READY])).\
+            group_by(Node.cloud_provider, Node.region, Node.node_type).all()
+        return {(cloud_provider, region, node_type): count for (cloud_provider, region, node_type, count) in rows}
+
+    @classmethod
+    def create_pooled(cls, cloud_provider, region, node_type, ttl_hours):
+        """
+        Create a Node for the warm pool, which does not belong to any NodeSpec until it is claimed.
+        :param cloud_provider: Cloud Provider name (str)
+        :param region: Region name (str)
+        :param node_type: Node/VM type (str)
+        :param ttl_hours: Time to live in hours (int) while idle in the pool, after which it is expired and replaced.
+        :return: Return the Node object that was created. Still need to call node.save() and session.commit()
+        """
+        node = Node(cloud_provider=cloud_provider, region=region, node_type=node_type, node_ip=None, ttl_hours=ttl_hours,
+                    node_spec_id=None)
+        node.is_pooled = True
+        return node
+
+    @classmethod
+    def get_pooled_ids(cls, cloud_provider, region, node_type, limit):
+        """
+        Get the ids of the newest idle Node objects in the warm pool, e.g., to shrink the pool.
+        :param cloud_provider: Cloud Provider name (str)
+        :param region: Region name (str)
+        :param node_type: Node/VM type (str)
+        :param limit: Maximum number of ids (int)
+        :return: Return a list of ids (int PK)
+        """
+        rows = session.query(Node.id).filter(Node.is_pooled == True, Node.state.in_([cls.State.LAUNCHED, cls.State.READY]),
+                                             Node.cloud_provider == cloud_provider, Node.region == region,
+                                             Node.node_type == node_type).order_by(Node.id.desc()).limit(limit).all()
+        return [id for (id,) in rows]
+
+    @classmethod
+    def expire_pooled(cls, ids):
+        """
+        Expire the given Node objects with a single UPDATE statement as long as they are still idle in the warm pool,
+        so that a Node claimed by a trial in the meantime is never expired.
+        :param ids: List of ids (int PK)
+        :return: Return the number of Node objects that were expired (int). Still need to call session.commit()
+        """
+        if len(ids) == 0:
+            return 0
+        query = session.query(Node).filter(Node.id.in_(ids), Node.is_pooled == True,
+                                           Node.state.in_([cls.State.LAUNCHED, cls.State.READY]))
+        return query.update({Node.state: cls.State.EXPIRED, Node.date_expired: clock.utcnow()}, synchronize_session="fetch")
+
+    @classmethod
+    def claim_from_pool(cls, cloud_provider, region, node_type, node_spec, ttl_hours):
+        """
+        Atomically take the oldest READY Node out of the warm pool and hand it over to the NodeSpec. The row is locked
+        with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers never claim the same Node.
+        :param cloud_provider: Cloud Provider name (str)
+        :param region: Region name (str)
+        :param node_type: Node/VM type (str)
+        :param node_spec: NodeSpec object that was saved, whose id is set by the autoflush of this query.
+        :param ttl_hours: Time to live in hours (int) from now on.
+        :return: Return the Node object, or None if the pool is empty. Still need to call session.commit()
+        """
+        node = session.query(Node).filter(Node.is_pooled == True, Node.state == cls.State.READY,
+                                          Node.cloud_provider == cloud_provider, Node.region == region,
+                                          Node.node_type == node_type).\
+            order_by(Node.id).limit(1).with_for_update(skip_locked=True).first()
+        if node is None:
+            return None
+
+        now = clock.utcnow()
+        node.is_pooled = False
+        node.date_claimed = now
+        node.node_spec_id = node_spec.id
+        # The TTL is relative to date_claimed rather than to when it became ready in the pool.
+        node.ttl_hours = ttl_hours
+        node._update_expires_at()
+        node.update()
+        return node
+
     @classmethod
     def get_by_id(cls, id):
         """
@@ -582,51 +1198,64 @@ class Node(Base):
         return node
 
     @classmethod
-    def get_all_ready_to_expire(self):
+    def get_all_ready_to_expire(cls, ids=None):
         """
         Get a list of the Node objects that are ready to be expired. Their current state could be either
         LAUNCHED or READY.
+        This is a range scan on the (state, expires_at) index, so it only returns the rows that are due.
+        :param ids: Optional list of ids (int PK) to restrict the check to, e.g., the ones that the expiry scheduler
+        considers due. If None, check every Node.
         :return: Return a list of Node objects to expire.
         """
-        now = datetime.utcnow()
-
-        expired = []
+        if ids is not None and len(ids) == 0:
+            return []
 
-        launched = Node.get_by_state(Node.State.LAUNCHED)
-        for node in launched:
-            if Node.date_launched is not None and (node.date_launched + timedelta(hours=node.ttl_hours)) <= now:
-                expired.append(node)
+        now = clock.utcnow()
+        query = session.query(Node).filter(Node.state.in_([Node.State.LAUNCHED, Node.State.READY]),
+                                           Node.expires_at <= now)
+        if ids is not None:
+            query = query.filter(Node.id.in_(ids))
+        return query.all()
 
-        ready = Node.get_by_state(Node.State.READY)
-        for node in ready:
-            if node.date_ready is not None and (node.date_ready + timedelta(hours=node.ttl_hours)) <= now:
-                expired.append(node)
+    @classmethod
+    def get_expiry_schedule(cls, ids=None):
+        """
+        Get the expiry time of the Node objects that can still expire, i.e., LAUNCHED or READY, without loading
+        the full rows.
+        :param ids: Optional list of ids (int PK). If None, get all of them.
+        :return: Return a list of 2-tuples <id (int), expires_at (Python DateTime object)>
+        """
+        return cls._get_expiry_schedule([Node.State.LAUNCHED, Node.State.READY], ids)
 
-        return expired
+    @classmethod
+    def bulk_transition(cls, from_state, to_state, ids=None):
+        """
+        Transition many Node objects at once with a single UPDATE ... WHERE state=from_state AND id IN (ids),
+        which also stamps the corresponding date column. Enforces the same transitions as set_state.
+        :param from_state: Current state, which must be one of Node.State
+        :param to_state: Desired state, which must be one of Node.State
+        :param ids: Optional list of ids (int PK). If None, transition every Node in from_state.
+        :return: Return the number of Node objects that were transitioned (int)
+        """
+        return cls._bulk_transition(from_state, to_state, ids)
 
     def set_state(self, state):
         """
         Change the state as long as it is allowed.
         :param state: Desired state, which must be one of Node.State
         """
-        now = datetime.utcnow()
-
-        allowed_transitions = {
-            Node.State.LAUNCHED: {Node.State.READY, Node.State.EXPIRED},
-            Node.State.READY: {Node.State.EXPIRED},
-            Node.State.EXPIRED: {Node.State.DELETED},
-            Node.State.DELETED: {}
-        }
+        now = clock.utcnow()
 
         if state == self.state:
             return
 
-        allowed_states = allowed_transitions[self.state]
+        allowed_states = self.ALLOWED_TRANSITIONS[self.state]
         if state in allowed_states:
             self.state = state
 
             if state == Node.State.READY:
                 self.date_ready = now
+                self._update_expires_at()
             elif state == Node.State.EXPIRED:
                 self.date_expired = now
             elif state == Node.State.DELETED:
@@ -641,6 +1270,21 @@ class Node(Base):
         * expire (set to 0)
         """
         self.ttl_hours = ttl_hours
+        self._update_expires_at()
+
+    def _update_expires_at(self):
+        """
+        Recompute expires_at from the TTL and the date that the TTL is relative to, which is date_claimed once a trial
+        claimed it from the warm pool, date_ready once READY, and date_launched before that.
+        Must be called whenever ttl_hours, date_launched, date_ready, or date_claimed change.
+        """
+        base_date = self.date_launched
+        if self.date_claimed is not None:
+            base_date = self.date_claimed
+        elif self.date_ready is not None:
+            base_date = self.date_ready
+        if base_date is not None and self.ttl_hours is not None:
+            self.expires_at = base_date + timedelta(hours=self.ttl_hours)
 
 class ClusterSpec(Base):
     """
@@ -649,10 +1293,17 @@ class ClusterSpec(Base):
 
     class State:
         PENDING = "pending"
+        # Committed right before calling the Cloud Provider to create the cluster, see mark_in_flight()
+        IN_FLIGHT = "in_flight"
         FINISHED = "finished"
+        # Gave up after too many failed attempts
+        FAILED = "failed"
 
     DEFAULT_TTL_HOURS = 72
 
+    # Truncate last_error to the column length
+    MAX_ERROR_LENGTH = 1024
+
     # No guarantee we can actually request that name
     cluster_name = Column(String(128), nullable=True)
 
@@ -686,13 +1337,41 @@ class ClusterSpec(Base):
 
     extra = Column(Text, nullable=True)
 
-    date_requested = Column(DateTime, default=datetime.utcnow, nullable=False)
+    date_requested = Column(DateTime, default=clock.utcnow, nullable=False)
     ttl_hours = Column(Integer, default=DEFAULT_TTL_HOURS, nullable=False)
 
     # Nullable FK
     trial_request_id = Column(Integer, ForeignKey("trial_request.id"))
 
+    # Work-claiming by a CLM worker, see claim_pending()
+    claimed_by = Column(String(128), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+
+    # Retries with backoff after failing to provision it, see record_failed_attempt()
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, nullable=True)
+    last_error = Column(String(1024), nullable=True)
+
+    # Provisioning journal, see mark_in_flight()
+    idempotency_token = Column(String(64), nullable=True)
+    date_in_flight = Column(DateTime, nullable=True)
+
+    # Fingerprint of the resolved spec, see ClusterSpecModel.get_fingerprint()
+    fingerprint = Column(String(64), nullable=True)
+    # id of the existing Cluster that this spec was attached to instead of creating one, see Cluster.find_reusable().
+    # The cluster table already references cluster_spec, so use_alter marks this side of the cycle.
+    reused_cluster_id = Column(Integer, ForeignKey("cluster.id", use_alter=True,
+                                                   name="fk_cluster_spec_reused_cluster_id"))
+
     __tablename__ = "cluster_spec"
+    __table_args__ = (
+        Index("ix_cluster_spec_state_date_requested", "state", "date_requested"),
+        Index("ix_cluster_spec_trial_request_id", "trial_request_id"),
+        Index("ix_cluster_spec_state_next_attempt_at", "state", "next_attempt_at"),
+        Index("ix_cluster_spec_state_date_in_flight", "state", "date_in_flight"),
+        Index("ix_cluster_spec_idempotency_token", "idempotency_token", unique=True),
+        Index("ix_cluster_spec_fingerprint", "fingerprint"),
+    )
 
     def __repr__(self):
         """
@@ -701,7 +1380,7 @@ class ClusterSpec(Base):
         """
         # TODO, add more stuff here
         return u"<ClusterSpec(id: {}, cluster_name: {}, cloud_provider: {}, region: {}, state: {}, user: {}, trial_request_id: {})>". \
-            format(self.id, self.name, self.cloud_provider, self.region, self.state, self.user, self.trial_request_id)
+            format(self.id, self.cluster_name, self.cloud_provider, self.region, self.state, self.user, self.trial_request_id)
 
     def __init__(self, cluster_name, cloud_provider, region, user, num_head_nodes, head_node_type, num_worker_nodes, worker_node_type,
                  os_family, stack_version, cluster_type, jdk, storage, services, bootstrap_action,
@@ -734,12 +1413,15 @@ class ClusterSpec(Base):
         self.is_ssl = is_ssl
         self.is_kerberized = is_kerberized
         self.extra = extra
-        self.date_requested = datetime.utcnow()
+        self.date_requested = clock.utcnow()
         self.ttl_hours = ttl_hours if ttl_hours >= 0 else 0
 
         # FK may be None
         self.trial_request_id = trial_request_id
 
+        # Not attempted yet
+        self.attempts = 0
+
     @classmethod
     def get_by_trial_request_id(cls, trial_request_id):
         """
@@ -761,11 +1443,92 @@ class ClusterSpec(Base):
     @classmethod
     def get_all_pending(cls):
         """
-        Get all ClusterSpec objects whose state is PENDING.
+        Get all ClusterSpec objects whose state is PENDING and that are due, i.e., not waiting to be retried.
         :return: Return a list of ClusterSpec objects, which could be an empty list.
         """
-        trials = session.query(ClusterSpec).filter_by(state=cls.State.PENDING).all()
-        return trials
+        return cls._get_due_pending()
+
+    @classmethod
+    def claim_pending(cls, worker_id, limit, lease_secs):
+        """
+        Claim up to limit PENDING ClusterSpec objects for this worker, skipping the ones claimed by other live workers
+        and reclaiming the ones whose worker's lease expired.
+        :param worker_id: Unique id of the worker (str)
+        :param limit: Maximum number of objects to claim (int)
+        :param lease_secs: Number of seconds the claim lasts unless renewed by claiming again (int)
+        :return: Return a list of ClusterSpec objects. Still need to call session.commit() to publish the claim.
+        """
+        return cls._claim_pending(worker_id, limit, lease_secs)
+
+    @classmethod
+    def claim_stale_in_flight(cls, worker_id, before, limit, lease_secs):
+        """
+        Claim up to limit IN_FLIGHT ClusterSpec objects whose marker is older than the given date, which means that
+        the worker that was creating the cluster crashed or failed to save it. Rows locked by another worker are skipped,
+        and the claimed rows get a lease so that no other worker recovers them at the same time. The date_in_flight is
+        kept, since the cluster cannot be older than it.
+        :param worker_id: Unique id of the worker (str)
+        :param before: Python DateTime object
+        :param limit: Maximum number of objects to claim (int)
+        :param lease_secs: Number of seconds (int) until another worker can recover them again
+        :return: Return a list of ClusterSpec objects. Still need to call session.commit() to publish the claim.
+        """
+        now = clock.utcnow()
+        claimed = session.query(ClusterSpec).filter(ClusterSpec.state == cls.State.IN_FLIGHT, ClusterSpec.date_in_flight < before,
+                                                    or_(ClusterSpec.lease_expires_at.is_(None), ClusterSpec.lease_expires_at < now)).\
+            order_by(ClusterSpec.id).limit(limit).with_for_update(skip_locked=True).all()
+        lease_expires_at = now + timedelta(seconds=lease_secs)
+        for spec in claimed:
+            spec.claimed_by = worker_id
+            spec.lease_expires_at = lease_expires_at
+        session.flush()
+        return claimed
+
+    def get_idempotency_token(self):
+        """
+        Get the token that identifies the cluster created for this ClusterSpec, which is deterministic so that every
+        attempt and every worker uses the same one.
+        :return: Return the token (str)
+        """
+        return "clm-cluster-spec-{}".format(self.id)
+
+    def mark_in_flight(self):
+        """
+        Record that the cluster is about to be created by the Cloud Provider with this ClusterSpec's idempotency token.
+        This must be committed before calling the Cloud Provider, so that if the CLM crashes before saving the Cluster,
+        the cluster is found by its token and adopted instead of being created again.
+        Still need to call session.commit()
+        """
+        self.set_state(self.State.IN_FLIGHT)
+        self.idempotency_token = self.get_idempotency_token()
+        self.date_in_flight = clock.utcnow()
+        self.update()
+
+    def record_failed_attempt(self, error, max_attempts, base_backoff_secs, max_backoff_secs):
+        """
+        Record that provisioning this ClusterSpec failed, so it is retried after a backoff or given up on as FAILED.
+        If it was IN_FLIGHT, the caller must have checked that no cluster was created with its idempotency token.
+        :param error: Error message (str)
+        :param max_attempts: Maximum number of attempts (int)
+        :param base_backoff_secs: Backoff after the first failed attempt, which doubles after every attempt (int)
+        :param max_backoff_secs: Maximum backoff (int)
+        :return: Return True if it transitioned to FAILED, otherwise, False. Still need to call session.commit()
+        """
+        if self.state == self.State.IN_FLIGHT:
+            self.set_state(self.State.PENDING)
+        return self._record_failed_attempt(error, max_attempts, base_backoff_secs, max_backoff_secs)
+
+    @classmethod
+    def count_by_state(cls, states=None):
+        """
+        Count the ClusterSpec objects grouped by state with a single GROUP BY query.
+        :param states: Optional list of states (str), only count the ones whose state matches.
+        :return: Return a dictionary from the state (str) to the number of ClusterSpec objects (int)
+        """
+        query = session.query(ClusterSpec.state, func.count(ClusterSpec.id))
+        if states is not None:
+            query = query.filter(ClusterSpec.state.in_(states))
+        return dict(query.group_by(ClusterSpec.state).all())
 
     @classmethod
     def get_by_id(cls, id):
@@ -809,8 +1572,10 @@ class ClusterSpec(Base):
         :param state: Desired state, which must be one of NodeSpec.State
         """
         allowed_transitions = {
-            ClusterSpec.State.PENDING: {ClusterSpec.State.FINISHED, },
-            ClusterSpec.State.FINISHED: {}
+            ClusterSpec.State.PENDING: {ClusterSpec.State.IN_FLIGHT, ClusterSpec.State.FINISHED, ClusterSpec.State.FAILED},
+            ClusterSpec.State.IN_FLIGHT: {ClusterSpec.State.PENDING, ClusterSpec.State.FINISHED, ClusterSpec.State.FAILED},
+            ClusterSpec.State.FINISHED: {},
+            ClusterSpec.State.FAILED: {}
         }
 
         if state == self.state:
@@ -835,6 +1600,21 @@ class Cluster(Base):
         EXPIRED = "expired"
         DELETED = "deleted"
 
+    # Used by both set_state and bulk_transition
+    ALLOWED_TRANSITIONS = {
+        State.LAUNCHED: {State.READY, State.EXPIRED},
+        State.READY: {State.EXPIRED},
+        State.EXPIRED: {State.DELETED},
+        State.DELETED: {}
+    }
+
+    # Date column to stamp when transitioning into that state
+    STATE_TO_DATE_COLUMN = {
+        State.READY: "date_ready",
+        State.EXPIRED: "date_expired",
+        State.DELETED: "date_deleted"
+    }
+
     # The actual ID and Name assigned by the Cloud Provider, which over time may not be unique.
     cluster_id = Column(String(256), nullable=True)
     cluster_name = Column(String(256), nullable=True)
@@ -846,15 +1626,27 @@ class Cluster(Base):
     config = Column(Text, nullable=True)
 
     ttl_hours = Column(Integer, nullable=False)
-    date_launched = Column(DateTime, default=datetime.utcnow, nullable=False)
+    date_launched = Column(DateTime, default=clock.utcnow, nullable=False)
     date_ready    = Column(DateTime, nullable=True)
     date_expired  = Column(DateTime, nullable=True)
     date_deleted  = Column(DateTime, nullable=True)
 
+    # Denormalized date_launched/date_ready + ttl_hours so that expiry is a single range scan.
+    expires_at    = Column(DateTime, nullable=True)
+
     # Nullable FK
     cluster_spec_id = Column(Integer, ForeignKey("cluster_spec.id"))
 
+    # Fingerprint of the ClusterSpec it was created from, see find_reusable()
+    fingerprint = Column(String(64), nullable=True)
+
     __tablename__ = "cluster"
+    __table_args__ = (
+        Index("ix_cluster_state_expires_at", "state", "expires_at"),
+        Index("ix_cluster_state_date_launched", "state", "date_launched"),
+        Index("ix_cluster_cluster_spec_id", "cluster_spec_id"),
+        Index("ix_cluster_fingerprint_state_expires_at", "fingerprint", "state", "expires_at"),
+    )
 
     def __repr__(self):
         """
@@ -901,7 +1693,8 @@ class Cluster(Base):
         # Current number of hours to expire after date_launched.
         # When expiring a resource, simply set it to 0
         self.ttl_hours = ttl_hours if ttl_hours >= 0 else 0
-        self.date_launched = datetime.utcnow()
+        self.date_launched = clock.utcnow()
+        self._update_expires_at()
 
         # FK
         self.cluster_spec_id = cluster_spec_id
@@ -916,6 +1709,32 @@ class Cluster(Base):
         node = session.query(Cluster).filter_by(cluster_spec_id=cluster_spec_id).all()
         return node
 
+    @classmethod
+    def find_reusable(cls, fingerprint, min_expires_at):
+        """
+        Find a READY Cluster with the given fingerprint that expires after the given date, preferring the one that
+        expires last. Its row is locked until the transaction ends so that it is not expired in the meantime.
+        :param fingerprint: Fingerprint (str) of a ClusterSpec
+        :param min_expires_at: Python DateTime object
+        :return: Return the Cluster object, or None if there is none.
+        """
+        return session.query(Cluster).filter(Cluster.fingerprint == fingerprint, Cluster.state == cls.State.READY,
+                                             Cluster.expires_at >= min_expires_at).\
+            order_by(Cluster.expires_at.desc()).limit(1).with_for_update().first()
+
+    def extend_ttl(self, expires_at):
+        """
+        Increase the TTL so that the Cluster does not expire before the given date. Never shortens it.
+        :param expires_at: Python DateTime object
+        Still need to call session.commit()
+        """
+        if self.expires_at is not None and self.expires_at >= expires_at:
+            return
+        base_date = self.date_ready if self.date_ready is not None else self.date_launched
+        self.ttl_hours = int(math.ceil((expires_at - base_date).total_seconds() / 3600.0))
+        self._update_expires_at()
+        self.update()
+
     @classmethod
     def get_all(cls):
         """
@@ -944,6 +1763,32 @@ class Cluster(Base):
         nodes = session.query(Cluster).filter(Cluster.state.in_(states)).all()
         return nodes
 
+    @classmethod
+    def get_page(cls, cursor=None, limit=Base.PAGE_SIZE, states=None):
+        """
+        Get one page of Cluster objects from the newest to the oldest.
+        :param cursor: Cursor (int) returned by the previous page, or None for the first page.
+        :param limit: Maximum number of objects to return (int)
+        :param states: Optional list of states (str), only include the ones whose state matches.
+        :return: Return a 2-tuple of <list of Cluster objects, next cursor (int) or None if last page>
+        """
+        query = session.query(Cluster)
+        if states is not None:
+            query = query.filter(Cluster.state.in_(states))
+        return cls._get_page(query, cursor, limit)
+
+    @classmethod
+    def count_by_state(cls, states=None):
+        """
+        Count the Cluster objects grouped by state with a single GROUP BY query.
+        :param states: Optional list of states (str), only count the ones whose state matches.
+        :return: Return a dictionary from the state (str) to the number of Cluster objects (int)
+        """
+        query = session.query(Cluster.state, func.count(Cluster.id))
+        if states is not None:
+            query = query.filter(Cluster.state.in_(states))
+        return dict(query.group_by(Cluster.state).all())
+
     @classmethod
     def get_by_id(cls, id):
         """
@@ -979,51 +1824,64 @@ class Cluster(Base):
         return cluster
 
     @classmethod
-    def get_all_ready_to_expire(self):
+    def get_all_ready_to_expire(cls, ids=None):
         """
         Get a list of the Cluster objects that are ready to be expired. Their current state could be either
         LAUNCHED or READY.
+        This is a range scan on the (state, expires_at) index, so it only returns the rows that are due.
+        :param ids: Optional list of ids (int PK) to restrict the check to, e.g., the ones that the expiry scheduler
+        considers due. If None, check every Cluster.
         :return: Return a list of Cluster objects to expire.
         """
-        now = datetime.utcnow()
-
-        expired = []
+        if ids is not None and len(ids) == 0:
+            return []
 
-        launched = Cluster.get_by_state(Cluster.State.LAUNCHED)
-        for cluster in launched:
-            if cluster.date_launched is not None and (cluster.date_launched + timedelta(hours=cluster.ttl_hours)) <= now:
-                expired.append(cluster)
+        now = clock.utcnow()
+        query = session.query(Cluster).filter(Cluster.state.in_([Cluster.State.LAUNCHED, Cluster.State.READY]),
+                                              Cluster.expires_at <= now)
+        if ids is not None:
+            query = query.filter(Cluster.id.in_(ids))
+        return query.all()
 
-        ready = Cluster.get_by_state(Cluster.State.READY)
-        for cluster in ready:
-            if cluster.date_ready is not None and (cluster.date_ready + timedelta(hours=cluster.ttl_hours)) <= now:
-                expired.append(cluster)
+    @classmethod
+    def get_expiry_schedule(cls, ids=None):
+        """
+        Get the expiry time of the Cluster objects that can still expire, i.e., LAUNCHED or READY, without loading
+        the full rows.
+        :param ids: Optional list of ids (int PK). If None, get all of them.
+        :return: Return a list of 2-tuples <id (int), expires_at (Python DateTime object)>
+        """
+        return cls._get_expiry_schedule([Cluster.State.LAUNCHED, Cluster.State.READY], ids)
 
-        return expired
+    @classmethod
+    def bulk_transition(cls, from_state, to_state, ids=None):
+        """
+        Transition many Cluster objects at once with a single UPDATE ... WHERE state=from_state AND id IN (ids),
+        which also stamps the corresponding date column. Enforces the same transitions as set_state.
+        :param from_state: Current state, which must be one of Cluster.State
+        :param to_state: Desired state, which must be one of Cluster.State
+        :param ids: Optional list of ids (int PK). If None, transition every Cluster in from_state.
+        :return: Return the number of Cluster objects that were transitioned (int)
+        """
+        return cls._bulk_transition(from_state, to_state, ids)
 
     def set_state(self, state):
         """
         Change the state as long as it is allowed.
         :param state: Desired state, which must be one of Cluster.State
         """
-        now = datetime.utcnow()
-
-        allowed_transitions = {
-            Cluster.State.LAUNCHED: {Cluster.State.READY, Cluster.State.EXPIRED},
-            Cluster.State.READY: {Cluster.State.EXPIRED},
-            Cluster.State.EXPIRED: {Cluster.State.DELETED},
-            Cluster.State.DELETED: {}
-        }
+        now = clock.utcnow()
 
         if state == self.state:
             return
 
-        allowed_states = allowed_transitions[self.state]
+        allowed_states = self.ALLOWED_TRANSITIONS[self.state]
         if state in allowed_states:
             self.state = state
 
             if state == Cluster.State.READY:
                 self.date_ready = now
+                self._update_expires_at()
             elif state == Cluster.State.EXPIRED:
                 self.date_expired = now
             elif state == Cluster.State.DELETED:
@@ -1038,3 +1896,90 @@ class Cluster(Base):
         * expire (set to 0)
         """
         self.ttl_hours = ttl_hours
+        self._update_expires_at()
+
+    def _update_expires_at(self):
+        """
+        Recompute expires_at from the TTL and the date that the TTL is relative to, which is
+        date_ready once READY and date_launched before that.
+        Must be called whenever ttl_hours, date_launched, or date_ready change.
+        """
+        base_date = self.date_ready if self.date_ready is not None else self.date_launched
+        if base_date is not None and self.ttl_hours is not None:
+            self.expires_at = base_date + timedelta(hours=self.ttl_hours)
+
+
+class Notification(Base):
+    """
+    Represents a signal from the webapp to the CLM daemon that there is new work, so the daemon can wake up immediately
+    instead of waiting for its next full sweep. Each daemon remembers the highest id it has seen, so polling is a cheap
+    range scan on the PK, and old rows are pruned periodically.
+    """
+
+    class Topic:
+        TRIAL_REQUEST = "trial_request"
+        CLUSTER_SPEC = "cluster_spec"
+        NODE_TTL = "node_ttl"
+        CLUSTER_TTL = "cluster_ttl"
+
+        ALL = [TRIAL_REQUEST, CLUSTER_SPEC, NODE_TTL, CLUSTER_TTL]
+
+    topic = Column(String(32), nullable=False)
+    # ID of the TrialRequest, ClusterSpec, Node, or Cluster, depending on the topic
+    entity_id = Column(Integer, nullable=True)
+    date_created = Column(DateTime, default=clock.utcnow, nullable=False)
+
+    __tablename__ = "notification"
+    __table_args__ = (
+        Index("ix_notification_date_created", "date_created"),
+    )
+
+    def __repr__(self):
+        """
+        Machine-readable representation of this object.
+        :return: Return a machine-readable string that exactly describes this object.
+        """
+        return "<Notification(id={}, topic={}, entity_id={}, date_created={})>".format(
+            self.id, self.topic, self.entity_id, self.date_created)
+
+    @classmethod
+    def create(cls, topic, entity_id=None):
+        """
+        Create a Notification. It should be saved in the same transaction as the change it signals.
+        :param topic: Topic (str), which must be one of Notification.Topic
+        :param entity_id: Optional ID (int) of the entity that changed
+        :return: Return the Notification object that was created
+        """
+        if topic not in cls.Topic.ALL:
+            raise Exception("Notification topic {} must be one of {}".format(topic, ", ".join(cls.Topic.ALL)))
+
+        notification = Notification(topic=topic, entity_id=entity_id, date_created=clock.utcnow())
+        # Still need to call notification.save() and session.commit()
+        return notification
+
+    @classmethod
+    def get_max_id(cls):
+        """
+        Get the highest Notification id, which is where a daemon that just started should begin polling.
+        :return: Return the id (int), or 0 if there are none.
+        """
+        max_id = session.query(func.max(Notification.id)).scalar()
+        return max_id if max_id is not None else 0
+
+    @classmethod
+    def get_after_id(cls, last_id):
+        """
+        Get the Notification objects whose id is > last_id, from the oldest to the newest.
+        :param last_id: Highest id (int) that was already seen
+        :return: Return a list of Notification objects, which could be an empty list.
+        """
+        return session.query(Notification).filter(Notification.id > last_id).order_by(Notification.id).all()
+
+    @classmethod
+    def delete_before_datetime(cls, date):
+        """
+        Delete the Notification objects created before the given date with a single statement.
+        :param date: Python DateTime object
+        :return: Return the number of rows deleted (int). Still need to call session.commit()
+        """
+        return session.query(Notification).filter(Notification.date_created < date).delete(synchronize_session=False)
@@ -0,0 +1,21 @@
+USE `clm` ;
+
+-- -----------------------------------------------------
+-- Persist the expiration time of Nodes and Clusters so that the CLM can
+-- select the ones that are due with a single range scan on (state, expires_at)
+-- instead of computing date + ttl_hours for every LAUNCHED and READY row.
+-- -----------------------------------------------------
+ALTER TABLE `node`
+  ADD COLUMN `expires_at` DATETIME NULL AFTER `date_deleted`,
+  ADD INDEX `ix_node_state_expires_at` (`state`, `expires_at`);
+
+ALTER TABLE `cluster`
+  ADD COLUMN `expires_at` DATETIME NULL AFTER `date_deleted`,
+  ADD INDEX `ix_cluster_state_expires_at` (`state`, `expires_at`);
+
+-- Backfill existing rows, the TTL is relative to date_ready once READY and date_launched before that.
+UPDATE `node`
+  SET `expires_at` = DATE_ADD(COALESCE(`date_ready`, `date_launched`), INTERVAL `ttl_hours` HOUR);
+
+UPDATE `cluster`
+  SET `expires_at` = DATE_ADD(COALESCE(`date_ready`, `date_launched`), INTERVAL `ttl_hours` HOUR);
@@ -0,0 +1,26 @@
+USE `clm` ;
+
+-- -----------------------------------------------------
+-- Secondary indexes for the queries that the CLM runs on every loop and that the webapp runs on every page.
+-- The FK lookup indexes replace the ones that InnoDB creates implicitly for the FK constraints.
+-- -----------------------------------------------------
+
+-- TrialRequest.get_all_pending, get_by_states_or_after_datetime, get_num_created_after_datetime
+CREATE INDEX `ix_trial_request_state_start_date` ON `trial_request` (`state`, `start_date`);
+CREATE INDEX `ix_trial_request_start_date` ON `trial_request` (`start_date`);
+
+-- NodeSpec.get_all_pending, get_by_trial_request_id
+CREATE INDEX `ix_node_spec_state_date_requested` ON `node_spec` (`state`, `date_requested`);
+CREATE INDEX `ix_node_spec_trial_request_id` ON `node_spec` (`trial_request_id`);
+
+-- ClusterSpec.get_all_pending, get_by_trial_request_id
+CREATE INDEX `ix_cluster_spec_state_date_requested` ON `cluster_spec` (`state`, `date_requested`);
+CREATE INDEX `ix_cluster_spec_trial_request_id` ON `cluster_spec` (`trial_request_id`);
+
+-- Node.get_by_state, get_by_states, get_by_node_spec_id
+CREATE INDEX `ix_node_state_date_launched` ON `node` (`state`, `date_launched`);
+CREATE INDEX `ix_node_node_spec_id` ON `node` (`node_spec_id`);
+
+-- Cluster.get_by_state, get_by_states, get_by_cluster_spec_id
+CREATE INDEX `ix_cluster_state_date_launched` ON `cluster` (`state`, `date_launched`);
+CREATE INDEX `ix_cluster_cluster_spec_id` ON `cluster` (`cluster_spec_id`);
@@ -0,0 +1,17 @@
+USE `clm` ;
+
+-- -----------------------------------------------------
+-- Let several CLM workers run concurrently. A worker claims PENDING rows with
+-- SELECT ... FOR UPDATE SKIP LOCKED and records itself as the owner until the lease expires.
+-- -----------------------------------------------------
+ALTER TABLE `trial_request`
+  ADD COLUMN `claimed_by` VARCHAR(128) NULL,
+  ADD COLUMN `lease_expires_at` DATETIME NULL;
+
+ALTER TABLE `node_spec`
+  ADD COLUMN `claimed_by` VARCHAR(128) NULL,
+  ADD COLUMN `lease_expires_at` DATETIME NULL;
+
+ALTER TABLE `cluster_spec`
+  ADD COLUMN `claimed_by` VARCHAR(128) NULL,
+  ADD COLUMN `lease_expires_at` DATETIME NULL;
@@ -0,0 +1,16 @@
+USE `clm` ;
+
+-- -----------------------------------------------------
+-- Table `notification`
+-- Written by the webapp in the same transaction as a new trial request, cluster spec, or TTL change
+-- so that the CLM daemon wakes up immediately. The daemon polls by id and prunes old rows.
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS `notification` (
+  `id` INT NOT NULL AUTO_INCREMENT,
+  `topic` VARCHAR(32) NOT NULL,
+  `entity_id` INT NULL,
+  `date_created` DATETIME NOT NULL,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+
+CREATE INDEX `ix_notification_date_created` ON `notification` (`date_created`);
@@ -0,0 +1,18 @@
+USE `clm` ;
+
+-- -----------------------------------------------------
+-- Retry the Node and Cluster Specs that failed to provision with exponential backoff,
+-- and give up on them as 'failed' after too many attempts.
+-- -----------------------------------------------------
+ALTER TABLE `node_spec`
+  ADD COLUMN `attempts` INT NOT NULL DEFAULT 0,
+  ADD COLUMN `next_attempt_at` DATETIME NULL,
+  ADD COLUMN `last_error` VARCHAR(1024) NULL;
+
+ALTER TABLE `cluster_spec`
+  ADD COLUMN `attempts` INT NOT NULL DEFAULT 0,
+  ADD COLUMN `next_attempt_at` DATETIME NULL,
+  ADD COLUMN `last_error` VARCHAR(1024) NULL;
+
+CREATE INDEX `ix_node_spec_state_next_attempt_at` ON `node_spec` (`state`, `next_attempt_at`);
+CREATE INDEX `ix_cluster_spec_state_next_attempt_at` ON `cluster_spec` (`state`, `next_attempt_at`);
@@ -0,0 +1,13 @@
+USE `clm` ;
+
+-- -----------------------------------------------------
+-- Provisioning journal. A Cluster Spec is marked 'in_flight' with a deterministic idempotency token
+-- (committed) before the Cloud Provider is asked to create the cluster, which is tagged with that token.
+-- If the CLM crashes before saving the Cluster, it finds the cluster by its tag and adopts it.
+-- -----------------------------------------------------
+ALTER TABLE `cluster_spec`
+  ADD COLUMN `idempotency_token` VARCHAR(64) NULL,
+  ADD COLUMN `date_in_flight` DATETIME NULL;
+
+CREATE INDEX `ix_cluster_spec_state_date_in_flight` ON `cluster_spec` (`state`, `date_in_flight`);
+CREATE UNIQUE INDEX `ix_cluster_spec_idempotency_token` ON `cluster_spec` (`idempotency_token`);
@@ -0,0 +1,10 @@
+USE `clm` ;
+
+-- -----------------------------------------------------
+-- Warm pool of Nodes that are launched ahead of time and handed over to a trial when it is approved.
+-- -----------------------------------------------------
+ALTER TABLE `node`
+  ADD COLUMN `is_pooled` BOOLEAN NOT NULL DEFAULT FALSE,
+  ADD COLUMN `date_claimed` DATETIME NULL;
+
+CREATE INDEX `ix_node_is_pooled_state_location` ON `node` (`is_pooled`, `state`, `cloud_provider`, `region`, `node_type`);
@@ -0,0 +1,19 @@
+USE `clm` ;
+
+-- -----------------------------------------------------
+-- Fingerprint of the resolved Cluster Spec, so that a new spec can reuse a READY cluster of the same shape.
+-- -----------------------------------------------------
+ALTER TABLE `cluster_spec`
+  ADD COLUMN `fingerprint` VARCHAR(64) NULL,
+  ADD COLUMN `reused_cluster_id` INT NULL,
+  ADD CONSTRAINT `fk_cluster_spec_reused_cluster_id`
+    FOREIGN KEY (`reused_cluster_id`)
+    REFERENCES `cluster` (`id`)
+    ON DELETE NO ACTION
+    ON UPDATE NO ACTION;
+
+ALTER TABLE `cluster`
+  ADD COLUMN `fingerprint` VARCHAR(64) NULL;
+
+CREATE INDEX `ix_cluster_spec_fingerprint` ON `cluster_spec` (`fingerprint`);
+CREATE INDEX `ix_cluster_fingerprint_state_expires_at` ON `cluster` (`fingerprint`, `state`, `expires_at`);
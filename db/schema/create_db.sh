@@ -52,4 +52,9 @@ cmd="mysql -h localhost -u root -p -e \"FLUSH PRIVILEGES;\""
 echo $cmd
 eval "$cmd"
 
+echo "Applying schema migrations"
+cmd="python ../migrate.py"
+echo $cmd
+eval "$cmd"
+
 echo "Done"
\ No newline at end of file
@@ -10,7 +10,7 @@ import logging
 root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append(root_dir)
 
-from saas.db.models import DBRunner, TrialRequest, NodeSpec, Node, ClusterSpec, Cluster
+from saas.db.models import DBRunner, TrialRequest, NodeSpec, Node, ClusterSpec, Cluster, Notification
 
 
 class Manager(object):
@@ -42,9 +42,16 @@ class Manager(object):
         Connect to the MySQL database.
         """
         DBRunner.DEBUG = False
-        self.session, self.engine = DBRunner.setup_session(DBRunner.get_unravel_jdbc_url())
+        # Each request thread gets its own session, see remove_session()
+        self.session, self.engine = DBRunner.setup_session(DBRunner.get_unravel_jdbc_url(), scoped=True)
         self.logger.info("Connected to the DB successfully")
 
+    def remove_session(self):
+        """
+        Discard the DB session of the current request. Must be called when the request is torn down.
+        """
+        DBRunner.remove_session()
+
     def get_active_trials(self):
         """
         Get all currently active trials.
@@ -82,6 +89,77 @@ class Manager(object):
         clusters = Cluster.get_by_states([Node.State.LAUNCHED, Node.State.READY, Node.State.EXPIRED])
         return clusters
 
+    def get_relevant_trials_page(self, start_date, cursor=None, limit=None):
+        """
+        Get one page of the trials returned by get_relevant_trials, from the newest to the oldest.
+        :param start_date: Python DateTime object of the start date.
+        :param cursor: Cursor (int) returned by the previous page, or None for the first page.
+        :param limit: Maximum number of trials (int), or None to use the default page size.
+        :return: Return a 2-tuple of <list of TrialRequest objects, next cursor (int) or None if last page>
+        """
+        self.logger.info("Getting page of relevant trials since {} before cursor {}".format(start_date, cursor))
+        limit = limit if limit is not None else TrialRequest.PAGE_SIZE
+        return TrialRequest.get_page(cursor, limit, since=start_date, states=[TrialRequest.State.PENDING])
+
+    def get_relevant_nodes_page(self, cursor=None, limit=None):
+        """
+        Get one page of the Nodes returned by get_relevant_nodes, from the newest to the oldest.
+        :param cursor: Cursor (int) returned by the previous page, or None for the first page.
+        :param limit: Maximum number of Nodes (int), or None to use the default page size.
+        :return: Return a 2-tuple of <list of Node objects, next cursor (int) or None if last page>
+        """
+        self.logger.info("Getting page of relevant nodes before cursor {}".format(cursor))
+        limit = limit if limit is not None else Node.PAGE_SIZE
+        return Node.get_page(cursor, limit, states=[Node.State.LAUNCHED, Node.State.READY, Node.State.EXPIRED])
+
+    def get_relevant_clusters_page(self, cursor=None, limit=None):
+        """
+        Get one page of the Clusters returned by get_relevant_clusters, from the newest to the oldest.
+        :param cursor: Cursor (int) returned by the previous page, or None for the first page.
+        :param limit: Maximum number of Clusters (int), or None to use the default page size.
+        :return: Return a 2-tuple of <list of Cluster objects, next cursor (int) or None if last page>
+        """
+        self.logger.info("Getting page of relevant clusters before cursor {}".format(cursor))
+        limit = limit if limit is not None else Cluster.PAGE_SIZE
+        return Cluster.get_page(cursor, limit, states=[Cluster.State.LAUNCHED, Cluster.State.READY, Cluster.State.EXPIRED])
+
+    def get_relevant_trial_state_counts(self, start_date):
+        """
+        Count the trials returned by get_relevant_trials by state.
+        :param start_date: Python DateTime object of the start date.
+        :return: Return a dictionary from the state (str) to the count (int)
+        """
+        return TrialRequest.count_by_state(since=start_date, states=[TrialRequest.State.PENDING])
+
+    def get_relevant_node_state_counts(self):
+        """
+        Count the Nodes returned by get_relevant_nodes by state.
+        :return: Return a dictionary from the state (str) to the count (int)
+        """
+        return Node.count_by_state([Node.State.LAUNCHED, Node.State.READY, Node.State.EXPIRED])
+
+    def get_relevant_cluster_state_counts(self):
+        """
+        Count the Clusters returned by get_relevant_clusters by state.
+        :return: Return a dictionary from the state (str) to the count (int)
+        """
+        return Cluster.count_by_state([Cluster.State.LAUNCHED, Cluster.State.READY, Cluster.State.EXPIRED])
+
+    def get_node_state_counts(self):
+        """
+        Count all of the Nodes by state.
+        :return: Return a dictionary from the state (str) to the count (int)
+        """
+        return Node.count_by_state()
+
+    def get_num_active_trials(self):
+        """
+        Get the number of currently active trials without loading them.
+        :return: Return the count (int)
+        """
+        counts = TrialRequest.count_by_state(states=[TrialRequest.State.PENDING])
+        return counts.get(TrialRequest.State.PENDING, 0)
+
     def check_resource(self, type, object_id):
         response = {
             "status": None,
@@ -139,6 +217,8 @@ class Manager(object):
             trial = TrialRequest.create_if_not_exists(first_name, last_name, email, title, company, ip, cloud_provider,
                                                       create_cluster, notify_customer=notify_customer)
             trial.save()
+            # Wake up the CLM daemon as soon as this commits
+            Notification.create(Notification.Topic.TRIAL_REQUEST, trial.id).save()
             self.session.commit()
             return trial.id
         except Exception as err:
@@ -196,6 +276,7 @@ class Manager(object):
                                                             is_hdfs_ha, is_rm_ha, is_ssl, is_kerberized,
                                                             extra, ttl_hours, None)
             cluster_spec.save()
+            Notification.create(Notification.Topic.CLUSTER_SPEC, cluster_spec.id).save()
             self.session.commit()
             response["status"] = "success"
             response["cluster_spec_id"] = cluster_spec.id
@@ -253,6 +334,9 @@ class Manager(object):
                 resource.set_ttl_hours(resource.ttl_hours + extra_hours)
 
             self.session.add(resource)
+            # Let the CLM daemon reschedule its expiry
+            topic = Notification.Topic.CLUSTER_TTL if resource_type.lower() == "cluster" else Notification.Topic.NODE_TTL
+            Notification.create(topic, resource.id).save()
             self.session.commit()
         except Exception as err:
             status = "error"
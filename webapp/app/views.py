@@ -16,8 +16,20 @@ from .util.rules import RuleEmail
 from . import manager
 from .helpers.constants import Conversion
 
+
+@app.teardown_appcontext
+def remove_db_session(exception=None):
+    """
+    Discard the DB session used by this request so that concurrent requests never share one.
+    :param exception: Exception that ended the request, if any.
+    """
+    manager.remove_session()
+
+
 @app.route("/")
 def index():
+    node_state_counts = manager.get_node_state_counts()
+    num_active_trials = manager.get_num_active_trials()
 
     dashboards = {"Dashboards":
         [
@@ -45,10 +57,10 @@ def index():
                      }
             },
             "data": {
-                    "launched": 1,
-                    "ready": 2,
-                    "expired": 3,
-                    "deleted": 4
+                    "launched": node_state_counts.get("launched", 0),
+                    "ready": node_state_counts.get("ready", 0),
+                    "expired": node_state_counts.get("expired", 0),
+                    "deleted": node_state_counts.get("deleted", 0)
                 }
             },
 
@@ -62,7 +74,7 @@ def index():
                  "center_color": "#DDDF0D",   # yellow
                  "max_color": "#55BF3B"       # green
              },
-             "data": {"min": 0, "max": 10, "value": 3}
+             "data": {"min": 0, "max": max(10, num_active_trials), "value": num_active_trials}
             },
         ]
     }
@@ -70,31 +82,96 @@ def index():
     return render_template("index.html", dashboard_json=dashboard_json)
 
 
+def _get_trials_start_date(start_date_epoch_sec):
+    """
+    Get the start date to show trials from.
+    :param start_date_epoch_sec: Start date in epoch secs, or 0 to default to the last 7 days.
+    :return: Return a Python DateTime object in UTC.
+    """
+    if start_date_epoch_sec > 0:
+        return Conversion.unix_time_sec_to_dt(start_date_epoch_sec)
+    return datetime.utcnow() - timedelta(days=7)
+
+
+def _page_to_json(rows, next_cursor):
+    """
+    Serialize one page of objects returned by a get_page classmethod.
+    :param rows: List of objects
+    :param next_cursor: Cursor (int) of the next page, or None if this is the last page.
+    :return: Return a JSON string
+    """
+    response = {
+        "items": [row.to_dict() for row in rows],
+        "next_cursor": next_cursor
+    }
+    return json.dumps(response, default=str)
+
+
 @app.route("/resources")
 @validate_params(
     Param("status", GET, str, required=False, default=lambda: None),
-    Param("msg", GET, str, required=False, default=lambda: None)
+    Param("msg", GET, str, required=False, default=lambda: None),
+    Param("node_cursor", GET, int, required=False, default=lambda: None),
+    Param("cluster_cursor", GET, int, required=False, default=lambda: None),
+    Param("limit", GET, int, required=False, default=lambda: None)
 )
-def resources(status, msg):
+def resources(status, msg, node_cursor, cluster_cursor, limit):
     """
-    For each type of resource (node, cluster), show a list of the available/relevant ones.
+    For each type of resource (node, cluster), show a page of the available/relevant ones.
     If got to this page via a redirect from /manage_resource, then will have a status and msg variable
     indicating if was able to perform that action.
     :param status: Optional, status as either "success" or "error".
     :param msg: Optional, message to show based on the last action.
+    :param node_cursor: Optional, cursor of the page of Nodes to show.
+    :param cluster_cursor: Optional, cursor of the page of Clusters to show.
+    :param limit: Optional, number of Nodes and Clusters per page.
     """
-    nodes = manager.get_relevant_nodes()
-    # Generate a dictionary from each state to the number of occurrences
-    node_states = [node.state for node in nodes]
-    node_state_counts = {s: node_states.count(s) for s in node_states}
-
-    clusters = manager.get_relevant_clusters()
-    # Generate a dictionary from each state to the number of occurrences
-    cluster_states = [cluster.state for cluster in clusters]
-    cluster_state_counts = {s: cluster_states.count(s) for s in cluster_states}
-    return render_template("resources.html", status=status, msg=msg,
+    nodes, node_next_cursor = manager.get_relevant_nodes_page(node_cursor, limit)
+    # Dictionary from each state to the number of occurrences, computed by the DB
+    node_state_counts = manager.get_relevant_node_state_counts()
+
+    clusters, cluster_next_cursor = manager.get_relevant_clusters_page(cluster_cursor, limit)
+    # Dictionary from each state to the number of occurrences, computed by the DB
+    cluster_state_counts = manager.get_relevant_cluster_state_counts()
+    return render_template("resources.html", status=status, msg=msg, limit=limit,
                            nodes=nodes, node_state_counts=node_state_counts,
-                           clusters=clusters, cluster_state_counts=cluster_state_counts)
+                           node_cursor=node_cursor, node_next_cursor=node_next_cursor,
+                           clusters=clusters, cluster_state_counts=cluster_state_counts,
+                           cluster_cursor=cluster_cursor, cluster_next_cursor=cluster_next_cursor)
+
+
+# E.g., http://127.0.0.1:5000/api/nodes?cursor=100&limit=50
+@app.route("/api/nodes", methods=["GET"])
+@validate_params(
+    Param("cursor", GET, int, required=False, default=lambda: None),
+    Param("limit", GET, int, required=False, default=lambda: None)
+)
+def api_nodes(cursor, limit):
+    """
+    Get a page of the relevant Nodes as JSON.
+    :param cursor: Optional, the next_cursor returned by the previous page.
+    :param limit: Optional, number of Nodes per page.
+    :return: Return JSON with the "items" and the "next_cursor", which is null on the last page.
+    """
+    nodes, next_cursor = manager.get_relevant_nodes_page(cursor, limit)
+    return _page_to_json(nodes, next_cursor)
+
+
+# E.g., http://127.0.0.1:5000/api/clusters?cursor=100&limit=50
+@app.route("/api/clusters", methods=["GET"])
+@validate_params(
+    Param("cursor", GET, int, required=False, default=lambda: None),
+    Param("limit", GET, int, required=False, default=lambda: None)
+)
+def api_clusters(cursor, limit):
+    """
+    Get a page of the relevant Clusters as JSON.
+    :param cursor: Optional, the next_cursor returned by the previous page.
+    :param limit: Optional, number of Clusters per page.
+    :return: Return JSON with the "items" and the "next_cursor", which is null on the last page.
+    """
+    clusters, next_cursor = manager.get_relevant_clusters_page(cursor, limit)
+    return _page_to_json(clusters, next_cursor)
 
 # http://127.0.0.1:5000/manage_resource?resource_type=cluster&resource_id=1&action=expire
 @app.route("/manage_resource", methods=["GET"])
@@ -195,25 +272,49 @@ def check_request():
 
 @app.route("/trials", methods=["GET"])
 @validate_params(
-    Param("start_date_epoch_sec", GET, int, required=False, default=lambda: 0)
+    Param("start_date_epoch_sec", GET, int, required=False, default=lambda: 0),
+    Param("cursor", GET, int, required=False, default=lambda: None),
+    Param("limit", GET, int, required=False, default=lambda: None)
 )
-def trials(start_date_epoch_sec):
+def trials(start_date_epoch_sec, cursor, limit):
     """
-    Get all active and relevant trials.
+    Get a page of the active and relevant trials.
     :param start_date_epoch_sec: Optional, start date in epoch secs.
+    :param cursor: Optional, cursor of the page of trials to show.
+    :param limit: Optional, number of trials per page.
     :return: Render the trials.html page.
     """
-    if start_date_epoch_sec > 0:
-        start_date = Conversion.unix_time_sec_to_dt(start_date_epoch_sec)
-    else:
-        start_date = datetime.utcnow() - timedelta(days=7)
+    start_date = _get_trials_start_date(start_date_epoch_sec)
+
+    trials, next_cursor = manager.get_relevant_trials_page(start_date, cursor, limit)
 
-    trials = manager.get_relevant_trials(start_date)
+    # Dictionary from each state to the number of occurrences, computed by the DB
+    state_counts = manager.get_relevant_trial_state_counts(start_date)
+    # Keep the same start date when paging even if it was defaulted
+    start_date_epoch_sec = Conversion.dt_to_unix_time_sec(start_date)
+    return render_template("trials.html", start_date=start_date, trials=trials, state_counts=state_counts,
+                           start_date_epoch_sec=start_date_epoch_sec, cursor=cursor, next_cursor=next_cursor,
+                           limit=limit)
 
-    # Generate a dictionary from each state to the number of occurrences
-    states = [trial.state for trial in trials]
-    state_counts = {s: states.count(s) for s in states}
-    return render_template("trials.html", start_date=start_date, trials=trials, state_counts=state_counts)
+
+# E.g., http://127.0.0.1:5000/api/trials?start_date_epoch_sec=1582000000&cursor=100&limit=50
+@app.route("/api/trials", methods=["GET"])
+@validate_params(
+    Param("start_date_epoch_sec", GET, int, required=False, default=lambda: 0),
+    Param("cursor", GET, int, required=False, default=lambda: None),
+    Param("limit", GET, int, required=False, default=lambda: None)
+)
+def api_trials(start_date_epoch_sec, cursor, limit):
+    """
+    Get a page of the active and relevant trials as JSON.
+    :param start_date_epoch_sec: Optional, start date in epoch secs.
+    :param cursor: Optional, the next_cursor returned by the previous page.
+    :param limit: Optional, number of trials per page.
+    :return: Return JSON with the "items" and the "next_cursor", which is null on the last page.
+    """
+    start_date = _get_trials_start_date(start_date_epoch_sec)
+    trials, next_cursor = manager.get_relevant_trials_page(start_date, cursor, limit)
+    return _page_to_json(trials, next_cursor)
 
 
 @app.route("/health")